@@ -0,0 +1,210 @@
+"""
+    Offline benchmark of the fetch engines against a local mock server farm.
+
+    Run with `python -m benchmarks.bench --help`. Each run scans the same
+    farm urls in a fresh process and records its throughput, latency
+    percentiles, peak RSS and CPU time. The results are written as JSON to
+    track regressions between commits.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Literal
+
+import tyro
+from pydantic import BaseModel
+
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.nyfitsa import (Timeouts, get_error_key,
+                             scan_urls_concurrently)
+from nyfitsa.session import SessionPool
+
+from .farm import FarmConfig, MockFarm
+
+Engine = Literal["threads", "async"]
+
+
+class BenchConfig(BaseModel):
+    urls: int = 2000
+    """Number of sites scanned by each run"""
+
+    engines: List[Engine] = ["threads", "async"]
+    """Engines to benchmark"""
+
+    threads: List[int] = [8, 32]
+    """Worker counts of the threads engine"""
+
+    concurrency: List[int] = [100, 500]
+    """Requests in flight of the async engine"""
+
+    repeat: int = 1
+    """Runs per engine and worker count"""
+
+    timeout: float = 10
+    """Connect and read timeouts of the engines in seconds"""
+
+    output: Path = Path("benchmark.json")
+    """JSON file receiving the results"""
+
+    farm: FarmConfig = FarmConfig()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process so far, in bytes."""
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0.0
+    index: int = min(int(q / 100 * len(values)), len(values) - 1)
+    return values[index]
+
+
+def run_once(
+        engine: Engine,
+        workers: int,
+        urls: List[str],
+        timeout: float,
+        ) -> Dict[str, Any]:
+    """
+        Scans `urls` once and returns the measurements. Latency is the time
+        from when the engine takes a url from its input to when the result
+        of the url is delivered.
+    """
+    started: Dict[str, float] = {}
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    def source() -> Iterator[str]:
+        for url in urls:
+            started[url] = time.perf_counter()
+            yield url
+
+    def on_result(result: Dict[str, Any]) -> None:
+        latencies.append(time.perf_counter() - started.pop(result["url"]))
+        if result["err_code"] is not None:
+            key: str = get_error_key(result["err_code"])
+            errors[key] = errors.get(key, 0) + 1
+
+    session = SessionPool(pool_maxsize=workers)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start: float = time.perf_counter()
+    if engine == "async":
+        scan_urls_async(source(), on_result, workers, timeout,
+                        session=session)
+    else:
+        scan_urls_concurrently(source(), on_result, session=session,
+                               workers=workers,
+                               timeouts=Timeouts(timeout, timeout))
+    elapsed: float = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    session.close()
+
+    cpu: float = (after.ru_utime - before.ru_utime) + \
+        (after.ru_stime - before.ru_stime)
+    latencies.sort()
+    return {
+        "engine": engine,
+        "workers": workers,
+        "urls": len(urls),
+        "seconds": round(elapsed, 3),
+        "urls_per_sec": round(len(urls) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss() / 2**20, 1),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(cpu / elapsed * 100, 1),
+        "errors": errors,
+    }
+
+
+def _run_in_child(
+        queue: Any,
+        function: Callable[..., Dict[str, Any]],
+        *args: Any,
+        ) -> None:
+    queue.put(function(*args))
+
+
+def isolated(
+        function: Callable[..., Dict[str, Any]],
+        *args: Any,
+        ) -> Dict[str, Any]:
+    """
+        Runs `function(*args)` in a fresh process, so peak RSS is its own,
+        and returns its measurements. `function` is a module-level function.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue: Any = context.Queue()
+    process = context.Process(
+        target=_run_in_child, args=(queue, function, *args)
+        )
+    # No progress bars in the measurements
+    disable: str | None = os.environ.get("TQDM_DISABLE")
+    os.environ["TQDM_DISABLE"] = "1"
+    try:
+        process.start()
+    finally:
+        if disable is None:
+            del os.environ["TQDM_DISABLE"]
+        else:
+            os.environ["TQDM_DISABLE"] = disable
+    result: Dict[str, Any] = queue.get()
+    process.join()
+    return result
+
+
+def run_isolated(
+        engine: Engine,
+        workers: int,
+        urls: List[str],
+        timeout: float,
+        ) -> Dict[str, Any]:
+    """Runs `run_once` in a fresh process."""
+    return isolated(run_once, engine, workers, urls, timeout)
+
+
+def run_benchmark(config: BenchConfig) -> Dict[str, Any]:
+    runs: List[Dict[str, Any]] = []
+    matrix: Dict[Engine, List[int]] = {
+        "threads": config.threads, "async": config.concurrency,
+        }
+    with MockFarm(config.farm) as farm:
+        urls: List[str] = farm.urls(config.urls)
+        for engine in config.engines:
+            for workers in matrix[engine]:
+                for _ in range(config.repeat):
+                    result = run_isolated(
+                        engine, workers, urls, config.timeout
+                        )
+                    print(json.dumps(result))
+                    runs.append(result)
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config.model_dump(mode="json"),
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    config = tyro.cli(BenchConfig)
+    report: Dict[str, Any] = run_benchmark(config)
+    config.output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {config.output}")
+
+
+if __name__ == "__main__":
+    main()
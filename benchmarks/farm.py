@@ -0,0 +1,205 @@
+import asyncio
+import multiprocessing
+import random
+import socket
+import struct
+from multiprocessing.process import BaseProcess
+from types import TracebackType
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+# Header mixes served by the farm, picked per site with `header_mix`
+PROFILES: Dict[str, Dict[str, str]] = {
+    "nginx": {
+        "Server": "nginx/1.18.0",
+        "X-Frame-Options": "DENY",
+        "X-Content-Type-Options": "nosniff",
+        "Referrer-Policy": "no-referrer",
+        "X-XSS-Protection": "1; mode=block",
+    },
+    "apache": {
+        "Server": "Apache/2.4.41 (Ubuntu)",
+        "X-Frame-Options": "SAMEORIGIN",
+    },
+    "cloudflare": {
+        "Server": "cloudflare",
+        "X-Content-Type-Options": "nosniff",
+        "Referrer-Policy": "strict-origin-when-cross-origin",
+    },
+    "iis": {
+        "Server": "Microsoft-IIS/10.0",
+        "X-XSS-Protection": "0",
+    },
+    "bare": {},
+}
+
+ERROR_CODES: Tuple[int, ...] = (500, 502, 503)
+BODY: bytes = b"x" * 512
+
+
+class FarmConfig(BaseModel):
+    servers: int = 4
+    """Number of servers, each one is a distinct host:port"""
+
+    latency: float = 0.02
+    """Mean time in seconds before a response is sent"""
+
+    jitter: float = 0.01
+    """Latency varies uniformly by up to this many seconds"""
+
+    timeout_rate: float = 0.0
+    """Share of sites that never answer (the clients time out)"""
+
+    hang: float = 30.0
+    """Seconds a site that never answers keeps the connection open"""
+
+    reset_rate: float = 0.01
+    """Share of sites that reset the connection"""
+
+    error_rate: float = 0.02
+    """Share of sites answering with a 5xx status"""
+
+    header_mix: Dict[str, float] = {
+        "nginx": 0.35, "apache": 0.3, "cloudflare": 0.2, "iis": 0.1,
+        "bare": 0.05,
+    }
+    """Weight of each header profile of PROFILES"""
+
+    seed: int = 0
+    """Seed of the per-site behaviour, the same seed serves the same sites"""
+
+
+def site_behaviour(config: FarmConfig, site: str) -> Tuple[str, float, Any]:
+    """
+        Deterministic behaviour of a site: ("hang" | "reset" | "error" |
+        "ok", latency, status or headers).
+    """
+    rng = random.Random(f"{config.seed}:{site}")
+    latency: float = max(
+        config.latency + rng.uniform(-config.jitter, config.jitter), 0.0
+        )
+    roll: float = rng.random()
+    if roll < config.timeout_rate:
+        return "hang", config.hang, None
+    roll -= config.timeout_rate
+    if roll < config.reset_rate:
+        return "reset", latency, None
+    roll -= config.reset_rate
+    if roll < config.error_rate:
+        return "error", latency, rng.choice(ERROR_CODES)
+    profile: str = rng.choices(
+        list(config.header_mix), list(config.header_mix.values())
+        )[0]
+    return "ok", latency, PROFILES[profile]
+
+
+def _response(status: int, headers: Dict[str, str], body: bytes) -> bytes:
+    lines: List[str] = [f"HTTP/1.1 {status} X"]
+    lines += [f"{key}: {value}" for key, value in headers.items()]
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def _handle(
+        config: FarmConfig,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        ) -> None:
+    try:
+        while True:
+            head: bytes = await reader.readuntil(b"\r\n\r\n")
+            method, path = head.split(b" ", 2)[:2]
+            kind, latency, detail = site_behaviour(
+                config, path.decode("latin-1")
+                )
+            await asyncio.sleep(latency)
+            if kind == "hang":
+                break
+            if kind == "reset":
+                # Linger 0: close() sends a RST instead of a FIN
+                sock: socket.socket = writer.get_extra_info("socket")
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                struct.pack("ii", 1, 0))
+                break
+            status, headers = (detail, {}) if kind == "error" \
+                else (200, detail)
+            body: bytes = b"" if method == b"HEAD" else BODY
+            writer.write(_response(status, headers, body))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(config: FarmConfig, ports: Any) -> None:
+    servers: List[asyncio.Server] = [
+        await asyncio.start_server(
+            lambda r, w: _handle(config, r, w), "127.0.0.1", 0, backlog=4096
+            )
+        for _ in range(max(config.servers, 1))
+    ]
+    ports.put([server.sockets[0].getsockname()[1] for server in servers])
+    await asyncio.Event().wait()
+
+
+def _run(config: FarmConfig, ports: Any) -> None:
+    asyncio.run(_serve(config, ports))
+
+
+class MockFarm():
+    """
+        Local HTTP server farm standing in for real sites in benchmarks.
+
+        The servers run on asyncio in their own process, so that their CPU
+        and memory are not counted in the measurements of the client. Each
+        site answers after a configurable latency with one of the header
+        profiles, or fails with a 5xx, a connection reset or no answer.
+        The behaviour of a site only depends on its path and on the seed,
+        so runs are reproducible. Used as a context manager.
+
+        Methods
+        -------
+        urls(count: int) -> List[str]
+            Urls of `count` distinct sites, spread over the servers.
+    """
+
+    def __init__(self, config: FarmConfig | None = None) -> None:
+        self.config = config or FarmConfig()
+        self.ports: List[int] = []
+        self._process: BaseProcess | None = None
+
+    def start(self) -> None:
+        context = multiprocessing.get_context("spawn")
+        ports: Any = context.Queue()
+        self._process = context.Process(
+            target=_run, args=(self.config, ports), daemon=True
+            )
+        self._process.start()
+        self.ports = ports.get(timeout=30)
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def urls(self, count: int) -> List[str]:
+        return [
+            f"http://127.0.0.1:{self.ports[i % len(self.ports)]}/site/{i}"
+            for i in range(count)
+        ]
+
+    def __enter__(self) -> "MockFarm":
+        self.start()
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc: BaseException | None,
+            traceback: TracebackType | None,
+            ) -> None:
+        self.stop()
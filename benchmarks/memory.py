@@ -0,0 +1,106 @@
+"""
+    Memory benchmark: peak RSS of a scan as the number of urls grows.
+
+    Run with `python -m benchmarks.memory --help`. Each run scans the farm
+    in a fresh process and keeps every site in memory, like the command
+    line without --stream. The urls are generated inside the process, so
+    only what the scan keeps is measured. A flat bytes/url across counts
+    means the results are compact and nothing else is kept per url.
+"""
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import tyro
+from pydantic import BaseModel
+
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.nyfitsa import Results, scan_urls_concurrently
+from nyfitsa.session import SessionPool
+
+from .bench import Engine, isolated, peak_rss
+from .farm import FarmConfig, MockFarm
+
+
+class MemoryConfig(BaseModel):
+    counts: List[int] = [1000, 5000, 20000]
+    """Numbers of urls scanned, one run each"""
+
+    engine: Engine = "threads"
+    """Engine used by the runs"""
+
+    workers: int = 32
+    """Threads, or requests in flight with the async engine"""
+
+    keep_headers: bool = False
+    """Keep the raw headers of each site, as --keep-headers does"""
+
+    output: Path = Path("memory.json")
+    """JSON file receiving the results"""
+
+    farm: FarmConfig = FarmConfig(latency=0.001, jitter=0.0)
+
+
+def measure(
+        engine: Engine,
+        workers: int,
+        ports: List[int],
+        count: int,
+        keep_headers: bool,
+        ) -> Dict[str, Any]:
+    """Scans `count` farm urls and returns the peak RSS of the scan."""
+    def urls() -> Iterator[str]:
+        for index in range(count):
+            yield f"http://127.0.0.1:{ports[index % len(ports)]}" \
+                f"/site/{index}"
+
+    results = Results(site_infos=[])
+    session = SessionPool(pool_maxsize=workers)
+    baseline: int = peak_rss()
+    start: float = time.perf_counter()
+    if engine == "async":
+        scan_urls_async(urls(), results.add_site, workers, session=session,
+                        keep_headers=keep_headers)
+    else:
+        scan_urls_concurrently(urls(), results.add_site, session=session,
+                               workers=workers, keep_headers=keep_headers)
+    elapsed: float = time.perf_counter() - start
+    session.close()
+    peak: int = peak_rss()
+
+    assert len(results.site_infos) == count
+    return {
+        "engine": engine,
+        "urls": count,
+        "keep_headers": keep_headers,
+        "seconds": round(elapsed, 3),
+        "baseline_rss_mb": round(baseline / 2**20, 1),
+        "peak_rss_mb": round(peak / 2**20, 1),
+        "growth_mb": round((peak - baseline) / 2**20, 2),
+        "bytes_per_url": round((peak - baseline) / count),
+    }
+
+
+def run_memory_benchmark(config: MemoryConfig) -> Dict[str, Any]:
+    runs: List[Dict[str, Any]] = []
+    with MockFarm(config.farm) as farm:
+        for count in config.counts:
+            result: Dict[str, Any] = isolated(
+                measure, config.engine, config.workers, farm.ports, count,
+                config.keep_headers,
+                )
+            print(json.dumps(result))
+            runs.append(result)
+    return {"config": config.model_dump(mode="json"), "runs": runs}
+
+
+def main() -> None:
+    config = tyro.cli(MemoryConfig)
+    report: Dict[str, Any] = run_memory_benchmark(config)
+    config.output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {config.output}")
+
+
+if __name__ == "__main__":
+    main()
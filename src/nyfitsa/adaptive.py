@@ -0,0 +1,155 @@
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from .nyfitsa import ErrorCode, ScanSummary
+
+# Errors signalling that the scan itself overloads the network or the hosts
+CONGESTION_ERRORS = (ErrorCode.TIMEOUT, ErrorCode.CONNECTION_ERROR)
+# Throughput changes smaller than this are noise
+TOLERANCE: float = 0.05
+# Weight of the last window in the baseline error rate
+BASELINE_WEIGHT: float = 0.2
+# Windows kept in `trajectory`, all of them are passed to `on_step`
+TRAJECTORY_SIZE: int = 1000
+
+
+class AdaptiveConcurrency():
+    """
+        AIMD controller of the number of requests in flight.
+
+        The engines ask `limit` before starting a fetch and `record` each
+        result. Every `interval` seconds (and at least `min_samples`
+        results), the last window is compared with the previous one:
+
+        - timeouts and connection errors above the baseline error rate by
+          more than `error_margin`: the limit is multiplied by `backoff`
+        - throughput up: the limit grows by `step`
+        - throughput down: the limit shrinks by `step`
+        - otherwise the limit holds, and after `probe_after` windows held
+          in a row it grows by `step` anyway, to find out whether more
+          requests in flight would now go faster
+
+        The baseline is a moving average of the error rate, so sites that
+        are always down do not keep the limit low. Each window is passed to
+        `on_step`, and the last TRAJECTORY_SIZE are kept in `trajectory`.
+        Not thread-safe: fed by the loop of the engine.
+
+        Attributes
+        ----------
+        limit : int
+            Current number of requests allowed in flight.
+        peak : int
+            Highest limit reached.
+        trajectory : List[Dict[str, Any]]
+            One entry per recent window: "time" since the start, "limit"
+            set for the next window, "throughput" in urls per second,
+            "error_rate" and "action".
+        adjustments : int
+            Number of windows since the start.
+
+        Methods
+        -------
+        record(err_code: ErrorCode | None, now: float | None = None)
+                -> None
+            Counts a result and adjusts the limit at the end of a window.
+
+        report(summary: ScanSummary) -> None
+            Copies the final and peak limits into the run summary.
+    """
+
+    def __init__(
+            self,
+            maximum: int,
+            minimum: int = 1,
+            initial: int | None = None,
+            step: int | None = None,
+            backoff: float = 0.5,
+            error_margin: float = 0.1,
+            interval: float = 1.0,
+            min_samples: int = 20,
+            probe_after: int = 5,
+            on_step: Callable[[Dict[str, Any]], None] | None = None,
+            ) -> None:
+        self.maximum = max(maximum, 1)
+        self.minimum = min(max(minimum, 1), self.maximum)
+        self.limit: int = min(
+            max(initial or self.maximum // 8, self.minimum), self.maximum
+            )
+        self.step: int = step or max(self.maximum // 32, 1)
+        self.backoff = backoff
+        self.error_margin = error_margin
+        self.interval = interval
+        self.min_samples = min_samples
+        self.probe_after = max(probe_after, 1)
+        self.on_step = on_step
+        self.peak: int = self.limit
+        self.trajectory: List[Dict[str, Any]] = []
+        self.adjustments: int = 0
+        self._held: int = 0
+        self._start: float = time.monotonic()
+        self._window_start: float = self._start
+        self._done: int = 0
+        self._errors: int = 0
+        self._throughput: float | None = None
+        self._baseline: float | None = None
+
+    def record(
+            self,
+            err_code: ErrorCode | None,
+            now: float | None = None,
+            ) -> None:
+        self._done += 1
+        if err_code in CONGESTION_ERRORS:
+            self._errors += 1
+        now = time.monotonic() if now is None else now
+        if now - self._window_start >= self.interval and \
+                self._done >= self.min_samples:
+            self._adjust(now)
+
+    def _adjust(self, now: float) -> None:
+        throughput: float = self._done / max(now - self._window_start, 1e-6)
+        error_rate: float = self._errors / self._done
+        baseline: float = error_rate if self._baseline is None \
+            else self._baseline
+        action: str = "hold"
+        if error_rate > baseline + self.error_margin:
+            self.limit = max(int(self.limit * self.backoff), self.minimum)
+            action = "backoff"
+        elif self._throughput is None or \
+                throughput > self._throughput * (1 + TOLERANCE):
+            self.limit = min(self.limit + self.step, self.maximum)
+            action = "increase"
+        elif throughput < self._throughput * (1 - TOLERANCE):
+            self.limit = max(self.limit - self.step, self.minimum)
+            action = "decrease"
+        elif self._held + 1 >= self.probe_after and \
+                self.limit < self.maximum:
+            self.limit = min(self.limit + self.step, self.maximum)
+            action = "probe"
+        self._held = self._held + 1 if action == "hold" else 0
+        self.peak = max(self.peak, self.limit)
+        self._baseline = baseline + BASELINE_WEIGHT * (error_rate - baseline)
+        self._throughput = throughput
+        self._window_start = now
+        self._done = self._errors = 0
+
+        step: Dict[str, Any] = {
+            "time": round(now - self._start, 3),
+            "pid": os.getpid(),
+            "limit": self.limit,
+            "throughput": round(throughput, 1),
+            "error_rate": round(error_rate, 3),
+            "action": action,
+        }
+        self.adjustments += 1
+        self.trajectory.append(step)
+        if len(self.trajectory) > TRAJECTORY_SIZE:
+            del self.trajectory[0]
+        if self.on_step is not None:
+            self.on_step(step)
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("concurrency_final", self.limit)
+        summary.set("concurrency_peak", self.peak)
+        summary.set("concurrency_adjustments", self.adjustments)
@@ -0,0 +1,646 @@
+import asyncio
+import socket
+import ssl
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Sized, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests import structures
+from tqdm import tqdm
+
+from .adaptive import AdaptiveConcurrency
+from .cache import CacheEntry, HeaderCache
+from .metrics import ScanMetrics
+from .nyfitsa import (HEAD_REJECTED_CODES, ErrorCode, FetchMode, Results,
+                      ScanSummary, SiteStore, Timeouts, content_length,
+                      fetch_validators, http_error_details,
+                      parse_site_headers, skipped)
+from .resolver import ResolverCache
+from .retry import RetryPolicy
+from .scheduler import InputScheduler, make_scheduler
+from .session import SessionPool
+
+MAX_REDIRECTS: int = 30
+REDIRECT_CODES: Tuple[int, ...] = (301, 302, 303, 307, 308)
+MAX_HEADERS_SIZE: int = 256 * 1024
+# Bodies up to this size are read and dropped to keep the connection alive
+DRAIN_LIMIT: int = 64 * 1024
+
+Origin = Tuple[str, str, int]
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class HeadersResponse():
+    """
+        Minimal response returned by the asyncio engine.
+
+        Only the status line and the headers are read from the server,
+        the body is never downloaded, whatever the request method, unless
+        it is small enough to be drained to reuse a keep-alive connection.
+
+        Attributes
+        ----------
+        url : str
+            The URL that produced this response, after redirects.
+        status_code : int
+            The HTTP status code.
+        headers : CaseInsensitiveDict[str]
+            The response headers.
+        body_read : bool
+            True if the body was drained from the connection.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            status_code: int,
+            headers: structures.CaseInsensitiveDict[str],
+            body_read: bool = False,
+            ) -> None:
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body_read = body_read
+
+
+def _default_ssl_context() -> ssl.SSLContext:
+    # Same CA bundle as requests so both engines trust the same sites
+    return ssl.create_default_context(cafile=requests.certs.where())
+
+
+def _build_request(method: str, host: str, port: int, scheme: str,
+                   target: str, keep_alive: bool = False,
+                   extra: Dict[str, str] | None = None) -> bytes:
+    default_port: int = 443 if scheme == "https" else 80
+    host_header: str = host if port == default_port else f"{host}:{port}"
+    headers: structures.CaseInsensitiveDict[str] = \
+        requests.utils.default_headers()
+    headers["Host"] = host_header
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    headers.update(extra or {})
+    lines: List[str] = [f"{method} {target} HTTP/1.1"]
+    lines += [f"{key}: {value}" for key, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _parse_head(raw: bytes) -> Tuple[int, structures.CaseInsensitiveDict[str]]:
+    lines: List[str] = raw.decode("latin-1").split("\r\n")
+    status_line: List[str] = lines[0].split(None, 2)
+    if len(status_line) < 2 or not status_line[0].startswith("HTTP/"):
+        raise ConnectionError(f"Invalid status line: {lines[0]!r}")
+    status_code: int = int(status_line[1])
+
+    headers: structures.CaseInsensitiveDict[str] = \
+        structures.CaseInsensitiveDict()
+    for line in lines[1:]:
+        if not line or line[0] in " \t" or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        key, value = key.strip(), value.strip()
+        # Repeated headers are folded like urllib3 does for requests
+        if key in headers:
+            headers[key] = f"{headers[key]}, {value}"
+        else:
+            headers[key] = value
+    return status_code, headers
+
+
+def _body_length(
+        method: str,
+        status_code: int,
+        headers: structures.CaseInsensitiveDict[str],
+        ) -> int | None:
+    """Length of the body to drain, None if it cannot be delimited."""
+    if method == "HEAD" or status_code in (204, 304):
+        return 0
+    if "transfer-encoding" in headers:
+        return None
+    length: str = headers.get("content-length", "")
+    return int(length) if length.isdigit() else None
+
+
+class AsyncConnectionPool():
+    """
+        Keep-alive connections of the asyncio engine.
+
+        Uses the limits of a `SessionPool` and records its hits and misses
+        in it, so both engines report the same pool counters.
+    """
+
+    def __init__(self, session: SessionPool) -> None:
+        self.session = session
+        self._idle: OrderedDict[Origin, List[Connection]] = OrderedDict()
+        self._slots: asyncio.Semaphore | None = (
+            asyncio.Semaphore(session.max_connections)
+            if session.max_connections else None
+            )
+
+    async def acquire(self) -> None:
+        if self._slots is not None:
+            await self._slots.acquire()
+
+    def release(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+    def get(self, origin: Origin) -> Connection | None:
+        connections: List[Connection] = self._idle.get(origin, [])
+        while connections:
+            reader, writer = connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.session.record(True)
+                return reader, writer
+            writer.close()
+        return None
+
+    def put(self, origin: Origin, connection: Connection) -> None:
+        connections: List[Connection] = self._idle.setdefault(origin, [])
+        self._idle.move_to_end(origin)
+        if len(connections) >= self.session.pool_maxsize:
+            connection[1].close()
+        else:
+            connections.append(connection)
+        # Close the pools of the least recently used hosts
+        while len(self._idle) > self.session.max_hosts:
+            _, evicted = self._idle.popitem(last=False)
+            for _, writer in evicted:
+                writer.close()
+
+    def close(self) -> None:
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncClient():
+    """
+        Shared state of the asyncio engine for a whole scan.
+
+        Attributes
+        ----------
+        timeouts : Timeouts
+            Timeouts in seconds for connecting, for each read and for a
+            whole request. A single number is used for connecting and for
+            each read, like the `timeout` argument of requests.
+        summary : ScanSummary | None
+            Run summary receiving the engine counters.
+        pool : AsyncConnectionPool | None
+            Keep-alive connections, None to open a connection per request.
+        cache : HeaderCache | None
+            Header cache, fresh entries are served without any request.
+        resolver : ResolverCache | None
+            DNS cache of the session, shared with the threads engine.
+        metrics : ScanMetrics | None
+            Timings of the session, shared with the threads engine.
+        keep_headers : bool
+            Keep the raw headers of each response in its result, for
+            debugging.
+
+        Methods
+        -------
+        fetch(url: str, method: str = "GET",
+              headers: Dict[str, str] | None = None) -> HeadersResponse
+            Sends a request and follows redirects, reading only headers.
+    """
+
+    def __init__(
+            self,
+            timeout: float | Timeouts = 10,
+            summary: ScanSummary | None = None,
+            session: SessionPool | None = None,
+            cache: HeaderCache | None = None,
+            keep_headers: bool = False,
+            ) -> None:
+        self.keep_headers = keep_headers
+        self.timeouts: Timeouts = timeout if isinstance(timeout, Timeouts) \
+            else Timeouts(timeout, timeout)
+        self.summary = summary
+        self.cache = cache
+        self.ssl_context: ssl.SSLContext = _default_ssl_context()
+        self.pool: AsyncConnectionPool | None = (
+            AsyncConnectionPool(session) if session is not None else None
+            )
+        self.resolver: ResolverCache | None = (
+            session.resolver if session is not None else None
+            )
+        self.metrics: ScanMetrics | None = (
+            session.metrics if session is not None else None
+            )
+
+    async def _connect(
+            self,
+            scheme: str,
+            host: str,
+            address: str,
+            port: int,
+            ) -> Connection:
+        start: float = time.perf_counter()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port, limit=MAX_HEADERS_SIZE),
+            self.timeouts.connect,
+        )
+        connected: float = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.record("connect", connected - start)
+        if scheme != "https":
+            return reader, writer
+        # TLS is negotiated apart from the TCP connection to time it
+        try:
+            await asyncio.wait_for(
+                writer.start_tls(self.ssl_context, server_hostname=host),
+                self.timeouts.connect,
+            )
+        except BaseException:
+            writer.close()
+            raise
+        if self.metrics is not None:
+            self.metrics.record("tls", time.perf_counter() - connected)
+        return reader, writer
+
+    async def _open(self, scheme: str, host: str, port: int) -> Connection:
+        if self.resolver is None:
+            # The resolution is part of "connect"
+            return await self._connect(scheme, host, host, port)
+        start: float = time.perf_counter()
+        addresses: List[str] = await asyncio.wait_for(
+            self.resolver.resolve_async(host), self.timeouts.connect
+            )
+        if self.metrics is not None:
+            self.metrics.record("dns", time.perf_counter() - start)
+        last: OSError = OSError(f"No address for {host}")
+        # Next address when one refuses, not after a timeout
+        for address in addresses:
+            try:
+                return await self._connect(scheme, host, address, port)
+            except (asyncio.TimeoutError, ssl.SSLError):
+                raise
+            except OSError as error:
+                last = error
+        raise last
+
+    async def _exchange(
+            self,
+            connection: Connection,
+            request: bytes,
+            method: str,
+            ) -> Tuple[int, structures.CaseInsensitiveDict[str], bool]:
+        reader, writer = connection
+        start: float = time.perf_counter()
+        writer.write(request)
+        await asyncio.wait_for(writer.drain(), self.timeouts.read)
+        while True:
+            raw: bytes = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), self.timeouts.read
+                )
+            status_code, headers = _parse_head(raw)
+            # Skip interim responses such as 100 Continue
+            if not 100 <= status_code < 200:
+                break
+        if self.metrics is not None:
+            self.metrics.record("first_byte", time.perf_counter() - start)
+
+        if self.pool is None or not raw.startswith(b"HTTP/1.1") or \
+                headers.get("connection", "").lower() == "close":
+            return status_code, headers, False
+        length: int | None = _body_length(method, status_code, headers)
+        if length is None or length > DRAIN_LIMIT:
+            return status_code, headers, False
+        if length:
+            start = time.perf_counter()
+            await asyncio.wait_for(
+                reader.readexactly(length), self.timeouts.read
+                )
+            if self.metrics is not None:
+                self.metrics.record("body", time.perf_counter() - start)
+        return status_code, headers, True
+
+    async def request(
+            self,
+            url: str,
+            method: str = "GET",
+            extra: Dict[str, str] | None = None,
+            ) -> HeadersResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Invalid URL: {url!r}")
+        host: str = parts.hostname.encode("idna").decode("ascii")
+        port: int = parts.port or (443 if parts.scheme == "https" else 80)
+        target: str = (parts.path or "/") + (
+            f"?{parts.query}" if parts.query else ""
+            )
+        request: bytes = _build_request(
+            method, host, port, parts.scheme, target, self.pool is not None,
+            extra,
+            )
+
+        if self.pool is None:
+            connection: Connection = await self._open(
+                parts.scheme, host, port
+                )
+            try:
+                status_code, headers, _ = await self._exchange(
+                    connection, request, method
+                    )
+            finally:
+                connection[1].close()
+            return HeadersResponse(url, status_code, headers)
+
+        origin: Origin = (parts.scheme, host, port)
+        await self.pool.acquire()
+        try:
+            reused: Connection | None = self.pool.get(origin)
+            if reused is not None:
+                try:
+                    status_code, headers, keep = await self._exchange(
+                        reused, request, method
+                        )
+                    return self._keep(origin, reused, url, status_code,
+                                      headers, keep, method)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # The server closed the idle connection, try a new one
+                    reused[1].close()
+                except BaseException:
+                    # Including a cancellation by the total timeout, the
+                    # exchange may be half done
+                    reused[1].close()
+                    raise
+            connection = await self._open(parts.scheme, host, port)
+            self.pool.session.record(False)
+            try:
+                status_code, headers, keep = await self._exchange(
+                    connection, request, method
+                    )
+            except BaseException:
+                connection[1].close()
+                raise
+            return self._keep(origin, connection, url, status_code,
+                              headers, keep, method)
+        finally:
+            self.pool.release()
+
+    def _keep(
+            self,
+            origin: Origin,
+            connection: Connection,
+            url: str,
+            status_code: int,
+            headers: structures.CaseInsensitiveDict[str],
+            keep: bool,
+            method: str,
+            ) -> HeadersResponse:
+        assert self.pool is not None
+        if keep:
+            self.pool.put(origin, connection)
+        else:
+            connection[1].close()
+        body_read: bool = keep and method != "HEAD"
+        return HeadersResponse(url, status_code, headers, body_read)
+
+    async def fetch(
+            self,
+            url: str,
+            method: str = "GET",
+            headers: Dict[str, str] | None = None,
+            ) -> HeadersResponse:
+        if self.timeouts.total is None:
+            return await self._follow(url, method, headers)
+        return await asyncio.wait_for(
+            self._follow(url, method, headers), self.timeouts.total
+            )
+
+    async def _follow(
+            self,
+            url: str,
+            method: str,
+            headers: Dict[str, str] | None,
+            ) -> HeadersResponse:
+        for _ in range(MAX_REDIRECTS + 1):
+            response: HeadersResponse = await self.request(
+                url, method, headers
+                )
+            location: str | None = response.headers.get("location")
+            if response.status_code not in REDIRECT_CODES or not location:
+                return response
+            url = urljoin(url, location)
+        raise ConnectionError(f"Exceeded {MAX_REDIRECTS} redirects.")
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+
+
+async def fetch_single_site_infos_async(
+        url: str,
+        client: AsyncClient | None = None,
+        mode: FetchMode = "get",
+        ) -> Dict[str, Any]:
+    client = client or AsyncClient()
+    metrics: ScanMetrics | None = client.metrics
+    if metrics is None:
+        return await _fetch_site_infos_async(url, client, mode)
+    metrics.start()
+    start: float = time.perf_counter()
+    d: Dict[str, Any] = await _fetch_site_infos_async(url, client, mode)
+    metrics.finish(d["err_code"], time.perf_counter() - start)
+    return d
+
+
+async def _fetch_site_infos_async(
+        url: str,
+        client: AsyncClient,
+        mode: FetchMode,
+        ) -> Dict[str, Any]:
+    d: Dict[str, Any] = {"url": url}
+    method: str = "HEAD" if mode == "head" else "GET"
+    entry: CacheEntry | None = (
+        client.cache.lookup(str(url)) if client.cache is not None else None
+        )
+    if entry is not None and entry.fresh:
+        return d | entry.headers | {"err_code": None}
+    conditional: Dict[str, str] | None = (
+        entry.conditional_headers() if entry is not None else None
+        )
+    try:
+        response: HeadersResponse = await client.fetch(
+            str(url), method, conditional
+            )
+        if mode == "head" and response.status_code in HEAD_REJECTED_CODES:
+            response = await client.fetch(str(url), "GET", conditional)
+        if client.summary is not None and not response.body_read:
+            client.summary.add(
+                "bytes_saved",
+                content_length(response),  # type: ignore[arg-type]
+                )
+
+        if response.status_code >= 400:
+            d["err_code"] = ErrorCode.HTTP_ERROR
+            d |= http_error_details(response.status_code, response.headers)
+            return d
+
+        headers: Dict[str, str]
+        if response.status_code == 304 and entry is not None:
+            assert client.cache is not None
+            headers = entry.headers
+            client.cache.revalidate(
+                str(url),
+                **fetch_validators(response),  # type: ignore[arg-type]
+                )
+        else:
+            parsing: float = time.perf_counter()
+            headers = parse_site_headers(response)  # type: ignore[arg-type]
+            if client.metrics is not None:
+                client.metrics.record(
+                    "parse", time.perf_counter() - parsing
+                    )
+            if client.cache is not None:
+                client.cache.put(
+                    str(url),
+                    headers,
+                    **fetch_validators(response),  # type: ignore[arg-type]
+                    )
+        d |= headers
+        d["err_code"] = None
+        if client.keep_headers:
+            d["raw_headers"] = dict(response.headers)
+
+    except asyncio.TimeoutError:
+        d["err_code"] = ErrorCode.TIMEOUT
+
+    except socket.gaierror:
+        d["err_code"] = ErrorCode.DNS_ERROR
+
+    except (OSError, EOFError, ValueError, asyncio.LimitOverrunError,
+            UnicodeError):
+        d["err_code"] = ErrorCode.CONNECTION_ERROR
+
+    return d
+
+
+async def _fetch_all(
+        scheduler: InputScheduler,
+        on_result: Callable[[Dict[str, Any]], None],
+        concurrency: int,
+        client: AsyncClient,
+        mode: FetchMode,
+        progress: tqdm,
+        controller: AdaptiveConcurrency | None = None,
+        ) -> None:
+    # Requests in flight, bounded by the controller if any
+    active: int = 0
+    # Notified when a fetch completes, so that waiting workers ask the
+    # scheduler again
+    released = asyncio.Condition()
+
+    async def wait_release(delay: float | None) -> None:
+        async with released:
+            try:
+                await asyncio.wait_for(released.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker() -> None:
+        # All the workers pull from the same scheduler, so at most
+        # `concurrency` requests are in flight at any time
+        nonlocal active
+        while True:
+            if controller is not None and active >= controller.limit:
+                # Parked until a fetch completes, the limit only moves then
+                await wait_release(None)
+                continue
+            url, delay = scheduler.next_ready(time.monotonic())
+            if url is None:
+                # A fetch still in flight may be retried
+                if scheduler.done and not active:
+                    async with released:
+                        released.notify_all()
+                    return
+                await wait_release(delay)
+                continue
+            active += 1
+            try:
+                result: Dict[str, Any] = \
+                    await fetch_single_site_infos_async(url, client, mode)
+            finally:
+                active -= 1
+            if controller is not None:
+                controller.record(result["err_code"])
+            now: float = time.monotonic()
+            scheduler.release(url, now)
+            retried: bool = scheduler.retry(url, result, now)
+            async with released:
+                released.notify()
+            if retried:
+                # Fetched again once its backoff has elapsed
+                continue
+            on_result(result)
+            progress.update()
+
+    try:
+        if controller is not None:
+            concurrency = controller.maximum
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        client.close()
+
+
+def scan_urls_async(
+        urls: Iterable[str],
+        on_result: Callable[[Dict[str, Any]], None],
+        concurrency: int = 1000,
+        timeout: float | Timeouts = 10,
+        mode: FetchMode = "get",
+        summary: ScanSummary | None = None,
+        session: SessionPool | None = None,
+        per_host_concurrency: int | None = None,
+        per_host_rps: float | None = None,
+        cache: HeaderCache | None = None,
+        controller: AdaptiveConcurrency | None = None,
+        retry: RetryPolicy | None = None,
+        deadline: float | None = None,
+        keep_headers: bool = False,
+        ) -> None:
+    total: int | None = len(urls) if isinstance(urls, Sized) else None
+    client = AsyncClient(timeout, summary, session, cache, keep_headers)
+    scheduler: InputScheduler = make_scheduler(
+        urls, per_host_concurrency, per_host_rps, retry, deadline,
+        client.timeouts.longest,
+        )
+    with tqdm(
+        total=total,
+        desc="Getting sites infos",
+        colour="green"
+    ) as progress:
+        asyncio.run(
+            _fetch_all(
+                scheduler,
+                on_result,
+                max(concurrency, 1),
+                client,
+                mode,
+                progress,
+                controller,
+                )
+            )
+        for url, last in scheduler.drain():
+            on_result(last or skipped(url, summary))
+            progress.update()
+
+
+def fetching_urls_async(
+        urls: List[str],
+        concurrency: int = 1000,
+        timeout: float = 10,
+        mode: FetchMode = "get",
+        summary: ScanSummary | None = None,
+        session: SessionPool | None = None,
+        cache: HeaderCache | None = None,
+        ) -> Results:
+    results = Results(site_infos=SiteStore())
+    scan_urls_async(
+        urls, results.add_site, concurrency, timeout, mode, summary, session,
+        cache=cache,
+        )
+    return results
@@ -0,0 +1,225 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, NamedTuple
+
+from .nyfitsa import ScanSummary
+
+
+class CacheEntry(NamedTuple):
+    """
+        Cached headers of a url, with the validators sent back to the
+        server to revalidate them once they are stale.
+    """
+    headers: Dict[str, str]
+    fresh: bool
+    etag: str | None = None
+    last_modified: str | None = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HeaderCache():
+    """
+        Persistent on-disk cache of the headers extracted for each url.
+
+        Entries are stored in a SQLite database with the time they were
+        fetched. An entry younger than `ttl` is served without any network
+        I/O. Stale entries keep the ETag and Last-Modified of the site, so
+        that they can be revalidated with a conditional request: a 304 Not
+        Modified reuses the cached headers without downloading anything.
+        When the cache holds more than `max_entries` urls, the oldest
+        entries are evicted. Only successful fetches are cached, so errors
+        are always retried. The cache can be shared by all the worker
+        threads, and the database by several processes, such as the shards
+        of a scan or the workers of a distributed scan on the same host:
+        each write is committed at once, so no process holds the database
+        locked across network requests, and a process finding it locked
+        waits for up to `BUSY_TIMEOUT` seconds.
+
+        Attributes
+        ----------
+        path : Path
+            The SQLite database.
+        ttl : float
+            Number of seconds an entry stays fresh.
+        max_entries : int
+            Maximum number of urls kept in the cache.
+        hits : int
+            Number of fresh entries served.
+        misses : int
+            Number of lookups without a fresh entry.
+        revalidated : int
+            Number of stale entries confirmed by a 304 Not Modified.
+
+        Methods
+        -------
+        lookup(url: str) -> CacheEntry | None
+            Returns the cached entry of `url`, fresh or stale.
+
+        get(url: str) -> Dict[str, str] | None
+            Returns the cached headers of `url` if they are fresh.
+
+        put(url: str, headers: Dict[str, str], etag: str | None = None,
+            last_modified: str | None = None) -> None
+            Stores the headers of `url` and its validators.
+
+        revalidate(url: str, etag: str | None = None,
+                   last_modified: str | None = None) -> None
+            Marks the entry of `url` as fresh again after a 304.
+
+        report(summary: ScanSummary) -> None
+            Copies the hit/miss counters and the hit ratio into the summary.
+
+        close() -> None
+            Closes the database.
+    """
+
+    # Seconds a write waits for another process to release the database
+    BUSY_TIMEOUT: float = 60.0
+
+    def __init__(
+            self,
+            path: str | Path,
+            ttl: float,
+            max_entries: int = 1_000_000,
+            ) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.hits: int = 0
+        self.misses: int = 0
+        self.revalidated: int = 0
+        self._lock = Lock()
+        self._db = sqlite3.connect(
+            self.path, timeout=self.BUSY_TIMEOUT, check_same_thread=False
+            )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS headers ("
+            "url TEXT PRIMARY KEY, fetched_at REAL NOT NULL, "
+            "headers TEXT NOT NULL, etag TEXT, last_modified TEXT)"
+            )
+        # Caches created before the validators were stored
+        columns = {
+            row[1] for row in self._db.execute("PRAGMA table_info(headers)")
+            }
+        for column in ("etag", "last_modified"):
+            if column not in columns:
+                self._db.execute(
+                    f"ALTER TABLE headers ADD COLUMN {column} TEXT"
+                    )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS headers_fetched_at "
+            "ON headers (fetched_at)"
+            )
+        self._size: int = self._db.execute(
+            "SELECT COUNT(*) FROM headers"
+            ).fetchone()[0]
+
+    def lookup(self, url: str) -> CacheEntry | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fetched_at, headers, etag, last_modified "
+                "FROM headers WHERE url = ?",
+                (url,),
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            fresh: bool = time.time() - row[0] <= self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return CacheEntry(json.loads(row[1]), fresh, row[2], row[3])
+
+    def get(self, url: str) -> Dict[str, str] | None:
+        entry: CacheEntry | None = self.lookup(url)
+        return entry.headers if entry is not None and entry.fresh else None
+
+    def put(
+            self,
+            url: str,
+            headers: Dict[str, str],
+            etag: str | None = None,
+            last_modified: str | None = None,
+            ) -> None:
+        with self._lock:
+            row = (url, time.time(), json.dumps(headers), etag, last_modified)
+            inserted: int = self._db.execute(
+                "INSERT OR IGNORE INTO headers VALUES (?, ?, ?, ?, ?)", row
+                ).rowcount
+            if not inserted:
+                self._db.execute(
+                    "UPDATE headers SET fetched_at = ?, headers = ?, "
+                    "etag = ?, last_modified = ? WHERE url = ?",
+                    row[1:] + row[:1],
+                    )
+            self._size += inserted
+            if self._size > self.max_entries:
+                self._evict()
+            self._db.commit()
+
+    def revalidate(
+            self,
+            url: str,
+            etag: str | None = None,
+            last_modified: str | None = None,
+            ) -> None:
+        with self._lock:
+            # A 304 may carry updated validators, keep the old ones otherwise
+            self._db.execute(
+                "UPDATE headers SET fetched_at = ?, "
+                "etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (time.time(), etag, last_modified, url),
+                )
+            self.revalidated += 1
+            self._db.commit()
+
+    def _evict(self) -> None:
+        # Other processes may have written to the database too
+        self._size = self._db.execute(
+            "SELECT COUNT(*) FROM headers"
+            ).fetchone()[0]
+        if self._size <= self.max_entries:
+            return
+        # Evict a tenth of the cache at once rather than one row per put
+        count: int = self._size - self.max_entries + self.max_entries // 10
+        self._size -= self._db.execute(
+            "DELETE FROM headers WHERE url IN ("
+            "SELECT url FROM headers ORDER BY fetched_at LIMIT ?)",
+            (count,),
+            ).rowcount
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("cache_hits", self.hits)
+        summary.set("cache_misses", self.misses)
+        summary.set("cache_revalidated", self.revalidated)
+        report_hit_ratio(summary)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def report_hit_ratio(summary: ScanSummary) -> None:
+    """
+        Sets the cache hit ratio from the hit and miss counters, once the
+        summaries of all the shards are merged.
+    """
+    hits: int | float = summary.get("cache_hits")
+    lookups: int | float = hits + summary.get("cache_misses")
+    summary.set(
+        "cache_hit_ratio", round(hits / lookups, 4) if lookups else 0.0
+        )
@@ -1,8 +1,33 @@
+import json
+import time
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
+from types import TracebackType
+from typing import (IO, Any, Callable, ContextManager, Dict, Iterable, List,
+                    Literal, Set, Tuple)
 from pydantic import BaseModel
 import tyro
 # from .nyfitsa import Results, parralelize_fetching
-from .nyfitsa import Results, fetching_urls_concurrently
+from .adaptive import AdaptiveConcurrency
+from .aio import scan_urls_async
+from .cache import HeaderCache, report_hit_ratio
+from .coalesce import OriginCoalescer
+from .columnar import ColumnarSink
+from .dedup import UrlDeduplicator, normalize_url, url_key
+from .diff import DiffReport, diff_scans
+from .distributed import coordinate, parse_address, run_worker
+from .metrics import MetricsExporter, ScanMetrics
+from .nyfitsa import (FetchMode, HeaderAggregator, Results, ScanSummary,
+                      SiteStore, Timeouts, scan_urls_concurrently)
+from .offline import ScanFilter, offline_stats
+from .resolver import ResolverCache
+from .retry import RETRY_STATUSES, RetryPolicy
+from .session import SessionPool
+from .shard import scan_urls_sharded
+from .sources import read_urls
+from .stream import (JsonlSink, StreamingPipeline, TeeSink, drop_skipped,
+                     load_jsonl, repair_journal)
 
 
 class NyfitsaConfig(BaseModel):
@@ -22,6 +47,14 @@ class NyfitsaConfig(BaseModel):
 
     """
 
+    stats_server_version: bool = False
+    """
+
+    Activate this option to calculate the server version stats from the
+    urls list
+
+    """
+
     stats_xss_protection: bool = False
     """
 
@@ -56,24 +89,641 @@ class NyfitsaConfig(BaseModel):
     file: Path | None = None
     """
 
-    urls in a txt file. 1 url per line
+    urls in a txt file. 1 url per line. The file is read lazily, it can be
+    gzip-compressed, and "-" reads the urls from stdin
 
     """
 
+    dedup: bool = True
+    """
 
-def main():
-    config = tyro.cli(NyfitsaConfig)
-    if config.file is not None:
-        # Open file
-        config.urls = []
-        with open(config.file, "r") as file:
-            # Put each url / line in a list
-            for line in file:
-                config.urls.append(line.strip())
-    # stats: Results = parralelize_fetching(config.urls)
-    stats: Results = fetching_urls_concurrently(config.urls)
+    Normalize the urls (bare domains, case of the host, default ports,
+    fragments) and fetch each canonical url once. --no-dedup fetches the
+    urls as they are written
+
+    """
+
+    dedup_bloom: int | None = None
+    """
+
+    Expected number of urls: deduplicate with a Bloom filter sized for
+    them, whose memory does not grow with the input. A few unique urls
+    may then be dropped as duplicates, see --dedup-error-rate
+
+    """
+
+    dedup_error_rate: float = 0.001
+    """
+
+    Probability that the Bloom filter drops a unique url, between 0 and 1
+    excluded
+
+    """
+
+    coalesce: int | None = None
+    """
+
+    Fetch this many urls per origin (scheme, host and port) and give
+    their headers to the other urls of the origin, marked as inferred.
+    Cuts the requests of inputs listing many paths of the same sites
+
+    """
+
+    engine: Literal["threads", "async"] = "threads"
+    """
+
+    Engine used to fetch the urls. "threads" uses a small thread pool,
+    "async" keeps up to `concurrency` requests in flight with asyncio
+
+    """
+
+    concurrency: int = 1000
+    """
+
+    Maximum number of requests in flight with the async engine
+
+    """
+
+    adaptive: bool = False
+    """
+
+    Adapt the number of requests in flight to the observed throughput:
+    raised while throughput climbs, halved when timeouts or connection
+    errors spike
+
+    """
+
+    adaptive_max: int | None = None
+    """
+
+    Upper bound of the adaptive concurrency. Defaults to --concurrency with
+    the async engine and 64 threads with the threads engine
+
+    """
+
+    adaptive_log: Path | None = None
+    """
+
+    Append each adjustment of the adaptive concurrency to this file, one
+    JSON object per line
+
+    """
+
+    fetch_mode: FetchMode = "get"
+    """
+
+    "head" sends a HEAD request first and falls back to a GET that only
+    reads the headers when the server rejects HEAD (405/501)
+
+    """
+
+    pool_size: int = 10
+    """
+
+    Number of keep-alive connections kept open per host
+
+    """
+
+    max_connections: int | None = None
+    """
+
+    Maximum number of connections in use at the same time across all hosts.
+    Unlimited by default
+
+    """
+
+    per_host_concurrency: int | None = None
+    """
+
+    Maximum number of requests in flight per host. Setting a per-host limit
+    also interleaves the hosts, so lists sorted by domain do not hammer one
+    host at a time
+
+    """
+
+    per_host_rps: float | None = None
+    """
+
+    Maximum number of requests per second per host
+
+    """
+
+    retries: int = 0
+    """
+
+    Number of times a timeout, a connection error or a --retry-statuses
+    response is retried. Retries wait their backoff without holding a
+    worker
+
+    """
+
+    retry_backoff: float = 0.5
+    """
+
+    Base delay in seconds before a retry, doubled at each attempt and
+    randomized between 0 and this value
+
+    """
+
+    retry_max_delay: float = 30.0
+    """
+
+    Longest delay before a retry, Retry-After headers included
+
+    """
+
+    retry_statuses: Tuple[int, ...] = RETRY_STATUSES
+    """
+
+    HTTP statuses worth retrying
+
+    """
+
+    retry_budget: float = 0.1
+    """
+
+    Retries allowed per url fetched, across the whole scan, so that
+    retries cannot take over the scan on a failing network
+
+    """
+
+    connect_timeout: float = 10.0
+    """
+
+    Seconds allowed to open a connection, TLS handshake included
+
+    """
+
+    read_timeout: float = 10.0
+    """
+
+    Seconds allowed for each read from a server
+
+    """
+
+    total_timeout: float | None = None
+    """
+
+    Seconds allowed for a whole request, redirects and body included, so
+    that servers sending bytes slowly cannot hold a worker. Unlimited by
+    default
+
+    """
+
+    deadline: float | None = None
+    """
+
+    Seconds the whole scan may take. No url is issued once there is not
+    enough time left to fetch it, retries stop a bit earlier, and the urls
+    left are counted as skipped in partial stats
+
+    """
+
+    keep_headers: bool = False
+    """
+
+    Debugging: keep all the response headers of each site in the output,
+    under raw_headers. By default only the parsed fields are kept, and
+    each response is dropped as soon as it is parsed
+
+    """
+
+    stream: bool = False
+    """
+
+    Stream the results: each site is counted and written to the output
+    file (one JSON object per line) as soon as it is fetched, instead of
+    keeping the whole scan in memory
+
+    """
+
+    output: Path | None = None
+    """
+
+    Output file. stats.json by default, stats.jsonl with --stream
+
+    """
+
+    journal: Path | None = None
+    """
+
+    Checkpoint journal: each site is appended to this file as soon as it is
+    fetched, so an interrupted scan can be resumed. With --stream, the
+    output file is the journal
+
+    """
+
+    resume: bool = False
+    """
+
+    Resume an interrupted scan: the urls already in the journal are not
+    fetched again, and their results are counted in the stats
+
+    """
+
+    columnar: Path | None = None
+    """
+
+    Also export the sites to this compact columnar file, written in chunks
+    as they are fetched. Its stats can be computed later without fetching
+    the sites again, see nyfitsa.columnar.ColumnarFile
+
+    """
+
+    load: Path | None = None
+    """
+
+    Offline mode: recompute the stats of a previous scan from its output
+    (stats.json, newline-delimited JSON or a --columnar export) instead of
+    fetching the urls
+
+    """
+
+    tld: List[str] = []
+    """
+
+    With --load, only count the sites of these top-level domains
+
+    """
+
+    error: List[str] = []
+    """
+
+    With --load, only count the sites with these errors: ok (no error),
+    timeout, connection_error, http_error, dns_error or skipped
+
+    """
+
+    server_family: List[str] = []
+    """
+
+    With --load, only count the sites whose server name starts with one of
+    these, case-insensitively (apache matches Apache and Apache-Coyote)
+
+    """
+
+    diff: Tuple[Path, Path] | None = None
+    """
+
+    Compare two scan outputs OLD NEW by url instead of fetching: the
+    changes are written to the output file (diff.jsonl by default), one
+    record per added or removed site and per changed field, and the most
+    frequent transitions are printed
+
+    """
+
+    cache_ttl: float | None = None
+    """
+
+    Enable the header cache: sites fetched less than this many seconds ago
+    are served from the cache without any request. Disabled by default
+
+    """
+
+    cache_file: Path = Path("nyfitsa_cache.sqlite")
+    """
+
+    SQLite database of the header cache
+
+    """
+
+    cache_size: int = 1_000_000
+    """
+
+    Maximum number of sites kept in the header cache, the oldest entries
+    are evicted first
+
+    """
+
+    dns_cache: bool = False
+    """
+
+    Resolve each host once and share its addresses between all the
+    workers, instead of querying the system resolver for every connection
+
+    """
+
+    dns_ttl: float = 300.0
+    """
+
+    Seconds the addresses of a host stay in the DNS cache
+
+    """
+
+    dns_negative_ttl: float = 60.0
+    """
+
+    Seconds a failed resolution stays in the DNS cache
+
+    """
+
+    dns_prefetch: int = 0
+    """
+
+    Resolve the hosts of the next N urls in the background, ahead of
+    fetching them. Enables the DNS cache
+
+    """
+
+    processes: int = 1
+    """
+
+    Number of worker processes. Above 1, the urls are sharded across the
+    processes, each running its own engine, and their stats are merged
+
+    """
+
+    listen: str | None = None
+    """
+
+    Coordinate a distributed scan on HOST:PORT: the urls are leased in
+    chunks to the workers started with --connect, and their stats are
+    merged here. Only listen on a trusted network
+
+    """
+
+    connect: str | None = None
+    """
+
+    Run as a worker of the coordinator at HOST:PORT. The urls come from the
+    coordinator, the fetch options are the ones of the worker
+
+    """
+
+    lease_timeout: float = 300.0
+    """
+
+    Seconds after which the chunk of a worker that stopped answering is
+    leased to another worker
+
+    """
+
+    metrics: bool = False
+    """
+
+    Time each phase of the requests (DNS, connect, TLS, first byte, body,
+    header parsing, storing the site) and print their histograms at the end
+
+    """
+
+    metrics_file: Path | None = None
+    """
+
+    Rewrite the live counters and timings to this JSON file every second.
+    Enables --metrics
+
+    """
+
+    metrics_listen: str | None = None
+    """
+
+    Serve the live counters and timings as JSON on HOST:PORT. Enables
+    --metrics
+
+    """
+
+
+# Default upper bound of the adaptive concurrency with the threads engine
+ADAPTIVE_MAX_THREADS: int = 64
+
+
+def log_step(file: IO[str], step: Dict[str, Any]) -> None:
+    file.write(json.dumps(step) + "\n")
+    file.flush()
+
+
+def scan(
+        config: NyfitsaConfig,
+        urls: Iterable[str],
+        on_result: Callable[[Dict[str, Any]], None],
+        summary: ScanSummary,
+        session: SessionPool,
+        cache: HeaderCache | None = None,
+        controller: AdaptiveConcurrency | None = None,
+        retry: RetryPolicy | None = None,
+        deadline: float | None = None,
+        ) -> None:
+    timeouts = Timeouts(
+        config.connect_timeout, config.read_timeout, config.total_timeout
+        )
+    if config.engine == "async":
+        scan_urls_async(
+            urls,
+            on_result,
+            config.concurrency,
+            timeouts,
+            mode=config.fetch_mode,
+            summary=summary,
+            session=session,
+            per_host_concurrency=config.per_host_concurrency,
+            per_host_rps=config.per_host_rps,
+            cache=cache,
+            controller=controller,
+            retry=retry,
+            deadline=deadline,
+            keep_headers=config.keep_headers,
+            )
+    else:
+        scan_urls_concurrently(
+            urls,
+            on_result,
+            config.fetch_mode,
+            summary,
+            session,
+            per_host_concurrency=config.per_host_concurrency,
+            per_host_rps=config.per_host_rps,
+            cache=cache,
+            controller=controller,
+            retry=retry,
+            timeouts=timeouts,
+            deadline=deadline,
+            keep_headers=config.keep_headers,
+            )
+
+
+class ScanEngine():
+    """
+        The connection pool, the DNS cache, the header cache, the adaptive
+        concurrency and the retry policy of a configuration, built once
+        and reused by every scan run with it. A --connect worker scans all
+        the chunks it leases with one engine, so keep-alive connections,
+        cached resolutions and the adaptive limit carry over from a chunk
+        to the next.
+
+        Instances are `ShardScan` callables: each call scans the urls,
+        coalesced per call, and records in its summary the counters of the
+        engine since the previous call, so that the summaries of the calls
+        add up. The `deadline` of the scan is a time.time() value, and the
+        timings of the requests go to `metrics`.
+
+        Methods
+        -------
+        close() -> None
+            Closes the connections, the header cache and the resolver.
+    """
+
+    def __init__(
+            self,
+            config: NyfitsaConfig,
+            metrics: ScanMetrics | None = None,
+            deadline: float | None = None,
+            ) -> None:
+        self.config = config
+        self.metrics = metrics
+        self.deadline = deadline
+        self.resolver: ResolverCache | None = (
+            ResolverCache(config.dns_ttl, config.dns_negative_ttl)
+            if config.dns_cache or config.dns_prefetch else None
+            )
+        self.session = SessionPool(
+            pool_maxsize=config.pool_size,
+            max_connections=config.max_connections,
+            resolver=self.resolver,
+            metrics=metrics,
+            )
+        self.cache: HeaderCache | None = (
+            HeaderCache(config.cache_file, config.cache_ttl, config.cache_size)
+            if config.cache_ttl is not None else None
+            )
+        self.log: IO[str] | None = None
+        self.controller: AdaptiveConcurrency | None = None
+        if config.adaptive:
+            if config.adaptive_log is not None:
+                self.log = open(config.adaptive_log, "a", encoding="utf-8")
+            self.controller = AdaptiveConcurrency(
+                config.adaptive_max or (
+                    config.concurrency if config.engine == "async"
+                    else ADAPTIVE_MAX_THREADS
+                    ),
+                on_step=partial(log_step, self.log)
+                if self.log is not None else None,
+                )
+        self.retry: RetryPolicy | None = (
+            RetryPolicy(
+                config.retries + 1,
+                config.retry_backoff,
+                config.retry_max_delay,
+                config.retry_statuses,
+                config.retry_budget,
+                )
+            if config.retries > 0 else None
+            )
+        # Counters of the engine at the end of the previous call
+        self._reported: Dict[str, int | float] = {}
+
+    def __call__(
+            self,
+            urls: Iterable[str],
+            on_result: Callable[[Dict[str, Any]], None],
+            summary: ScanSummary,
+            ) -> None:
+        config: NyfitsaConfig = self.config
+        coalescer: OriginCoalescer | None = (
+            OriginCoalescer(config.coalesce) if config.coalesce else None
+            )
+        if coalescer is not None:
+            # Only the samples are resolved ahead
+            urls = coalescer.coalesce(urls)
+        if self.resolver is not None and config.dns_prefetch:
+            urls = self.resolver.prefetch(urls, config.dns_prefetch)
+        if self.metrics is not None:
+            on_result = self.metrics.timed("store", on_result)
+        if coalescer is not None:
+            on_result = coalescer.wrap(on_result)
+        try:
+            scan(
+                config, urls, on_result, summary, self.session, self.cache,
+                self.controller, self.retry,
+                # The engines wait on the monotonic clock
+                time.monotonic() + self.deadline - time.time()
+                if self.deadline is not None else None,
+                )
+        finally:
+            self._report(summary)
+            if coalescer is not None:
+                coalescer.report(summary)
+
+    def _report(self, summary: ScanSummary) -> None:
+        engine = ScanSummary()
+        self.session.report(engine)
+        if self.cache is not None:
+            self.cache.report(engine)
+        if self.resolver is not None:
+            self.resolver.report(engine)
+        if self.controller is not None:
+            self.controller.report(engine)
+        if self.retry is not None:
+            self.retry.report(engine)
+        counters: Dict[str, int | float] = engine.as_dict()
+        for name, value in counters.items():
+            if name in ScanSummary.GAUGES:
+                summary.set(name, value)
+            else:
+                summary.add(name, value - self._reported.get(name, 0))
+        self._reported = counters
+
+    def close(self) -> None:
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.resolver is not None:
+            self.resolver.close()
+        if self.log is not None:
+            self.log.close()
+
+    def __enter__(self) -> "ScanEngine":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc: BaseException | None,
+            traceback: TracebackType | None,
+            ) -> None:
+        self.close()
+
+
+def run_scan(
+        config: NyfitsaConfig,
+        urls: Iterable[str],
+        on_result: Callable[[Dict[str, Any]], None],
+        summary: ScanSummary,
+        metrics: ScanMetrics | None = None,
+        deadline: float | None = None,
+        ) -> None:
+    """
+        Scans the urls with a `ScanEngine` of the configuration, then
+        records its counters in the summary. Runs in each worker process
+        when the scan is sharded, so the `deadline` of the scan is a
+        time.time() value.
+    """
+    with ScanEngine(config, metrics, deadline) as engine:
+        engine(urls, on_result, summary)
+
+
+def export_metrics(
+        config: NyfitsaConfig,
+        metrics: ScanMetrics | None,
+        ) -> ContextManager[Any]:
+    if metrics is None or (
+            config.metrics_file is None and config.metrics_listen is None):
+        return nullcontext()
+    return MetricsExporter(
+        metrics,
+        config.metrics_file,
+        parse_address(config.metrics_listen)
+        if config.metrics_listen is not None else None,
+        )
+
+
+def print_selected_stats(
+        config: NyfitsaConfig,
+        stats: Results | HeaderAggregator,
+        ) -> None:
     if config.stats_server:
         stats.print_stats("server")
+    if config.stats_server_version:
+        stats.print_stats("server_version")
     if config.stats_x_content_type_options:
         stats.print_stats("x_content_type_options")
     if config.stats_x_frame_options:
@@ -83,4 +733,166 @@ def main():
     if config.stats_referrer_policy:
         stats.print_stats("referrer_policy")
 
-    stats.to_json()
+
+def run_offline(config: NyfitsaConfig, path: Path) -> None:
+    """Prints the stats of a previous scan without fetching anything."""
+    try:
+        scan_filter = ScanFilter(
+            config.tld, config.error, config.server_family
+            )
+    except ValueError as error:
+        raise SystemExit(str(error))
+    aggregator, loaded = offline_stats(path, scan_filter)
+    print(f"{aggregator.total} of {loaded} sites selected from {path}")
+    print_selected_stats(config, aggregator)
+
+
+def run_diff(config: NyfitsaConfig, old: Path, new: Path) -> None:
+    output: Path = config.output or Path("diff.jsonl")
+    with open(output, "w", encoding="utf-8") as file:
+        report: DiffReport = diff_scans(
+            old, new,
+            lambda record: file.write(
+                json.dumps(record, ensure_ascii=False) + "\n"
+                ),
+            )
+    report.print_report()
+    print(f"Changes written to {output}")
+
+
+def main():
+    config = tyro.cli(NyfitsaConfig)
+    if config.diff is not None:
+        run_diff(config, *config.diff)
+        return
+    if config.load is not None:
+        run_offline(config, config.load)
+        return
+    if config.tld or config.error or config.server_family:
+        raise SystemExit(
+            "--tld, --error and --server-family filter a scan loaded "
+            "with --load"
+            )
+    if not 0 < config.dedup_error_rate < 1:
+        raise SystemExit(
+            "--dedup-error-rate is a probability between 0 and 1 excluded"
+            )
+    metrics: ScanMetrics | None = (
+        ScanMetrics() if config.metrics or config.metrics_file
+        or config.metrics_listen else None
+        )
+    if metrics is not None and (
+            config.processes > 1 or config.listen is not None):
+        raise SystemExit(
+            "--metrics times the requests of this process: use it without "
+            "--processes and --listen, or on each --connect worker"
+            )
+    if config.deadline is not None and config.listen is not None:
+        raise SystemExit(
+            "--deadline bounds the fetches of this process: use it without "
+            "--listen, or on each --connect worker"
+            )
+    deadline: float | None = (
+        time.time() + config.deadline if config.deadline is not None
+        else None
+        )
+    if config.connect is not None:
+        with export_metrics(config, metrics), \
+                ScanEngine(config, metrics, deadline) as engine:
+            fetched: int = run_worker(config.connect, engine, deadline)
+        print(f"Fetched {fetched} sites for {config.connect}")
+        if metrics is not None:
+            metrics.print_metrics()
+        return
+    urls: Iterable[str] = config.urls
+    if config.file is not None:
+        # Urls are read as they are fetched, never all at once
+        urls = read_urls(config.file)
+    dedup: UrlDeduplicator | None = (
+        UrlDeduplicator(config.dedup_bloom, config.dedup_error_rate)
+        if config.dedup else None
+        )
+    if dedup is not None:
+        urls = dedup.deduplicate(urls)
+        if config.file is None:
+            # Urls given on the command line keep a progress total
+            urls = list(urls)
+    # stats: Results = parralelize_fetching(config.urls)
+    summary = ScanSummary()
+    # When streaming, the output file is the journal of the scan
+    journal: Path | None = (
+        (config.output or Path("stats.jsonl")) if config.stream
+        else config.journal
+        )
+    if config.resume and journal is None:
+        raise SystemExit("--resume needs a journal: use --journal or --stream")
+
+    results: Results | None = (
+        None if config.stream else Results(site_infos=SiteStore())
+        )
+    pipeline = StreamingPipeline(results=results)
+    columnar: ColumnarSink | None = (
+        ColumnarSink(config.columnar) if config.columnar is not None
+        else None
+        )
+    resume: bool = config.resume and journal is not None and journal.exists()
+    if resume:
+        assert journal is not None
+        repair_journal(journal)
+        # The urls skipped at a deadline are fetched this time
+        drop_skipped(journal)
+        done: Set[str] = set()
+        # Journals written with --no-dedup match the urls as dedup keys
+        # them, a trailing slash making no difference
+        key: Callable[[str], str] = (
+            (lambda url: url) if dedup is None
+            else (lambda url: url_key(normalize_url(url)))
+            )
+        for site in load_jsonl(journal):
+            pipeline.restore(site)
+            # The export is written again from the start
+            if columnar is not None:
+                columnar.write(site)
+            done.add(key(site.url))
+        summary.set("resumed_sites", len(done))
+        urls = (url for url in urls if key(url) not in done)
+
+    if journal is not None:
+        pipeline.sink = JsonlSink(journal, append=resume, checkpoint=True)
+    if columnar is not None:
+        pipeline.sink = TeeSink(columnar) if pipeline.sink is None \
+            else TeeSink(pipeline.sink, columnar)
+    try:
+        if config.listen is not None:
+            pipeline.merge(coordinate(
+                urls,
+                config.listen,
+                pipeline.add_line,
+                summary,
+                config.lease_timeout,
+                ))
+        elif config.processes > 1:
+            pipeline.merge(scan_urls_sharded(
+                urls,
+                partial(run_scan, config, deadline=deadline),
+                config.processes,
+                pipeline.add_line,
+                summary,
+                ))
+        else:
+            with export_metrics(config, metrics):
+                run_scan(config, urls, pipeline, summary, metrics, deadline)
+    finally:
+        pipeline.close()
+    if dedup is not None and dedup.duplicates:
+        dedup.report(summary)
+    if summary.get("cache_hits") or summary.get("cache_misses"):
+        # Hit ratio of all the shards or workers together
+        report_hit_ratio(summary)
+    print_selected_stats(config, results or pipeline.aggregator)
+    summary.print_summary()
+    if metrics is not None:
+        metrics.print_metrics()
+
+    if results is not None:
+        results.to_json(str(config.output or "stats.json"))
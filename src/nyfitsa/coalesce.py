@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+from urllib.parse import urlsplit
+
+from .nyfitsa import ScanSummary
+
+# Origins remembered at most, the oldest are forgotten first and sampled
+# again if they come back
+MAX_ORIGINS: int = 100_000
+
+
+def origin_of(url: str) -> str | None:
+    """scheme://host:port of a url, None if it cannot be parsed."""
+    try:
+        parts = urlsplit(url)
+        port: int | None = parts.port
+    except ValueError:
+        return None
+    if not parts.hostname:
+        return None
+    scheme: str = parts.scheme.lower()
+    return f"{scheme}://{parts.hostname.lower()}:" \
+        f"{port or (443 if scheme == 'https' else 80)}"
+
+
+class _Origin():
+    __slots__ = ("issued", "completed", "result", "waiting")
+
+    def __init__(self) -> None:
+        self.issued: int = 0
+        self.completed: int = 0
+        # Result attributed to the urls that are not fetched
+        self.result: Dict[str, Any] | None = None
+        self.waiting: List[str] = []
+
+
+class OriginCoalescer():
+    """
+        Fetches a sample of the urls of each origin, and attributes the
+        result to the others.
+
+        Security headers are set per server much more often than per
+        page, so on inputs listing many paths of the same sites, most
+        requests only fetch headers already known. The first `sample`
+        urls of each origin (scheme, host and port) are fetched. The first
+        sample fetched without error is attributed to the other urls of
+        the origin, marked as inferred, or the error of the last sample if
+        all `sample` failed. Urls read while the samples are in flight wait
+        for them, without holding a worker.
+
+        Not thread-safe: the urls are pulled and the results pushed by the
+        loop of the engine.
+
+        Attributes
+        ----------
+        sample : int
+            Urls fetched per origin.
+        fetched : int
+            Urls passed on to be fetched.
+        inferred : int
+            Urls given the result of another url of their origin.
+
+        Methods
+        -------
+        coalesce(urls: Iterable[str]) -> Iterator[str]
+            Lazily yields the urls to fetch.
+
+        wrap(on_result: Callable[[Dict[str, Any]], None])
+                -> Callable[[Dict[str, Any]], None]
+            Returns the callback receiving the results of the engine,
+            which passes them on to `on_result` with the inferred ones.
+
+        report(summary: ScanSummary) -> None
+            Adds the counters to the run summary.
+    """
+
+    def __init__(self, sample: int = 1) -> None:
+        self.sample = max(sample, 1)
+        self.fetched: int = 0
+        self.inferred: int = 0
+        self._origins: OrderedDict[str, _Origin] = OrderedDict()
+        self._on_result: Callable[[Dict[str, Any]], None] | None = None
+
+    def _infer(self, url: str, result: Dict[str, Any]) -> None:
+        assert self._on_result is not None
+        self.inferred += 1
+        self._on_result(result | {"url": url, "inferred": True})
+
+    def _forget(self) -> None:
+        for _ in range(len(self._origins) - MAX_ORIGINS):
+            key, origin = self._origins.popitem(last=False)
+            if origin.completed < origin.issued:
+                # Samples in flight, kept until they are done
+                self._origins[key] = origin
+
+    def coalesce(self, urls: Iterable[str]) -> Iterator[str]:
+        for url in urls:
+            key: str | None = origin_of(url)
+            if key is None:
+                self.fetched += 1
+                yield url
+                continue
+            origin: _Origin | None = self._origins.get(key)
+            if origin is None:
+                origin = self._origins[key] = _Origin()
+                self._forget()
+            if origin.result is not None:
+                self._infer(url, origin.result)
+            elif origin.issued < self.sample:
+                origin.issued += 1
+                self.fetched += 1
+                yield url
+            else:
+                origin.waiting.append(url)
+
+    def _done(self, result: Dict[str, Any]) -> None:
+        assert self._on_result is not None
+        self._on_result(result)
+        key: str | None = origin_of(result["url"])
+        origin: _Origin | None = (
+            self._origins.get(key) if key is not None else None
+            )
+        if origin is None or origin.result is not None:
+            return
+        origin.completed += 1
+        if result["err_code"] is not None and \
+                origin.completed < self.sample:
+            # Another sample may succeed, fetched now or read later
+            return
+        origin.result = result
+        waiting: List[str] = origin.waiting
+        origin.waiting = []
+        for url in waiting:
+            self._infer(url, origin.result)
+
+    def wrap(
+            self,
+            on_result: Callable[[Dict[str, Any]], None],
+            ) -> Callable[[Dict[str, Any]], None]:
+        self._on_result = on_result
+        return self._done
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.add("coalesced_fetched", self.fetched)
+        summary.add("coalesced_inferred", self.inferred)
@@ -0,0 +1,405 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Dict, Iterator, List, Sequence, Tuple
+
+from .nyfitsa import (STAT_HEADERS, STORE_ERROR_CODES, ColumnChunk,
+                      ErrorCode, HeaderAggregator, Results, SiteInfos,
+                      SiteStore, aggregate_columns)
+
+COLUMNAR_MAGIC: bytes = b"NYFCOL2\n"
+# Files written before the inferred column, still read
+COLUMNAR_V1_MAGIC: bytes = b"NYFCOL1\n"
+CHUNK_MAGIC: bytes = b"CHNK"
+# Chunk magic, number of sites, payload size in bytes
+CHUNK_HEADER = struct.Struct("<4sII")
+LENGTH = struct.Struct("<I")
+# The format is little-endian, arrays are swapped on other machines
+SWAP: bool = sys.byteorder != "little"
+
+
+def _pad(size: int) -> int:
+    return -size % 4
+
+
+def _to_bytes(values: array) -> bytes:
+    if SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ColumnarSink():
+    """
+        Writes sites to a compact columnar file as they arrive.
+
+        Sites are buffered and written in chunks of `chunk_rows` sites.
+        Each chunk holds the new values of the header dictionaries, then
+        one column of codes per header, the error codes, the inferred flags
+        and the urls, so memory stays bounded by one chunk whatever the
+        size of the scan.
+        The file is read back with `ColumnarFile`.
+
+        Layout, little-endian: COLUMNAR_MAGIC, then for each chunk a
+        CHUNK_HEADER followed by its payload:
+        - per header of STAT_HEADERS: u32 number of new values, then each
+          value as u32 length + UTF-8 bytes
+        - u32 length + UTF-8 bytes of the concatenated urls
+        - u32 end offset of each url, then u32 codes per header, then u8
+          error codes (indexes of STORE_ERROR_CODES), then u8 inferred
+          flags
+        Sections are padded to 4 bytes so columns can be mapped in place.
+
+        Methods
+        -------
+        write(site: SiteInfos) -> None
+            Adds a site to the file.
+
+        write_line(line: str) -> None
+            Adds a site serialized to JSON by a validated SiteInfos,
+            without validating it again.
+
+        flush() -> None
+            Writes the buffered sites as a chunk.
+
+        close() -> None
+            Writes the last chunk and closes the file.
+    """
+
+    CHUNK_ROWS: int = 65536
+
+    def __init__(self, path: str | Path, chunk_rows: int = CHUNK_ROWS) -> None:
+        self.path = Path(path)
+        self.chunk_rows = max(chunk_rows, 1)
+        self._file: IO[bytes] = open(self.path, "wb")
+        self._file.write(COLUMNAR_MAGIC)
+        self._codes: Dict[str, Dict[str, int]] = {
+            field: {} for field in STAT_HEADERS
+        }
+        self._new_values: Dict[str, List[str]] = {
+            field: [] for field in STAT_HEADERS
+        }
+        self._reset()
+
+    def _reset(self) -> None:
+        self._urls = bytearray()
+        self._url_ends: array = array("I")
+        self._columns: Dict[str, array] = {
+            field: array("I") for field in STAT_HEADERS
+        }
+        self._errors: array = array("B")
+        self._inferred: array = array("B")
+
+    def _encode(self, field: str, value: str | None) -> int:
+        if value is None:
+            return 0
+        codes: Dict[str, int] = self._codes[field]
+        code: int | None = codes.get(value)
+        if code is None:
+            # Code 0 is None
+            code = codes[value] = len(codes) + 1
+            self._new_values[field].append(value)
+        return code
+
+    def _append(
+            self,
+            url: str,
+            values: Dict[str, Any],
+            err_code: ErrorCode | None,
+            inferred: bool,
+            ) -> None:
+        self._urls += url.encode()
+        self._url_ends.append(len(self._urls))
+        for field in STAT_HEADERS:
+            self._columns[field].append(
+                self._encode(field, values.get(field))
+                )
+        self._errors.append(STORE_ERROR_CODES.index(err_code))
+        self._inferred.append(inferred)
+        if len(self._errors) >= self.chunk_rows:
+            self.flush()
+
+    def write(self, site: SiteInfos) -> None:
+        self._append(
+            site.url,
+            {field: getattr(site, field) for field in STAT_HEADERS},
+            site.err_code,
+            site.inferred,
+            )
+
+    def write_line(self, line: str) -> None:
+        row: Dict[str, Any] = json.loads(line)
+        err_code: str | None = row.get("err_code")
+        self._append(
+            row["url"],
+            row,
+            ErrorCode(err_code) if err_code else None,
+            bool(row.get("inferred")),
+            )
+
+    def flush(self) -> None:
+        rows: int = len(self._errors)
+        if not rows:
+            return
+        parts: List[bytes] = []
+        for field in STAT_HEADERS:
+            parts.append(LENGTH.pack(len(self._new_values[field])))
+            for value in self._new_values[field]:
+                encoded: bytes = value.encode()
+                parts += [LENGTH.pack(len(encoded)), encoded]
+            self._new_values[field].clear()
+        size: int = sum(map(len, parts))
+        parts.append(b"\0" * _pad(size))
+        parts += [
+            LENGTH.pack(len(self._urls)),
+            bytes(self._urls),
+            b"\0" * _pad(len(self._urls)),
+            _to_bytes(self._url_ends),
+        ]
+        parts += [_to_bytes(self._columns[field]) for field in STAT_HEADERS]
+        parts += [self._errors.tobytes(), self._inferred.tobytes()]
+        payload: bytes = b"".join(parts)
+        payload += b"\0" * _pad(len(payload))
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, rows, len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self._reset()
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> "ColumnarSink":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc: BaseException | None,
+            traceback: TracebackType | None,
+            ) -> None:
+        self.close()
+
+
+class _Chunk():
+    def __init__(
+            self,
+            rows: int,
+            urls: int,
+            url_bytes: int,
+            has_inferred: bool,
+            ) -> None:
+        self.rows = rows
+        # Offsets of the urls and of the url end offsets in the file, the
+        # code columns follow
+        self.urls = urls
+        self.url_bytes = url_bytes
+        self.ends: int = urls + url_bytes + _pad(url_bytes)
+        self.has_inferred = has_inferred
+
+    def column(self, index: int) -> Tuple[int, int]:
+        start: int = self.ends + 4 * self.rows * (index + 1)
+        return start, start + 4 * self.rows
+
+    def errors(self) -> Tuple[int, int]:
+        start: int = self.column(len(STAT_HEADERS) - 1)[1]
+        return start, start + self.rows
+
+    def inferred(self) -> Tuple[int, int]:
+        start: int = self.errors()[1]
+        return start, start + self.rows
+
+
+class ColumnarFile():
+    """
+        Columnar file written by `ColumnarSink`, memory-mapped for offline
+        statistics.
+
+        Only the dictionaries are decoded when the file is opened. The
+        columns are read in place from the mapping, so computing the stats
+        of millions of sites needs neither a refetch nor loading the sites
+        into memory. A truncated last chunk, from a scan killed while it
+        was writing, is ignored. Files written before the inferred flags
+        were stored read as not inferred. Used as a context manager.
+
+        Attributes
+        ----------
+        values : Dict[str, List[str | None]]
+            Distinct values of each header, indexed by their codes.
+
+        Methods
+        -------
+        chunks() -> Iterator[ColumnChunk]
+            The error codes, code columns and urls of each chunk.
+
+        aggregate() -> HeaderAggregator
+            Statistics of all the sites, counted over the mapped columns.
+
+        rows() -> Iterator[Dict[str, Any]]
+            The sites as JSON-compatible dicts, in the SiteInfos format.
+
+        results() -> Results
+            Loads the sites into a `Results`.
+
+        close() -> None
+            Unmaps and closes the file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._file: IO[bytes] = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic: bytes = self._map[:len(COLUMNAR_MAGIC)]
+        if magic not in (COLUMNAR_MAGIC, COLUMNAR_V1_MAGIC):
+            self.close()
+            raise ValueError(f"{self.path} is not a nyfitsa columnar file")
+        self._has_inferred: bool = magic == COLUMNAR_MAGIC
+        self.values: Dict[str, List[str | None]] = {
+            field: [None] for field in STAT_HEADERS
+        }
+        self._chunks: List[_Chunk] = []
+        self._index()
+
+    def _index(self) -> None:
+        offset: int = len(COLUMNAR_MAGIC)
+        size: int = len(self._map)
+        while offset + CHUNK_HEADER.size <= size:
+            magic, rows, payload = CHUNK_HEADER.unpack_from(self._map, offset)
+            offset += CHUNK_HEADER.size
+            if magic != CHUNK_MAGIC or offset + payload > size:
+                break
+            position: int = offset
+            for field in STAT_HEADERS:
+                (count,) = LENGTH.unpack_from(self._map, position)
+                position += LENGTH.size
+                for _ in range(count):
+                    (length,) = LENGTH.unpack_from(self._map, position)
+                    position += LENGTH.size
+                    self.values[field].append(
+                        self._map[position:position + length].decode()
+                        )
+                    position += length
+            position += _pad(position - offset)
+            (url_bytes,) = LENGTH.unpack_from(self._map, position)
+            self._chunks.append(_Chunk(
+                rows, position + LENGTH.size, url_bytes, self._has_inferred
+                ))
+            offset += payload
+
+    def _array(self, typecode: str, start: int, end: int) -> array:
+        values: array = array(typecode, self._map[start:end])
+        if SWAP:
+            values.byteswap()
+        return values
+
+    def __len__(self) -> int:
+        return sum(chunk.rows for chunk in self._chunks)
+
+    def chunks(self) -> Iterator[ColumnChunk]:
+        """
+            Yields the (errors, columns, urls) of each chunk, the columns
+            being views of the mapping valid until the next chunk.
+        """
+        view = memoryview(self._map)
+        try:
+            for chunk in self._chunks:
+                errors = view[slice(*chunk.errors())]
+                columns: Dict[str, Sequence[int]] = {
+                    field: (
+                        self._array("I", *chunk.column(index)) if SWAP
+                        else view[slice(*chunk.column(index))].cast("I")
+                        )
+                    for index, field in enumerate(STAT_HEADERS)
+                }
+                try:
+                    yield errors, columns, self._urls(chunk)
+                finally:
+                    for column in columns.values():
+                        if isinstance(column, memoryview):
+                            column.release()
+                    errors.release()
+        finally:
+            view.release()
+
+    def _urls(self, chunk: _Chunk) -> Iterator[str]:
+        ends: array = self._array(
+            "I", chunk.ends, chunk.ends + 4 * chunk.rows
+            )
+        urls: bytes = self._map[chunk.urls:chunk.urls + chunk.url_bytes]
+        start: int = 0
+        for end in ends:
+            yield urls[start:end].decode()
+            start = end
+
+    def aggregate(self) -> HeaderAggregator:
+        aggregator = HeaderAggregator()
+        for errors, columns, _ in self.chunks():
+            aggregator.merge(aggregate_columns(errors, columns, self.values))
+        return aggregator
+
+    def _inferred(self, chunk: _Chunk) -> bytes:
+        if not chunk.has_inferred:
+            return bytes(chunk.rows)
+        return self._map[slice(*chunk.inferred())]
+
+    def __iter__(self) -> Iterator[SiteInfos]:
+        for chunk in self._chunks:
+            columns: List[array] = [
+                self._array("I", *chunk.column(index))
+                for index in range(len(STAT_HEADERS))
+            ]
+            errors: bytes = self._map[slice(*chunk.errors())]
+            inferred: bytes = self._inferred(chunk)
+            for row, url in enumerate(self._urls(chunk)):
+                yield SiteInfos.model_construct(
+                    url=url,
+                    err_code=STORE_ERROR_CODES[errors[row]],
+                    inferred=bool(inferred[row]),
+                    **{
+                        field: self.values[field][columns[index][row]]
+                        for index, field in enumerate(STAT_HEADERS)
+                    },
+                )
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for chunk in self._chunks:
+            columns: List[array] = [
+                self._array("I", *chunk.column(index))
+                for index in range(len(STAT_HEADERS))
+            ]
+            errors: bytes = self._map[slice(*chunk.errors())]
+            inferred: bytes = self._inferred(chunk)
+            for row, url in enumerate(self._urls(chunk)):
+                site: Dict[str, Any] = {"url": url}
+                for index, field in enumerate(STAT_HEADERS):
+                    site[field] = self.values[field][columns[index][row]]
+                err_code: ErrorCode | None = STORE_ERROR_CODES[errors[row]]
+                site["err_code"] = err_code.value if err_code else None
+                site["inferred"] = bool(inferred[row])
+                yield site
+
+    def results(self) -> Results:
+        return Results(site_infos=SiteStore(self))
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "ColumnarFile":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc: BaseException | None,
+            traceback: TracebackType | None,
+            ) -> None:
+        self.close()
+
+
+def load_columnar(path: str | Path) -> ColumnarFile:
+    return ColumnarFile(path)
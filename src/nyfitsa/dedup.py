@@ -0,0 +1,154 @@
+import hashlib
+import math
+from typing import Dict, Iterable, Iterator, Set
+from urllib.parse import urlsplit, urlunsplit
+
+from .nyfitsa import ScanSummary
+
+DEFAULT_PORTS: Dict[str, int] = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+        Canonical spelling of a url: "http://" is added to bare domains,
+        the scheme and host are lowercased, default ports and fragments
+        dropped, and an empty path becomes "/". Urls that cannot be parsed
+        are returned stripped, the engines report them as errors.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = f"http://{url}"
+    try:
+        parts = urlsplit(url)
+        port: int | None = parts.port
+    except ValueError:
+        return url
+    scheme: str = parts.scheme.lower()
+    netloc: str = (parts.hostname or "").lower()
+    if ":" in netloc:
+        # IPv6 literal
+        netloc = f"[{netloc}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username is not None:
+        userinfo: str = parts.netloc.rpartition("@")[0]
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def url_key(url: str) -> str:
+    """
+        Key of a normalized url in the deduplication index: a trailing
+        slash does not make a different page.
+    """
+    path, question, query = url.partition("?")
+    if path.count("/") > 3:
+        path = path.rstrip("/")
+    return path + question + query
+
+
+def _digest(key: str, size: int) -> bytes:
+    return hashlib.blake2b(key.encode(), digest_size=size).digest()
+
+
+class BloomFilter():
+    """
+        Probabilistic set of strings, in a fixed number of bits.
+
+        Sized for `capacity` items with a `error_rate` probability of
+        false positives: an item never added may be reported as present,
+        an item added is always found.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        if not 0 < error_rate < 1:
+            raise ValueError(
+                f"The error rate is a probability between 0 and 1 "
+                f"excluded, not {error_rate}"
+                )
+        capacity = max(capacity, 1)
+        self.size: int = max(
+            int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8
+            )
+        self.hashes: int = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: str) -> bool:
+        """Adds `key`, returns True if it was (probably) already there."""
+        digest: bytes = _digest(key, 16)
+        # Double hashing: the positions are h1 + i * h2
+        first: int = int.from_bytes(digest[:8], "little")
+        second: int = int.from_bytes(digest[8:], "little") | 1
+        present: bool = True
+        for index in range(self.hashes):
+            bit: int = (first + index * second) % self.size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self._bits[byte] & mask:
+                present = False
+                self._bits[byte] |= mask
+        return present
+
+
+class UrlDeduplicator():
+    """
+        Normalization and deduplication stage in front of the fetches.
+
+        Each url is normalized, and only the first occurrence of each
+        canonical url is passed on, so duplicates in the input cost
+        neither a request nor a share of the percentages. The index keeps
+        a 64-bit hash per url rather than the url itself. For inputs too
+        large even for that, `bloom_capacity` swaps it for a Bloom filter
+        of fixed size: memory no longer grows, but a url wrongly seen as
+        a duplicate is dropped with probability `error_rate`.
+
+        Attributes
+        ----------
+        unique : int
+            Urls passed on.
+        duplicates : int
+            Urls dropped as duplicates.
+
+        Methods
+        -------
+        deduplicate(urls: Iterable[str]) -> Iterator[str]
+            Lazily yields the normalized urls not seen before.
+
+        report(summary: ScanSummary) -> None
+            Copies the counters into the run summary.
+    """
+
+    def __init__(
+            self,
+            bloom_capacity: int | None = None,
+            error_rate: float = 0.001,
+            ) -> None:
+        self.unique: int = 0
+        self.duplicates: int = 0
+        self._hashes: Set[int] = set()
+        self._bloom: BloomFilter | None = (
+            BloomFilter(bloom_capacity, error_rate)
+            if bloom_capacity is not None else None
+            )
+
+    def seen(self, url: str) -> bool:
+        """Records a normalized url, returns True if it was seen before."""
+        key: str = url_key(url)
+        if self._bloom is not None:
+            return self._bloom.add(key)
+        digest: int = int.from_bytes(_digest(key, 8), "little")
+        if digest in self._hashes:
+            return True
+        self._hashes.add(digest)
+        return False
+
+    def deduplicate(self, urls: Iterable[str]) -> Iterator[str]:
+        for url in urls:
+            url = normalize_url(url)
+            if self.seen(url):
+                self.duplicates += 1
+                continue
+            self.unique += 1
+            yield url
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("duplicates_removed", self.duplicates)
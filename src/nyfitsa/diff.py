@@ -0,0 +1,266 @@
+import marshal
+import struct
+import tempfile
+from collections import Counter
+from operator import itemgetter
+from pathlib import Path
+from typing import (IO, Any, Callable, Dict, Iterable, Iterator, List, Set,
+                    Tuple)
+
+from .dedup import normalize_url
+from .nyfitsa import STAT_HEADERS, ErrorCode, get_error_key
+from .offline import NO_ERROR, iter_rows
+
+# Fields compared between two scans
+DIFF_FIELDS: Tuple[str, ...] = (*STAT_HEADERS, "err_code")
+# Each scan is split in this many partitions on disk, only one partition of
+# the old scan is indexed in memory at a time
+PARTITIONS: int = 128
+
+# Rows are written to the partitions in batches of this many rows
+BATCH_ROWS: int = 1024
+BATCH_LENGTH = struct.Struct("<I")
+
+# Normalized url, url, then the DIFF_FIELDS in order
+Row = Tuple[str | None, ...]
+_columns: Callable[[Dict[str, Any]], Row] = itemgetter("url", *DIFF_FIELDS)
+
+
+def _to_row(site: Dict[str, Any]) -> Row:
+    # Scans made before the urls were normalized, or with --no-dedup,
+    # spell them differently
+    return (normalize_url(site["url"]), *_columns(site))
+
+
+def _label(row: Row, index: int) -> str:
+    """Value of a field as counted in the stats tables."""
+    value: str | None = row[index + 2]
+    if value is not None:
+        return value
+    if DIFF_FIELDS[index] == "err_code":
+        return NO_ERROR
+    err_code: str | None = row[-1]
+    return get_error_key(ErrorCode(err_code) if err_code else None)
+
+
+class DiffReport():
+    """
+        Counters and transition matrices of a diff between two scans.
+
+        Attributes
+        ----------
+        added : int
+            Urls only in the new scan.
+        removed : int
+            Urls only in the old scan.
+        changed : int
+            Urls in both scans with at least one field changed.
+        unchanged : int
+            Urls in both scans with the same fields.
+        changes : Dict[str, int]
+            Number of urls whose field changed, per field.
+        transitions : Dict[str, Counter[Tuple[str, str]]]
+            For each field, how many urls went from a value to another, as
+            counted in the stats tables (errors and "unavailable" included).
+            Unchanged values are counted on the diagonal.
+
+        Methods
+        -------
+        top_transitions(field: str, limit: int = 10)
+                -> List[Tuple[Tuple[str, str], int]]
+            The most frequent changes of a field.
+
+        print_report(limit: int = 10) -> None
+            Prints the counters and the most frequent changes.
+    """
+
+    def __init__(self) -> None:
+        self.added: int = 0
+        self.removed: int = 0
+        self.changed: int = 0
+        self.unchanged: int = 0
+        self.changes: Dict[str, int] = {field: 0 for field in DIFF_FIELDS}
+        self.transitions: Dict[str, Counter[Tuple[str, str]]] = {
+            field: Counter() for field in DIFF_FIELDS
+        }
+
+    def top_transitions(
+            self,
+            field: str,
+            limit: int = 10,
+            ) -> List[Tuple[Tuple[str, str], int]]:
+        return [
+            (transition, count)
+            for transition, count in self.transitions[field].most_common()
+            if transition[0] != transition[1]
+        ][:limit]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "added": self.added,
+            "removed": self.removed,
+            "changed": self.changed,
+            "unchanged": self.unchanged,
+            "changes": self.changes,
+            "transitions": {
+                field: [
+                    {"old": old, "new": new, "count": count}
+                    for (old, new), count in counter.most_common()
+                ]
+                for field, counter in self.transitions.items()
+            },
+        }
+
+    def print_report(self, limit: int = 10) -> None:
+        print("\n" + "="*50)
+        print("Scan diff")
+        print("="*50)
+        for key in ("added", "removed", "changed", "unchanged"):
+            print(f"- {key}: {getattr(self, key)}")
+        for field in DIFF_FIELDS:
+            if not self.changes[field]:
+                continue
+            print(f"\n{field.replace('_', ' ')}: {self.changes[field]} "
+                  "changed")
+            for (old, new), count in self.top_transitions(field, limit):
+                print(f"- {old} → {new}: {count}")
+        print("="*50 + "\n")
+
+
+def _partition(
+        rows: Iterable[Dict[str, Any]],
+        directory: Path,
+        side: str,
+        partitions: int,
+        ) -> List[Path]:
+    paths: List[Path] = [
+        directory / f"{side}-{index}" for index in range(partitions)
+    ]
+    files: List[IO[bytes]] = [open(path, "wb") for path in paths]
+    batches: List[List[Row]] = [[] for _ in range(partitions)]
+    try:
+        for row in map(_to_row, rows):
+            partition: int = hash(row[0]) % partitions
+            batch: List[Row] = batches[partition]
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                _write_batch(files[partition], batch)
+                batch.clear()
+        for file, batch in zip(files, batches):
+            if batch:
+                _write_batch(file, batch)
+    finally:
+        for file in files:
+            file.close()
+    return paths
+
+
+def _write_batch(file: IO[bytes], batch: List[Row]) -> None:
+    # Length-prefixed: marshal.load reads a file in tiny pieces
+    data: bytes = marshal.dumps(batch)
+    file.write(BATCH_LENGTH.pack(len(data)))
+    file.write(data)
+
+
+def _read_partition(path: Path) -> Iterator[Row]:
+    with open(path, "rb") as file:
+        while header := file.read(BATCH_LENGTH.size):
+            (length,) = BATCH_LENGTH.unpack(header)
+            yield from marshal.loads(file.read(length))
+
+
+def _join(
+        old: Path,
+        new: Path,
+        report: DiffReport,
+        on_record: Callable[[Dict[str, Any]], None] | None,
+        ) -> None:
+    # The last occurrence of a url in the old scan wins
+    index: Dict[str | None, Row] = {
+        row[0]: row for row in _read_partition(old)
+    }
+    seen: Set[str | None] = set()
+    # Unchanged sites are counted per distinct values, and only added to
+    # the transition matrices once the partition is joined
+    unchanged: Counter[Row] = Counter()
+    for row in _read_partition(new):
+        key: str | None = row[0]
+        if key in seen:
+            # Duplicate of a url already compared
+            continue
+        seen.add(key)
+        url: str | None = row[1]
+        before: Row | None = index.pop(key, None)
+        if before is None:
+            report.added += 1
+            if on_record is not None:
+                on_record({"url": url, "change": "added"})
+            continue
+        if before[2:] == row[2:]:
+            unchanged[(None, None, *row[2:])] += 1
+            continue
+        report.changed += 1
+        for position, field in enumerate(DIFF_FIELDS):
+            report.transitions[field][
+                (_label(before, position), _label(row, position))
+                ] += 1
+            if before[position + 2] == row[position + 2]:
+                continue
+            report.changes[field] += 1
+            if on_record is not None:
+                on_record({
+                    "url": url,
+                    "change": "changed",
+                    "field": field,
+                    "old": before[position + 2],
+                    "new": row[position + 2],
+                })
+    for values, count in unchanged.items():
+        report.unchanged += count
+        for position, field in enumerate(DIFF_FIELDS):
+            label: str = _label(values, position)
+            report.transitions[field][(label, label)] += count
+    for before in index.values():
+        report.removed += 1
+        if on_record is not None:
+            on_record({"url": before[1], "change": "removed"})
+
+
+def diff_scans(
+        old: str | Path,
+        new: str | Path,
+        on_record: Callable[[Dict[str, Any]], None] | None = None,
+        partitions: int = PARTITIONS,
+        workdir: str | Path | None = None,
+        ) -> DiffReport:
+    """
+        Compares two scan outputs (any format `iter_rows` reads) by url.
+        Urls are matched once normalized by `normalize_url`, so scans made
+        with and without deduplication can be compared, and the records
+        keep the urls as each scan spells them.
+
+        Both scans are hash-partitioned by url into temporary files in
+        `workdir`, then each partition of the old scan is indexed in a
+        dict and joined with the same partition of the new scan. Memory
+        is bounded by one partition, so two scans of millions of sites can
+        be compared on a small machine, at the cost of writing them once to
+        disk.
+
+        `on_record` receives the change records as they are found:
+        {"url", "change": "added" | "removed"}, or one {"url", "change":
+        "changed", "field", "old", "new"} per changed field.
+    """
+    report = DiffReport()
+    partitions = max(partitions, 1)
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        old_parts: List[Path] = _partition(
+            iter_rows(old), Path(directory), "old", partitions
+            )
+        new_parts: List[Path] = _partition(
+            iter_rows(new), Path(directory), "new", partitions
+            )
+        for old_part, new_part in zip(old_parts, new_parts):
+            _join(old_part, new_part, report, on_record)
+            old_part.unlink()
+            new_part.unlink()
+    return report
@@ -0,0 +1,317 @@
+import json
+import threading
+import time
+import uuid
+import xmlrpc.client
+from collections import deque
+from itertools import islice
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Tuple
+from xmlrpc.server import SimpleXMLRPCServer
+
+from tqdm import tqdm
+
+from .nyfitsa import ErrorCode, HeaderAggregator, ScanSummary, get_error_key
+from .shard import CHUNK_SIZE, ShardResults, ShardScan
+
+# Seconds a worker waits before asking again when every url is leased
+WAIT_INTERVAL: float = 0.5
+# Seconds a worker keeps trying to reach the coordinator when it starts
+CONNECT_TIMEOUT: float = 30.0
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class _Lease():
+    def __init__(self, urls: List[str], deadline: float) -> None:
+        self.urls = urls
+        self.deadline = deadline
+
+
+class Coordinator():
+    """
+        Hands out the urls of a distributed scan in leased chunks and
+        merges what the workers send back.
+
+        A worker leases a chunk of urls, fetches it and completes the lease
+        with the partial aggregate of the chunk and its sites serialized to
+        JSON. A lease that is neither completed nor renewed before
+        `lease_timeout` is considered lost with its worker, and its urls
+        are leased again to another worker. A late completion of an expired
+        lease is ignored, so every url is counted once. The input is read
+        lazily, one chunk at a time.
+
+        The coordinator is served over XML-RPC with `serve`, no broker is
+        needed: workers only need to reach its address.
+
+        Attributes
+        ----------
+        aggregator : HeaderAggregator
+            Statistics of all the completed chunks.
+        summary : ScanSummary
+            Counters of all the completed chunks, plus the number of
+            requeued leases.
+        finished : threading.Event
+            Set once every url has been fetched.
+
+        Methods
+        -------
+        lease(worker: str) -> Dict[str, Any]
+            Returns {"status": "lease", "id": ..., "urls": [...],
+            "renew": seconds}, {"status": "wait"} while every url left is
+            leased, or {"status": "done"}.
+
+        renew(lease_id: str) -> bool
+            Extends a lease, False if it already expired.
+
+        complete(lease_id: str, payload: str) -> bool
+            Merges the results of a lease, False if it already expired.
+
+        release(lease_id: str) -> bool
+            Hands the urls of a lease that was not fetched to the next
+            worker, False if it already expired.
+
+        serve(host: str, port: int) -> SimpleXMLRPCServer
+            Serves the coordinator in a background thread.
+    """
+
+    def __init__(
+            self,
+            urls: Iterable[str],
+            on_line: Callable[[str], None] | None = None,
+            chunk_size: int = CHUNK_SIZE,
+            lease_timeout: float = 300.0,
+            progress: tqdm | None = None,
+            ) -> None:
+        self.on_line = on_line
+        self.chunk_size = chunk_size
+        self.lease_timeout = lease_timeout
+        self.progress = progress
+        self.aggregator = HeaderAggregator()
+        self.summary = ScanSummary()
+        self.finished = threading.Event()
+        self._urls: Iterator[str] = iter(urls)
+        self._exhausted: bool = False
+        self._requeued: Deque[List[str]] = deque()
+        self._leases: Dict[str, _Lease] = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        for lease_id, lease in list(self._leases.items()):
+            if lease.deadline <= now:
+                del self._leases[lease_id]
+                self._requeued.append(lease.urls)
+                self.summary.add("requeued_leases")
+
+    def _next_chunk(self) -> List[str]:
+        if self._requeued:
+            return self._requeued.popleft()
+        if self._exhausted:
+            return []
+        chunk: List[str] = list(islice(self._urls, self.chunk_size))
+        if not chunk:
+            self._exhausted = True
+        return chunk
+
+    def _check_finished(self) -> None:
+        if self._exhausted and not self._requeued and not self._leases:
+            self.finished.set()
+
+    def lease(self, worker: str) -> Dict[str, Any]:
+        with self._lock:
+            now: float = time.monotonic()
+            self._expire(now)
+            chunk: List[str] = self._next_chunk()
+            if not chunk:
+                self._check_finished()
+                return {"status": "done" if self.finished.is_set()
+                        else "wait"}
+            lease_id: str = uuid.uuid4().hex
+            self._leases[lease_id] = _Lease(chunk, now + self.lease_timeout)
+            # Workers renew their lease well before it expires
+            return {"status": "lease", "id": lease_id, "urls": chunk,
+                    "renew": self.lease_timeout / 3}
+
+    def renew(self, lease_id: str) -> bool:
+        with self._lock:
+            lease: _Lease | None = self._leases.get(lease_id)
+            if lease is None:
+                return False
+            lease.deadline = time.monotonic() + self.lease_timeout
+            return True
+
+    def complete(self, lease_id: str, payload: str) -> bool:
+        with self._lock:
+            if self._leases.pop(lease_id, None) is None:
+                # Expired and leased again, the new lease is counted instead
+                return False
+            data: Dict[str, Any] = json.loads(payload)
+            self.aggregator.merge(
+                HeaderAggregator.from_dict(data["aggregator"])
+                )
+            self.summary.merge(data["counters"])
+            if self.on_line is not None:
+                for line in data["sites"]:
+                    self.on_line(line)
+            if self.progress is not None:
+                self.progress.update(data["aggregator"]["total"])
+            self._check_finished()
+            return True
+
+    def release(self, lease_id: str) -> bool:
+        with self._lock:
+            lease: _Lease | None = self._leases.pop(lease_id, None)
+            if lease is None:
+                return False
+            # Leased again before the urls read after it
+            self._requeued.appendleft(lease.urls)
+            return True
+
+    def expire(self) -> None:
+        """Requeues the expired leases, for when no worker asks anymore."""
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def serve(self, host: str, port: int) -> SimpleXMLRPCServer:
+        server = _ThreadingXMLRPCServer(
+            (host, port), logRequests=False, allow_none=True
+            )
+        server.register_function(self.lease, "lease")
+        server.register_function(self.renew, "renew")
+        server.register_function(self.complete, "complete")
+        server.register_function(self.release, "release")
+        threading.Thread(
+            target=server.serve_forever, args=(0.1,), daemon=True
+            ).start()
+        return server
+
+
+class _ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def coordinate(
+        urls: Iterable[str],
+        address: str,
+        on_line: Callable[[str], None] | None = None,
+        summary: ScanSummary | None = None,
+        lease_timeout: float = 300.0,
+        ) -> HeaderAggregator:
+    """
+        Runs the coordinator of a distributed scan on `address` (host:port)
+        until every url has been fetched by the workers.
+
+        Returns the statistics of the whole scan.
+    """
+    with tqdm(desc="Getting sites infos", colour="green") as progress:
+        coordinator = Coordinator(
+            urls, on_line, lease_timeout=lease_timeout, progress=progress
+            )
+        server: SimpleXMLRPCServer = coordinator.serve(
+            *parse_address(address)
+            )
+        try:
+            # Leases of dead workers also expire while nobody asks
+            while not coordinator.finished.wait(1.0):
+                coordinator.expire()
+            # Let the idle workers learn that the scan is done
+            time.sleep(WAIT_INTERVAL * 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+    if summary is not None:
+        summary.merge(coordinator.summary.as_dict())
+    return coordinator.aggregator
+
+
+def _renew_leases(
+        url: str,
+        current: Dict[str, Any],
+        stop: threading.Event,
+        ) -> None:
+    # Own proxy: ServerProxy instances are not thread-safe
+    proxy = xmlrpc.client.ServerProxy(url, allow_none=True)
+    while not stop.wait(current.get("renew", WAIT_INTERVAL)):
+        lease_id: str | None = current.get("id")
+        if lease_id is not None:
+            try:
+                proxy.renew(lease_id)
+            except OSError:
+                pass
+
+
+def run_worker(
+        address: str,
+        scan: ShardScan,
+        deadline: float | None = None,
+        ) -> int:
+    """
+        Runs a worker of the distributed scan coordinated at `address`
+        (host:port): leases chunks of urls, fetches them with `scan` and
+        sends back their partial aggregates and sites, until the
+        coordinator has no url left.
+
+        Past `deadline`, a time.time() value, the worker stops leasing
+        urls, and a chunk whose urls were all skipped is released rather
+        than completed, so that the other workers fetch it.
+
+        Returns the number of sites fetched.
+    """
+    host, port = parse_address(address)
+    url: str = f"http://{host}:{port}"
+    proxy = xmlrpc.client.ServerProxy(url, allow_none=True)
+    worker: str = uuid.uuid4().hex
+    # Lease being fetched, renewed in the background
+    current: Dict[str, Any] = {}
+    stop = threading.Event()
+    threading.Thread(
+        target=_renew_leases,
+        args=(url, current, stop),
+        daemon=True,
+        ).start()
+
+    fetched: int = 0
+    connected: bool = False
+    started: float = time.monotonic()
+    skipped: str = get_error_key(ErrorCode.SKIPPED)
+    try:
+        while True:
+            if deadline is not None and time.time() >= deadline:
+                return fetched
+            try:
+                reply: Dict[str, Any] = proxy.lease(worker)
+            except ConnectionError:
+                # Gone once the scan is done, or not started yet
+                if connected or \
+                        time.monotonic() - started > CONNECT_TIMEOUT:
+                    return fetched
+                time.sleep(WAIT_INTERVAL)
+                continue
+            connected = True
+            if reply["status"] == "done":
+                return fetched
+            if reply["status"] == "wait":
+                time.sleep(WAIT_INTERVAL)
+                continue
+
+            current.update(id=reply["id"], renew=reply["renew"])
+            shard = ShardResults()
+            summary = ScanSummary()
+            scan(reply["urls"], shard, summary)
+            current.pop("id", None)
+            if shard.aggregator.counters["server"].get(skipped) == \
+                    shard.done:
+                # Reached the deadline before fetching any url
+                proxy.release(reply["id"])
+                return fetched
+            proxy.complete(reply["id"], json.dumps({
+                "aggregator": shard.aggregator.as_dict(),
+                "counters": summary.as_dict(),
+                "sites": shard.lines,
+            }))
+            fetched += shard.done
+    finally:
+        stop.set()
@@ -0,0 +1,312 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from .nyfitsa import ErrorCode
+
+# Phases of a request, in the order they happen
+PHASES: Tuple[str, ...] = (
+    "dns",
+    "connect",
+    "tls",
+    "first_byte",
+    "body",
+    "parse",
+    "store",
+    "total",
+)
+# Upper bounds in seconds of the histogram buckets: 100µs doubling up to
+# about 52s, anything slower goes to a last bucket
+BUCKETS: Tuple[float, ...] = tuple(0.0001 * 2 ** i for i in range(20))
+QUANTILES: Tuple[float, ...] = (0.5, 0.9, 0.99)
+# Errors are counted under the value of their ErrorCode
+NO_ERROR: str = "ok"
+
+
+class Histogram():
+    """
+        Fixed log-scale histogram of durations in seconds.
+
+        Recording a value is a binary search in `BUCKETS`, whatever the
+        number of values. Quantiles are the upper bound of their bucket,
+        within a factor of 2 of the exact value. Not thread-safe: guarded
+        by the lock of `ScanMetrics`.
+
+        Methods
+        -------
+        record(seconds: float) -> None
+            Counts a duration.
+
+        quantile(q: float) -> float
+            Upper bound of the bucket holding the `q` quantile.
+
+        as_dict() -> Dict[str, float]
+            Count, mean, quantiles and max, in milliseconds.
+    """
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        rank: float = q * self.count
+        seen: int = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, float]:
+        summary: Dict[str, float] = {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3)
+            if self.count else 0.0,
+        }
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}_ms"] = round(
+                self.quantile(q) * 1000, 3
+                )
+        summary["max_ms"] = round(self.max * 1000, 3)
+        return summary
+
+
+class ScanMetrics():
+    """
+        Live counters and per-phase timing histograms of a scan, shared by
+        the worker threads or coroutines of one process.
+
+        The phases are the ones of `PHASES`: "dns", "connect" and "tls"
+        are recorded once per new connection, "first_byte" (request sent
+        to headers read, connection excluded), "body", "parse" (header
+        extraction) and "total" once per request, and "store" (validation,
+        counting and writing of the site) once per result. DNS is only
+        timed apart when the DNS cache resolves the hosts, otherwise it is
+        part of "connect".
+
+        Attributes
+        ----------
+        in_flight : int
+            Requests started and not finished.
+        completed : int
+            Requests finished, fetched or not.
+        errors : Counter[str]
+            Finished requests per ErrorCode value, "ok" without error.
+        phases : Dict[str, Histogram]
+            One histogram per phase.
+
+        Methods
+        -------
+        record(phase: str, seconds: float) -> None
+            Counts the duration of a phase.
+
+        record_setup(phase: str, seconds: float) -> None
+            Counts a connection phase and adds it to the setup time of the
+            calling thread.
+
+        take_setup() -> float
+            Returns and resets the setup time of the calling thread.
+
+        start() -> None
+            Counts a request in flight.
+
+        finish(err_code: ErrorCode | None, seconds: float) -> None
+            Counts a finished request and its total duration.
+
+        timed(phase: str, function: Callable[..., Any])
+                -> Callable[..., Any]
+            Wraps `function` to record its duration under `phase`.
+
+        snapshot() -> Dict[str, Any]
+            Counters, throughput and histograms, as written to the metrics
+            file and served by `MetricsExporter`.
+
+        print_metrics() -> None
+            Prints the timings of each phase.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight: int = 0
+        self.completed: int = 0
+        self.errors: Counter[str] = Counter()
+        self.phases: Dict[str, Histogram] = {
+            phase: Histogram() for phase in PHASES
+        }
+        self._start: float = time.monotonic()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase].record(seconds)
+
+    def record_setup(self, phase: str, seconds: float) -> None:
+        self.record(phase, seconds)
+        self._local.setup = getattr(self._local, "setup", 0.0) + seconds
+
+    def take_setup(self) -> float:
+        setup: float = getattr(self._local, "setup", 0.0)
+        self._local.setup = 0.0
+        return setup
+
+    def start(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, err_code: ErrorCode | None, seconds: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.errors[err_code.value if err_code else NO_ERROR] += 1
+            self.phases["total"].record(seconds)
+
+    def timed(
+            self,
+            phase: str,
+            function: Callable[..., Any],
+            ) -> Callable[..., Any]:
+        def wrapper(*args: Any) -> Any:
+            start: float = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.record(phase, time.perf_counter() - start)
+        return wrapper
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed: float = time.monotonic() - self._start
+            return {
+                "pid": os.getpid(),
+                "elapsed": round(elapsed, 3),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "urls_per_second": round(self.completed / elapsed, 1)
+                if elapsed else 0.0,
+                "errors": dict(self.errors),
+                "phases": {
+                    phase: histogram.as_dict()
+                    for phase, histogram in self.phases.items()
+                },
+            }
+
+    def print_metrics(self) -> None:
+        snapshot: Dict[str, Any] = self.snapshot()
+        print("\n" + "="*50)
+        print("Timings (ms)")
+        print("="*50)
+        print(f"{'phase':<12}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}"
+              f"{'p99':>9}")
+        for phase, timings in snapshot["phases"].items():
+            if not timings["count"]:
+                continue
+            print(f"{phase:<12}{timings['count']:>8}"
+                  f"{timings['mean_ms']:>9.1f}{timings['p50_ms']:>9.1f}"
+                  f"{timings['p90_ms']:>9.1f}{timings['p99_ms']:>9.1f}")
+        print(f"\n- urls per second: {snapshot['urls_per_second']}")
+        for key, count in sorted(snapshot["errors"].items()):
+            print(f"- {key}: {count}")
+        print("="*50 + "\n")
+
+
+class MetricsExporter():
+    """
+        Exposes the live snapshot of a `ScanMetrics` while scanning.
+
+        The snapshot is rewritten to `path` every `interval` seconds
+        (replaced atomically, so readers never see a partial file), and
+        served as JSON over HTTP on `address` (HOST:PORT) for any GET.
+        Both run in daemon threads until `close`, which writes the file a
+        last time.
+
+        Attributes
+        ----------
+        port : int | None
+            Port the HTTP endpoint listens on, useful with port 0.
+    """
+
+    def __init__(
+            self,
+            metrics: ScanMetrics,
+            path: Path | None = None,
+            address: Tuple[str, int] | None = None,
+            interval: float = 1.0,
+            ) -> None:
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.port: int | None = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._server: ThreadingHTTPServer | None = None
+        if address is not None:
+            self._server = ThreadingHTTPServer(address, self._handler())
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(
+                target=self._server.serve_forever, args=(0.1,), daemon=True
+                ))
+        if path is not None:
+            self._threads.append(
+                threading.Thread(target=self._write_loop, daemon=True)
+                )
+        for thread in self._threads:
+            thread.start()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        metrics: ScanMetrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body: bytes = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        return Handler
+
+    def write(self) -> None:
+        assert self.path is not None
+        partial: Path = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(json.dumps(self.metrics.snapshot()))
+        os.replace(partial, self.path)
+
+    def _write_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.path is not None:
+            self.write()
+
+    def __enter__(self) -> "MetricsExporter":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
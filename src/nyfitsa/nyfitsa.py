@@ -1,22 +1,187 @@
-
+import json
 import os
-from collections import defaultdict
-from concurrent.futures import (ThreadPoolExecutor,
-                                as_completed)
+import socket
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
 from enum import Enum
-from typing import Any, Dict, List, Literal, Tuple
+from itertools import chain
+from threading import Lock
+from typing import (TYPE_CHECKING, Any, Callable, Dict, FrozenSet, Iterable,
+                    Iterator, List, Literal, Mapping, NamedTuple, Sequence,
+                    Set, Sized, Tuple, overload)
 
 import requests
-from pydantic import BaseModel
+from pydantic import (BaseModel, GetCoreSchemaHandler, GetJsonSchemaHandler,
+                      PrivateAttr)
+from pydantic.json_schema import JsonSchemaValue
+from pydantic_core import core_schema
 from requests import Response, structures
-from requests.exceptions import ConnectionError, HTTPError, Timeout
+from requests.exceptions import (ConnectionError, HTTPError,
+                                 RequestException, Timeout)
 from tqdm import tqdm
+from urllib3.exceptions import LocationValueError, NameResolutionError
+
+from .scheduler import InputScheduler, make_scheduler
+
+if TYPE_CHECKING:
+    from .adaptive import AdaptiveConcurrency
+    from .cache import CacheEntry, HeaderCache
+    from .metrics import ScanMetrics
+    from .retry import RetryPolicy
+    from .session import SessionPool
 
 
 class ErrorCode(Enum):
     TIMEOUT = "timeout"
     CONNECTION_ERROR = "connection_error"
     HTTP_ERROR = "http_error"
+    DNS_ERROR = "dns_error"
+    # Not fetched before the deadline of the scan
+    SKIPPED = "skipped"
+
+
+FetchMode = Literal["get", "head"]
+
+
+class Timeouts(NamedTuple):
+    """
+        Timeouts of a request in seconds.
+
+        `connect` bounds opening a connection, `read` each read from the
+        socket, and `total` the whole request, redirects and body
+        included, unlimited if None.
+    """
+    connect: float = 10
+    read: float = 10
+    total: float | None = None
+
+    @property
+    def connect_read(self) -> Tuple[float, float]:
+        """`timeout` argument of requests, no longer than `total`."""
+        total: float = self.total if self.total is not None else float("inf")
+        return min(self.connect, total), min(self.read, total)
+
+    @property
+    def longest(self) -> float:
+        """Longest time a request can take, unless a server drips bytes."""
+        return self.total if self.total is not None \
+            else self.connect + self.read
+
+
+DEFAULT_TIMEOUTS = Timeouts()
+# Chunks read from a body with a total timeout, checked between chunks
+BODY_CHUNK: int = 64 * 1024
+
+# Status codes returned by servers that do not implement HEAD
+HEAD_REJECTED_CODES: Tuple[int, ...] = (405, 501)
+
+
+class ScanSummary():
+    """
+        Thread-safe counters collected while scanning, printed at the end
+        of the run.
+
+        Methods
+        -------
+        add(name: str, value: int = 1) -> None
+            Increments the counter `name` by `value`.
+
+        set(name: str, value: int | float) -> None
+            Overwrites the counter `name`, for ratios computed at the end.
+
+        get(name: str) -> int | float
+            Returns the value of the counter `name`, 0 if it was never set.
+
+        as_dict() -> Dict[str, int | float]
+            Returns a copy of all the counters.
+
+        merge(counters: Dict[str, int | float]) -> None
+            Adds the counters of another summary, such as a shard's. The
+            `GAUGES` keep the highest value instead.
+
+        print_summary() -> None
+            Prints the counters, if any.
+    """
+
+    # Set once per run rather than counted, so never added up
+    GAUGES: FrozenSet[str] = frozenset({
+        "concurrency_final", "concurrency_peak", "cache_hit_ratio",
+    })
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, int | float] = {}
+        self._lock = Lock()
+
+    def add(self, name: str, value: int | float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value: int | float) -> None:
+        with self._lock:
+            self._counters[name] = value
+
+    def get(self, name: str) -> int | float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def as_dict(self) -> Dict[str, int | float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def merge(self, counters: Dict[str, int | float]) -> None:
+        for name, value in counters.items():
+            if name not in self.GAUGES:
+                self.add(name, value)
+                continue
+            with self._lock:
+                self._counters[name] = max(
+                    self._counters.get(name, value), value
+                    )
+
+    def print_summary(self) -> None:
+        counters: Dict[str, int | float] = self.as_dict()
+        if not counters:
+            return
+        print("\n" + "="*50)
+        print("Run summary")
+        print("="*50)
+        for key, value in counters.items():
+            print(f"- {key.replace('_', ' ')}: {value}")
+        print("="*50 + "\n")
+
+
+def content_length(response: Response) -> int:
+    length: str = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else 0
+
+
+def retry_after(headers: Mapping[str, str]) -> float | None:
+    """Seconds to wait from a Retry-After header, in seconds or a date."""
+    value: str = headers.get("Retry-After", "").strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date: datetime = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def http_error_details(
+        status_code: int,
+        headers: Mapping[str, str],
+        ) -> Dict[str, Any]:
+    """Status of a failed fetch, and its Retry-After if any."""
+    details: Dict[str, Any] = {"status_code": status_code}
+    delay: float | None = retry_after(headers)
+    if delay is not None:
+        details["retry_after"] = delay
+    return details
 
 
 class SiteInfos(BaseModel):
@@ -39,8 +204,11 @@ class SiteInfos(BaseModel):
             The content of the X-XSS-Protection header.
         err_code : Optional[ErrorCode]
             The error code if there was an issue retrieving the website.
-        _response : Optional[Response]
-            The response object obtained for the URL.
+        inferred : bool
+            True if the site was not fetched, and its headers are those
+            of another url of the same origin.
+        raw_headers : Optional[Dict[str, str]]
+            All the response headers, only kept when debugging.
     """
     url: str
     server: str | None = None
@@ -50,7 +218,8 @@ class SiteInfos(BaseModel):
     referrer_policy: str | None = None
     xss_protection: str | None = None
     err_code: ErrorCode | None = None
-    _response: Response | None = None
+    inferred: bool = False
+    raw_headers: Dict[str, str] | None = None
 
 
 StatType = Literal[
@@ -62,6 +231,523 @@ StatType = Literal[
     "xss_protection",
 ]
 
+# Fields counted by the statistics, as named in SiteInfos
+STAT_HEADERS: Tuple[str, ...] = (
+    "server",
+    "server_version",
+    "x_frame_options",
+    "x_content_type_options",
+    "referrer_policy",
+    "xss_protection",
+)
+
+
+def get_error_key(err_code: ErrorCode | None) -> str:
+    if err_code is None:
+        return "unavailable"
+
+    error_map: Dict[ErrorCode, str] = {
+        ErrorCode.TIMEOUT: "timeout",
+        ErrorCode.CONNECTION_ERROR: "connection_error",
+        ErrorCode.HTTP_ERROR: "http_error",
+        ErrorCode.DNS_ERROR: "dns_error",
+        ErrorCode.SKIPPED: "skipped",
+    }
+    return error_map.get(err_code, "unavailable")
+
+
+def is_dns_error(error: BaseException) -> bool:
+    """
+        Whether a connection error comes from a failed name resolution,
+        looking through the exceptions wrapped by requests and urllib3.
+    """
+    pending: List[BaseException | None] = [error]
+    seen: Set[int] = set()
+    while pending:
+        current: BaseException | None = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, (socket.gaierror, NameResolutionError)):
+            return True
+        reason: Any = getattr(current, "reason", None)
+        pending += [current.__cause__, current.__context__]
+        pending += [
+            wrapped for wrapped in (reason, *current.args)
+            if isinstance(wrapped, BaseException)
+        ]
+    return False
+
+
+def calculate_percentage(counter: Dict[str, int]) -> Dict[str, float]:
+    total: int = sum(counter.values())
+    if total == 0:
+        return {}
+    return {
+        key: round((qty / total) * 100, 2) for key, qty in counter.items()
+    }
+
+
+def print_stat_table(
+        stat_type: str,
+        stats: Dict[str, float] | None,
+        server_version_stats: Dict[str, Dict[str, float]] | None = None,
+        ) -> None:
+    # Vérifie si des statistiques existent et les imprime
+    if stats is not None:
+        print("\n" + "="*50)
+        print(f"Statistics for: {stat_type.replace('_', ' ').title()}")
+        print("="*50)
+        for key, percentage in stats.items():
+            print(f"- {key}: {percentage:.2f}%")
+            if (
+                server_version_stats is not None
+                and key in server_version_stats
+            ):
+                for version, version_percentage in \
+                        server_version_stats[key].items():
+                    print(
+                        f"  - {version}: {version_percentage:.2f}%"
+                        )
+
+        print("="*50 + "\n")
+    else:
+        print("\n" + "="*50)
+        print(
+            f"No statistics available for: "
+            f"{stat_type.replace('_', ' ').title()}"
+            )
+        print("="*50 + "\n")
+
+
+class HeaderAggregator():
+    """
+        Incremental statistics over a stream of SiteInfos.
+
+        Each site is counted in O(1) when it is added and then dropped, so
+        the memory used only depends on the number of distinct header
+        values. Every table is kept up to date at all times, so any of them
+        can be produced without going through the sites again. The tables
+        are the ones of `Results`, which uses an aggregator for its stats.
+
+        Attributes
+        ----------
+        total : int
+            Number of sites added.
+        counters : Dict[str, Dict[str, int]]
+            Number of sites per value, or per error key, for each header
+            of `STAT_HEADERS`.
+        server_versions : Dict[str, Dict[str, int]]
+            Number of sites per version for each server.
+
+        Methods
+        -------
+        add(site: SiteInfos) -> None
+            Counts a site in every table.
+
+        merge(other: HeaderAggregator) -> None
+            Adds the counts of another aggregator, such as a shard's.
+
+        as_dict() -> Dict[str, Any]
+            JSON-compatible counts, to send an aggregator to another node.
+
+        from_dict(data: Dict[str, Any]) -> HeaderAggregator
+            Rebuilds an aggregator from `as_dict`.
+
+        stats(header: str) -> Dict[str, float]
+            Percentage distribution of the values of `header`.
+
+        stats_server() -> Tuple[Dict[str, float], Dict[str, Dict[str, float]]]
+            Percentage distribution of servers and of their versions.
+
+        stats_server_version(), stats_xss_protection(),
+        stats_x_frames_options(), stats_x_content_type_options(),
+        stats_referrer_policy() -> Dict[str, float]
+            Same tables as the `Results` methods of the same name.
+
+        print_stats(stat_type: StatType | None = None) -> None
+            Prints the statistics for the specified header type.
+    """
+
+    def __init__(self) -> None:
+        self.total: int = 0
+        self.counters: Dict[str, Dict[str, int]] = {
+            header: {} for header in STAT_HEADERS
+        }
+        self.server_versions: Dict[str, Dict[str, int]] = {}
+
+    def add(self, site: SiteInfos) -> None:
+        self.total += 1
+        error_key: str = get_error_key(site.err_code)
+        for header in STAT_HEADERS:
+            value: str | None = getattr(site, header)
+            if value is None or site.err_code is not None:
+                value = error_key
+            counter: Dict[str, int] = self.counters[header]
+            counter[value] = counter.get(value, 0) + 1
+
+        if site.server is not None and site.err_code is None:
+            versions: Dict[str, int] = self.server_versions.setdefault(
+                site.server, {}
+                )
+            # Kept as is, even None, like Results does
+            version: Any = site.server_version
+            versions[version] = versions.get(version, 0) + 1
+
+    def merge(self, other: "HeaderAggregator") -> None:
+        self.total += other.total
+        for header, counter in other.counters.items():
+            merged: Dict[str, int] = self.counters[header]
+            for value, count in counter.items():
+                merged[value] = merged.get(value, 0) + count
+        for server, versions in other.server_versions.items():
+            merged = self.server_versions.setdefault(server, {})
+            for version, count in versions.items():
+                merged[version] = merged.get(version, 0) + count
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "counters": self.counters,
+            # Versions can be None, which is not a valid JSON key
+            "server_versions": [
+                [server, version, count]
+                for server, versions in self.server_versions.items()
+                for version, count in versions.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HeaderAggregator":
+        aggregator = cls()
+        aggregator.total = data["total"]
+        for header, counter in data["counters"].items():
+            aggregator.counters[header] = dict(counter)
+        for server, version, count in data["server_versions"]:
+            aggregator.server_versions.setdefault(server, {})[version] = count
+        return aggregator
+
+    def stats(self, header: str) -> Dict[str, float]:
+        stats: Dict[str, float] = calculate_percentage(self.counters[header])
+        return dict(sorted(stats.items(), key=lambda x: x[1], reverse=True))
+
+    def stats_server(self) -> Tuple[
+            Dict[str, float], Dict[str, Dict[str, float]]
+            ]:
+        server_version_stats: Dict[str, Dict[str, float]] = {
+            server_type: calculate_percentage(versions)
+            for server_type, versions in self.server_versions.items()
+        }
+        return self.stats("server"), server_version_stats
+
+    def stats_server_version(self) -> Dict[str, float]:
+        return self.stats("server_version")
+
+    def stats_xss_protection(self) -> Dict[str, float]:
+        return self.stats("xss_protection")
+
+    def stats_x_frames_options(self) -> Dict[str, float]:
+        return self.stats("x_frame_options")
+
+    def stats_x_content_type_options(self) -> Dict[str, float]:
+        return self.stats("x_content_type_options")
+
+    def stats_referrer_policy(self) -> Dict[str, float]:
+        return self.stats("referrer_policy")
+
+    def print_stats(self, stat_type: StatType | None = None) -> None:
+        if not stat_type:
+            print("No statistic type was provided.")
+            return
+
+        stats: Dict[str, float] | None = None
+        server_version_stats: Dict[str, Dict[str, float]] | None = None
+        if stat_type == "server":
+            stats, server_version_stats = self.stats_server()
+        elif stat_type in STAT_HEADERS:
+            stats = self.stats(stat_type)
+        print_stat_table(stat_type, stats, server_version_stats)
+
+
+# Error codes as stored by SiteStore, 0 is no error
+STORE_ERROR_CODES: Tuple[ErrorCode | None, ...] = (None, *ErrorCode)
+# Error codes, code columns and urls of a block of dictionary-encoded sites
+ColumnChunk = Tuple[Sequence[int], Dict[str, Sequence[int]], Iterable[str]]
+
+
+def aggregate_columns(
+        errors: Sequence[int],
+        columns: Dict[str, Sequence[int]],
+        values: Dict[str, List[str | None]],
+        ) -> HeaderAggregator:
+    """
+        Statistics of dictionary-encoded sites: `errors` indexes
+        STORE_ERROR_CODES, and `columns` index the `values` of each field
+        of STAT_HEADERS, 0 being None. The columns are counted once per
+        (error, value) pair rather than site by site.
+    """
+    aggregator = HeaderAggregator()
+    aggregator.total = len(errors)
+    error_keys: List[str] = [
+        get_error_key(err_code) for err_code in STORE_ERROR_CODES
+    ]
+    for field in STAT_HEADERS:
+        field_values: List[str | None] = values[field]
+        counter: Dict[str, int] = aggregator.counters[field]
+        for (error, code), count in Counter(
+                zip(errors, columns[field])).items():
+            key: str | None = error_keys[error] if error or not code \
+                else field_values[code]
+            assert key is not None
+            counter[key] = counter.get(key, 0) + count
+
+    servers: List[str | None] = values["server"]
+    versions: List[str | None] = values["server_version"]
+    for (error, server, version), count in Counter(zip(
+            errors, columns["server"], columns["server_version"]
+            )).items():
+        if error or not server:
+            continue
+        server_versions: Dict[str, int] = \
+            aggregator.server_versions.setdefault(servers[server], {})
+        value: Any = versions[version]
+        server_versions[value] = server_versions.get(value, 0) + count
+    return aggregator
+
+
+class SiteStore():
+    """
+        Compact columnar storage of SiteInfos.
+
+        Each header field is a column of integer codes into a dictionary of
+        its distinct values, so a value such as "unavailable" or "nginx" is
+        stored once however many sites share it, and the error codes and
+        inferred flags are columns of bytes. The urls are kept encoded in a
+        single buffer. No SiteInfos object is kept: they are rebuilt when
+        the store is read as a sequence, so it can replace a list of
+        SiteInfos. It is a read-only view: the sites read are copies, and
+        changing one does not change the store.
+
+        Methods
+        -------
+        append(site: SiteInfos | Dict[str, Any]) -> None
+            Adds a site at the end of the store.
+
+        extend_rows(rows: Sequence[Dict[str, Any]]) -> None
+            Adds sites in the format of `rows()`, such as sites loaded from
+            a JSON output, without validating them.
+
+        urls() -> Iterator[str]
+            The urls of the sites, in order.
+
+        chunks() -> Iterator[ColumnChunk]
+            The error codes, code columns and urls of the store.
+
+        aggregate(start: int = 0) -> HeaderAggregator
+            Statistics of the sites from `start`, counted over the code
+            columns with `aggregate_columns`.
+
+        rows() -> Iterator[Dict[str, Any]]
+            The sites as JSON-compatible dicts, in the SiteInfos format.
+    """
+
+    def __init__(
+            self,
+            sites: Iterable[SiteInfos | Dict[str, Any]] = (),
+            ) -> None:
+        self._url_data = bytearray()
+        self._url_ends: array[int] = array("Q")
+        self.columns: Dict[str, array[int]] = {
+            field: array("I") for field in STAT_HEADERS
+        }
+        # Code 0 is None in every column
+        self.values: Dict[str, List[str | None]] = {
+            field: [None] for field in STAT_HEADERS
+        }
+        self._codes: Dict[str, Dict[str, int]] = {
+            field: {} for field in STAT_HEADERS
+        }
+        self.err_codes: array[int] = array("B")
+        self.inferred: array[int] = array("B")
+        # Raw headers of the few sites that have them, by index
+        self.raw_headers: Dict[int, Dict[str, str]] = {}
+        for site in sites:
+            self.append(site)
+
+    def _encode(self, field: str, value: str | None) -> int:
+        if value is None:
+            return 0
+        codes: Dict[str, int] = self._codes[field]
+        code: int | None = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[field])
+            self.values[field].append(value)
+        return code
+
+    def append(self, site: SiteInfos | Dict[str, Any]) -> None:
+        if not isinstance(site, SiteInfos):
+            site = SiteInfos.model_validate(site)
+        self._url_data += site.url.encode()
+        self._url_ends.append(len(self._url_data))
+        for field in STAT_HEADERS:
+            self.columns[field].append(
+                self._encode(field, getattr(site, field))
+                )
+        self.err_codes.append(STORE_ERROR_CODES.index(site.err_code))
+        if site.raw_headers is not None:
+            self.raw_headers[len(self.inferred)] = site.raw_headers
+        self.inferred.append(site.inferred)
+
+    def extend_rows(self, rows: Sequence[Dict[str, Any]]) -> None:
+        for index, row in enumerate(rows, len(self)):
+            if row.get("raw_headers") is not None:
+                self.raw_headers[index] = row["raw_headers"]
+        for row in rows:
+            self._url_data += row["url"].encode()
+            self._url_ends.append(len(self._url_data))
+        # One column at a time, with the dictionary lookups of a field
+        # kept local
+        for field in STAT_HEADERS:
+            codes: Dict[str, int] = self._codes[field]
+            values: List[str | None] = self.values[field]
+            column: array[int] = self.columns[field]
+            for row in rows:
+                value: str | None = row.get(field)
+                if value is None:
+                    column.append(0)
+                    continue
+                code: int | None = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+                column.append(code)
+        error_codes: Dict[str | None, int] = {
+            err_code.value if err_code else None: index
+            for index, err_code in enumerate(STORE_ERROR_CODES)
+        }
+        self.err_codes.extend(
+            error_codes[row.get("err_code")] for row in rows
+            )
+        self.inferred.extend(bool(row.get("inferred")) for row in rows)
+
+    def _url(self, index: int) -> str:
+        start: int = self._url_ends[index - 1] if index else 0
+        return self._url_data[start:self._url_ends[index]].decode()
+
+    def _site(self, index: int) -> SiteInfos:
+        # Values come from validated sites, no need to validate them again
+        return SiteInfos.model_construct(
+            url=self._url(index),
+            err_code=STORE_ERROR_CODES[self.err_codes[index]],
+            inferred=bool(self.inferred[index]),
+            raw_headers=self.raw_headers.get(index),
+            **{
+                field: self.values[field][self.columns[field][index]]
+                for field in STAT_HEADERS
+            },
+        )
+
+    def __len__(self) -> int:
+        return len(self.err_codes)
+
+    @overload
+    def __getitem__(self, index: int) -> SiteInfos: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[SiteInfos]: ...
+
+    def __getitem__(
+            self, index: int | slice
+            ) -> SiteInfos | List[SiteInfos]:
+        if isinstance(index, slice):
+            return [self._site(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SiteStore index out of range")
+        return self._site(index)
+
+    def __iter__(self) -> Iterator[SiteInfos]:
+        for index in range(len(self)):
+            yield self._site(index)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (SiteStore, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other)
+            )
+
+    def urls(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self._url(index)
+
+    def chunks(self) -> Iterator[ColumnChunk]:
+        yield self.err_codes, self.columns, self.urls()
+
+    def aggregate(self, start: int = 0) -> HeaderAggregator:
+        return aggregate_columns(
+            self.err_codes[start:],
+            {field: column[start:] for field, column in self.columns.items()},
+            self.values,
+            )
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            err_code: ErrorCode | None = STORE_ERROR_CODES[
+                self.err_codes[index]
+                ]
+            row: Dict[str, Any] = {"url": self._url(index)}
+            for field in STAT_HEADERS:
+                row[field] = self.values[field][self.columns[field][index]]
+            row["err_code"] = err_code.value if err_code else None
+            row["inferred"] = bool(self.inferred[index])
+            row["raw_headers"] = self.raw_headers.get(index)
+            yield row
+
+    @classmethod
+    def _validate(cls, value: Any) -> "SiteStore":
+        if isinstance(value, SiteStore):
+            return value
+        return cls(value)
+
+    @staticmethod
+    def _serialize(
+            store: "SiteStore",
+            info: core_schema.SerializationInfo,
+            ) -> List[Dict[str, Any]]:
+        if info.mode_is_json():
+            return list(store.rows())
+        # Python mode keeps the types of SiteInfos, such as ErrorCode
+        return [site.model_dump() for site in store]
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+            cls,
+            source: Any,
+            handler: GetCoreSchemaHandler,
+            ) -> core_schema.CoreSchema:
+        # Validated from a list of sites and serialized as one, so that
+        # Results keeps its format
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                cls._serialize, info_arg=True,
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(
+            cls,
+            schema: core_schema.CoreSchema,
+            handler: GetJsonSchemaHandler,
+            ) -> JsonSchemaValue:
+        # Neither the validator nor the serializer has a schema: read and
+        # written as a list of sites in both modes
+        return handler(
+            core_schema.list_schema(SiteInfos.__pydantic_core_schema__)
+            )
+
 
 class Results(BaseModel):
     """
@@ -70,9 +756,12 @@ class Results(BaseModel):
 
     ttributes
     ----------
-    site_infos : List[SiteInfos]
-        A list of `SiteInfos` objects, each representing information
-        about a specific website, including headers and response status.
+    site_infos : SiteStore
+        The `SiteInfos` of each website, including headers and response
+        status, in a compact columnar store that reads like a list. A list
+        of `SiteInfos` or of dicts is converted when the model is built.
+        Sites are added with `add_site`; those read from the store are
+        copies, changing them does not change the results.
 
     Methods
     -------
@@ -80,6 +769,10 @@ class Results(BaseModel):
         Calculates the percentage distribution of different
         server types among the websites.
 
+    stats_server_version() -> Dict[str, float]
+        Calculates the percentage distribution of the server
+        versions among the websites.
+
     stats_xss_protection() -> Dict[str, float]
         Calculates the percentage distribution of the
         'X-XSS-Protection' header among the websites.
@@ -100,85 +793,78 @@ class Results(BaseModel):
         stat_type: Literal["server", "xss_protection"] | None = None
         ) -> None
         Prints the statistics for the specified header type, if available.
+
+    add_site(site: SiteInfos | Dict[str, Any]) -> None
+        Appends a site and updates the statistics in O(1).
+
+    to_json(filename: str = "stats.json") -> None
+        Writes the sites as one JSON document, one site at a time.
+
+    to_ndjson(filename: str = "stats.jsonl") -> None
+        Writes the sites as newline-delimited JSON, one site per line.
+
+    All the statistics come from a `HeaderAggregator` counted once over
+    the columns of `site_infos`, so asking for several tables, or for the
+    same table twice, never rescans the sites.
     """
-    site_infos: List[SiteInfos]
+    site_infos: SiteStore
 
-    def _calculate_server_stats(self) -> Tuple[
-            Dict[str, float], Dict[str, Dict[str, float]]
-            ]:
-        counter: Dict[str, int] = defaultdict(int)
-        server_version_counter: Dict[str, Dict[str, int]] = defaultdict(
-            lambda: defaultdict(int)
-            )
+    _aggregator: HeaderAggregator | None = PrivateAttr(default=None)
 
-        for site in self.site_infos:
-            server_value = getattr(site, "server", None)
-            server_version_value = getattr(site, "server_version")
-            if (
-                server_value is not None
-                and site.err_code is None
-            ):
-                counter[server_value] += 1
-                server_version_counter[server_value][server_version_value] += 1
-            else:
-                error_key = self._get_error_key(site.err_code)
-                counter[error_key] += 1
+    @property
+    def aggregator(self) -> HeaderAggregator:
+        """
+            Statistics of `site_infos`, counted over the columns of the
+            store the first time they are needed and then kept up to date
+            by `add_site`.
+        """
+        if self._aggregator is None or \
+                self._aggregator.total > len(self.site_infos):
+            self._aggregator = self.site_infos.aggregate()
+        elif self._aggregator.total < len(self.site_infos):
+            # Sites appended to the store directly are counted here
+            self._aggregator.merge(
+                self.site_infos.aggregate(self._aggregator.total)
+                )
+        return self._aggregator
 
-        stats: Dict[str, float] = self._caclulate_percentage(counter)
-        stats = dict(sorted(stats.items(), key=lambda x: x[1], reverse=True))
+    def __eq__(self, other: object) -> bool:
+        # The aggregator is a cache, only the sites make the value
+        if not isinstance(other, Results):
+            return NotImplemented
+        return self.site_infos == other.site_infos
 
-        server_version_stats: Dict[str, Dict[str, float]] = {}
-        for server_type, versions in server_version_counter.items():
-            total_versions: int = sum(versions.values())
-            server_version_stats[server_type] = {
-                version: round((qty / total_versions) * 100, 2)
-                for version, qty in versions.items()
-            }
+    def add_site(self, site: SiteInfos | Dict[str, Any]) -> None:
+        if not isinstance(site, SiteInfos):
+            site = SiteInfos.model_validate(site)
+        self.site_infos.append(site)
+        if self._aggregator is not None:
+            self._aggregator.add(site)
 
-        return stats, server_version_stats
+    def _calculate_server_stats(self) -> Tuple[
+            Dict[str, float], Dict[str, Dict[str, float]]
+            ]:
+        return self.aggregator.stats_server()
 
     def _caclulate_percentage(
             self, counter: Dict[str, int]
             ) -> Dict[str, float]:
-        total: int = sum(counter.values())
-        if total == 0:
-            return {}
-        return {
-            key: round((qty / total) * 100, 2) for key, qty in counter.items()
-        }
+        return calculate_percentage(counter)
 
     def _get_error_key(self, err_code: ErrorCode | None) -> str:
-        if err_code is None:
-            return "unavailable"
-
-        error_map: Dict[ErrorCode, str] = {
-            ErrorCode.TIMEOUT: "timeout",
-            ErrorCode.CONNECTION_ERROR: "connection_error",
-            ErrorCode.HTTP_ERROR: "http_error",
-        }
-        return error_map.get(err_code, "unavailable")
+        return get_error_key(err_code)
 
     def _calculate_stats(self, header: str) -> Dict[str, float]:
-        counter: Dict[str, int] = defaultdict(int)
-
-        for site in self.site_infos:
-            value = getattr(site, header, None)
-            if value is not None and site.err_code is None:
-                counter[value] += 1
-            else:
-                error_key = self._get_error_key(site.err_code)
-                counter[error_key] += 1
-
-        stats: Dict[str, float] = self._caclulate_percentage(counter)
-        stats = dict(sorted(stats.items(), key=lambda x: x[1], reverse=True))
-
-        return stats
+        return self.aggregator.stats(header)
 
     def stats_server(self) -> Tuple[
             Dict[str, float], Dict[str, Dict[str, float]]
             ]:
         return self._calculate_server_stats()
 
+    def stats_server_version(self) -> Dict[str, float]:
+        return self._calculate_stats("server_version")
+
     def stats_xss_protection(self) -> Dict[str, float]:
         return self._calculate_stats("xss_protection")
 
@@ -195,56 +881,25 @@ class Results(BaseModel):
             self,
             stat_type: StatType | None = None
             ) -> None:
-        stats: Dict[str, float] | None = None
-        server_version_stats: Dict[str, Dict[str, float]] | None = None
-        # Handle case where no `stat_type` is provided
-        if not stat_type:
-            print("No statistic type was provided.")
-            return
-
-        # Appeler la méthode en fonction du type de statistique demandé
-        if stat_type == "server":
-            stats, server_version_stats = self.stats_server()
-        elif stat_type == "xss_protection":
-            stats = self.stats_xss_protection()
-        elif stat_type == "x_frame_options":
-            stats = self.stats_x_frames_options()
-        elif stat_type == "x_content_type_options":
-            stats = self.stats_x_content_type_options()
-        elif stat_type == "referrer_policy":
-            stats = self.stats_referrer_policy()
-        else:
-            stats = None
-
-        # Vérifie si des statistiques existent et les imprime
-        if stats is not None:
-            print("\n" + "="*50)
-            print(f"Statistics for: {stat_type.replace('_', ' ').title()}")
-            print("="*50)
-            for key, percentage in stats.items():
-                print(f"- {key}: {percentage:.2f}%")
-                if (
-                    server_version_stats is not None
-                    and key in server_version_stats
-                ):
-                    for version, version_percentage in \
-                            server_version_stats[key].items():
-                        print(
-                            f"  - {version}: {version_percentage:.2f}%"
-                            )
-
-            print("="*50 + "\n")
-        else:
-            print("\n" + "="*50)
-            print(
-                f"No statistics available for: "
-                f"{stat_type.replace('_', ' ').title()}"
-                )
-            print("="*50 + "\n")
+        self.aggregator.print_stats(stat_type)
 
     def to_json(self, filename: str = "stats.json"):
-        with open(filename, 'w') as f:
-            f.write(self.model_dump_json())
+        # Same document as model_dump_json, written one site at a time
+        # instead of building the whole string in memory
+        with open(filename, 'w', encoding="utf-8") as f:
+            f.write('{"site_infos":[')
+            for index, row in enumerate(self.site_infos.rows()):
+                if index:
+                    f.write(",")
+                f.write(json.dumps(row, ensure_ascii=False,
+                                   separators=(",", ":")))
+            f.write("]}")
+
+    def to_ndjson(self, filename: str = "stats.jsonl"):
+        with open(filename, 'w', encoding="utf-8") as f:
+            for row in self.site_infos.rows():
+                f.write(json.dumps(row, ensure_ascii=False,
+                                   separators=(",", ":")) + "\n")
 
 
 def fetch_headers(response: Response) -> Dict[str, str]:
@@ -259,53 +914,299 @@ def fetch_headers(response: Response) -> Dict[str, str]:
     }
 
 
-def fetching_urls_concurrently(urls: List[str]) -> Results:
-    websites: List[Dict[str, Any]] = []
-    workers: int | None = min(os.cpu_count() or 1, 8)
-
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        future_to_url = {
-            executor.submit(fetch_single_site_infos, url):
-            url for url in urls
-            }
-        for future in tqdm(
-            as_completed(future_to_url),
-            total=len(urls),
-            desc="Getting sites infos",
-            colour="green"
-        ):
-            websites.append(future.result())
-    results = Results.model_validate({"site_infos": websites})
+def fetch_validators(response: Response) -> Dict[str, str | None]:
+    """Validators used to revalidate the cached headers of a site."""
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def parse_site_headers(response: Response) -> Dict[str, str]:
+    headers: Dict[str, str] = fetch_headers(response)
+    return {
+        "server": get_server_version(headers["server"]),
+        "server_version": get_server_version_number(headers["server"]),
+        "x_frame_options": headers["x_frame_options"],
+        "x_content_type_options": headers["x_content_type_options"],
+        "referrer_policy": headers["referrer_policy"],
+        "xss_protection": headers["xss_protection"],
+    }
+
+
+def scan_urls_concurrently(
+        urls: Iterable[str],
+        on_result: Callable[[Dict[str, Any]], None],
+        mode: FetchMode = "get",
+        summary: ScanSummary | None = None,
+        session: "SessionPool | None" = None,
+        max_in_flight: int | None = None,
+        per_host_concurrency: int | None = None,
+        per_host_rps: float | None = None,
+        cache: "HeaderCache | None" = None,
+        workers: int | None = None,
+        controller: "AdaptiveConcurrency | None" = None,
+        retry: "RetryPolicy | None" = None,
+        timeouts: Timeouts = DEFAULT_TIMEOUTS,
+        deadline: float | None = None,
+        keep_headers: bool = False,
+        ) -> None:
+    workers = workers or min(os.cpu_count() or 1, 8)
+    # Enough queued urls to keep the workers busy, without submitting the
+    # whole input at once
+    max_in_flight = max_in_flight or workers * 4
+    if controller is not None:
+        # One thread per request the controller may allow, the number of
+        # submitted urls is the number of requests in flight
+        workers = controller.maximum
+    total: int | None = len(urls) if isinstance(urls, Sized) else None
+    scheduler: InputScheduler = make_scheduler(
+        urls, per_host_concurrency, per_host_rps, retry, deadline,
+        timeouts.longest,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(
+        total=total,
+        desc="Getting sites infos",
+        colour="green"
+    ) as progress:
+        in_flight: Dict[Future[Dict[str, Any]], str] = {}
+        while True:
+            delay: float | None = None
+            while len(in_flight) < (
+                    max_in_flight if controller is None else controller.limit
+                    ):
+                url, delay = scheduler.next_ready(time.monotonic())
+                if url is None:
+                    break
+                in_flight[executor.submit(
+                    fetch_single_site_infos, url, mode, summary, session,
+                    cache, timeouts, keep_headers,
+                    )] = url
+            if scheduler.expired:
+                # The urls still queued would not end by the deadline
+                for future in [f for f in in_flight if f.cancel()]:
+                    url = in_flight.pop(future)
+                    scheduler.release(url, time.monotonic())
+                    on_result(skipped(url, summary))
+                    progress.update()
+            if not in_flight:
+                if scheduler.done:
+                    break
+                # Every host left is waiting for its rate limit
+                time.sleep(delay or 0)
+                continue
+            done, _ = wait(in_flight, delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                now: float = time.monotonic()
+                scheduler.release(url, now)
+                result: Dict[str, Any] = future.result()
+                if controller is not None:
+                    controller.record(result["err_code"])
+                if scheduler.retry(url, result, now):
+                    # Fetched again once its backoff has elapsed
+                    continue
+                on_result(result)
+                progress.update()
+        for url, last in scheduler.drain():
+            on_result(last or skipped(url, summary))
+            progress.update()
+
+
+def skipped(url: str, summary: ScanSummary | None = None) -> Dict[str, Any]:
+    """Result of a url left unfetched by the deadline of the scan."""
+    if summary is not None:
+        summary.add("skipped")
+    return {"url": url, "err_code": ErrorCode.SKIPPED}
+
+
+def fetching_urls_concurrently(
+        urls: List[str],
+        mode: FetchMode = "get",
+        summary: ScanSummary | None = None,
+        session: "SessionPool | None" = None,
+        cache: "HeaderCache | None" = None,
+        ) -> Results:
+    # Sites are counted as they arrive, printing stats needs no extra pass
+    results = Results(site_infos=SiteStore())
+    scan_urls_concurrently(
+        urls, results.add_site, mode, summary, session, cache=cache
+        )
     return results
 
 
-def fetch_single_site_infos(url: str) -> Dict[str, Any]:
+def _fetch_head_first(
+        url: str,
+        summary: ScanSummary | None,
+        session: "SessionPool | None",
+        headers: Dict[str, str] | None = None,
+        timeouts: Timeouts = DEFAULT_TIMEOUTS,
+        ) -> Response:
+    head: Callable[..., Response] = (
+        session.head if session is not None else requests.head
+        )
+    get: Callable[..., Response] = (
+        session.get if session is not None else requests.get
+        )
+    timeout: Tuple[float, float] = timeouts.connect_read
+    response: Response = head(
+        url, timeout=timeout, allow_redirects=True, headers=headers
+        )
+    if response.status_code in HEAD_REJECTED_CODES:
+        # Only the headers are read, the body is left on the socket
+        response = get(url, timeout=timeout, stream=True, headers=headers)
+        response.close()
+    if summary is not None:
+        summary.add("bytes_saved", content_length(response))
+    return response
+
+
+def fetch_single_site_infos(
+        url: str,
+        mode: FetchMode = "get",
+        summary: ScanSummary | None = None,
+        session: "SessionPool | None" = None,
+        cache: "HeaderCache | None" = None,
+        timeouts: Timeouts = DEFAULT_TIMEOUTS,
+        keep_headers: bool = False,
+        ) -> Dict[str, Any]:
+    """
+        Fetches a url and returns the fields of its SiteInfos. The response
+        is dropped once its headers are parsed, with its body and
+        connection, unless `keep_headers` keeps a copy of its raw headers
+        for debugging.
+    """
+    metrics: "ScanMetrics | None" = (
+        session.metrics if session is not None else None
+        )
+    if metrics is None:
+        return _fetch_site_infos(
+            url, mode, summary, session, cache, timeouts, keep_headers
+            )
+    metrics.start()
+    start: float = time.perf_counter()
+    d: Dict[str, Any] = _fetch_site_infos(
+        url, mode, summary, session, cache, timeouts, keep_headers, metrics
+        )
+    metrics.finish(d["err_code"], time.perf_counter() - start)
+    return d
+
+
+def _record_exchange(
+        metrics: "ScanMetrics",
+        response: Response,
+        seconds: float,
+        ) -> None:
+    # requests times each hop from sending the request to its headers,
+    # connection included, the rest of the time is spent on the bodies
+    headers: float = sum(
+        hop.elapsed.total_seconds() for hop in (*response.history, response)
+        )
+    metrics.record(
+        "first_byte", max(headers - metrics.take_setup(), 0.0)
+        )
+    metrics.record("body", max(seconds - headers, 0.0))
+
+
+def _finish_before(response: Response, deadline: float, body: bool) -> None:
+    """
+        Downloads the body of a streamed response, raises Timeout past
+        `deadline` (a time.perf_counter value).
+    """
+    chunks: Iterable[bytes] = response.iter_content(BODY_CHUNK) if body \
+        else ()
+    # Checked before the first chunk too, and chunk by chunk: the body is
+    # dropped as it is read
+    for _ in chain((None,), chunks):
+        if time.perf_counter() > deadline:
+            response.close()
+            raise Timeout(f"Total timeout exceeded for {response.url}")
+
+
+def _fetch_site_infos(
+        url: str,
+        mode: FetchMode,
+        summary: ScanSummary | None,
+        session: "SessionPool | None",
+        cache: "HeaderCache | None",
+        timeouts: Timeouts = DEFAULT_TIMEOUTS,
+        keep_headers: bool = False,
+        metrics: "ScanMetrics | None" = None,
+        ) -> Dict[str, Any]:
     d: Dict[str, Any] = {"url": url}
+    entry: "CacheEntry | None" = (
+        cache.lookup(str(url)) if cache is not None else None
+        )
+    if entry is not None and entry.fresh:
+        # Fresh entry, no request is sent
+        return d | entry.headers | {"err_code": None}
+    # Stale entry: only download the headers again if they changed
+    conditional: Dict[str, str] | None = (
+        (entry.conditional_headers() or None) if entry is not None else None
+        )
+    start: float = time.perf_counter()
+    if metrics is not None:
+        metrics.take_setup()
+    timeout: Tuple[float, float] = timeouts.connect_read
+    # With a total timeout, the body is read in chunks to check the time
+    stream: bool = timeouts.total is not None
     try:
-        # Délai d'attente de 10 secondes
-        response: Response = requests.get(str(url), timeout=10)
+        response: Response
+        if mode == "head":
+            response = _fetch_head_first(
+                str(url), summary, session, conditional, timeouts
+                )
+        elif session is not None:
+            response = session.get(
+                str(url), timeout=timeout, headers=conditional, stream=stream
+                )
+        else:
+            # Délai d'attente de 10 secondes par défaut
+            response = requests.get(
+                str(url), timeout=timeout, headers=conditional, stream=stream
+                )
+        if timeouts.total is not None:
+            _finish_before(response, start + timeouts.total, mode == "get")
+        if metrics is not None:
+            _record_exchange(metrics, response, time.perf_counter() - start)
         response.raise_for_status()
 
-        headers: Dict[str, str] = fetch_headers(response)
-        d |= {
-            "server": get_server_version(headers["server"]),
-            "server_version": get_server_version_number(headers["server"]),
-            "x_frame_options": headers["x_frame_options"],
-            "x_content_type_options": headers["x_content_type_options"],
-            "referrer_policy": headers["referrer_policy"],
-            "xss_protection": headers["xss_protection"],
-            "response": response,
-            "err_code": None,
-        }
+        headers: Dict[str, str]
+        if response.status_code == 304 and entry is not None:
+            assert cache is not None
+            headers = entry.headers
+            cache.revalidate(str(url), **fetch_validators(response))
+        else:
+            parsing: float = time.perf_counter()
+            headers = parse_site_headers(response)
+            if metrics is not None:
+                metrics.record("parse", time.perf_counter() - parsing)
+            if cache is not None:
+                cache.put(str(url), headers, **fetch_validators(response))
+        d |= headers
+        d["err_code"] = None
+        if keep_headers:
+            d["raw_headers"] = dict(response.headers)
 
     except Timeout:
         d["err_code"] = ErrorCode.TIMEOUT
 
-    except ConnectionError:
-        d["err_code"] = ErrorCode.CONNECTION_ERROR
+    except ConnectionError as error:
+        d["err_code"] = ErrorCode.DNS_ERROR if is_dns_error(error) \
+            else ErrorCode.CONNECTION_ERROR
 
-    except HTTPError:
+    except HTTPError as error:
         d["err_code"] = ErrorCode.HTTP_ERROR
+        if error.response is not None:
+            d |= http_error_details(
+                error.response.status_code, error.response.headers
+                )
+
+    except (RequestException, LocationValueError):
+        # Urls that cannot be parsed, unsupported schemes and broken
+        # exchanges, connection errors as with the async engine
+        d["err_code"] = ErrorCode.CONNECTION_ERROR
 
     return d
 
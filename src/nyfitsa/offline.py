@@ -0,0 +1,306 @@
+import json
+import re
+from array import array
+from itertools import compress, islice
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+from .columnar import COLUMNAR_MAGIC, COLUMNAR_V1_MAGIC, ColumnarFile
+from .nyfitsa import (STAT_HEADERS, STORE_ERROR_CODES, ColumnChunk,
+                      HeaderAggregator, SiteStore, aggregate_columns)
+
+# Error filter of the sites fetched without error
+NO_ERROR: str = "ok"
+ERROR_FILTERS: Tuple[str, ...] = tuple(
+    NO_ERROR if err_code is None else err_code.value
+    for err_code in STORE_ERROR_CODES
+)
+
+
+# Host of an absolute url, without its userinfo and port. Faster than
+# urlsplit on millions of distinct urls
+HOST_PATTERN = re.compile(
+    r"[A-Za-z][A-Za-z0-9+.-]*://(?:[^/?#@]*@)?(\[[^\]]*\]|[^/?#:]*)"
+    )
+# Sites loaded from JSON are encoded in batches of this many sites
+LOAD_BATCH: int = 65536
+# Characters read at once from a JSON document
+READ_SIZE: int = 1 << 16
+# Longest site accepted in a JSON document, in characters
+MAX_SITE_SIZE: int = 1 << 24
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def tld_of(url: str) -> str:
+    match: re.Match[str] | None = HOST_PATTERN.match(url)
+    if match is None or match[1].startswith("["):
+        return ""
+    return match[1].rstrip(".").rpartition(".")[2].lower()
+
+
+class ScanFilter():
+    """
+        Selects the sites of a stored scan by top-level domain, error and
+        server family. A site is kept when it matches every filter that is
+        set, so an empty filter keeps every site.
+
+        The error and server filters are resolved once against the
+        dictionaries of the columns, each site then costs a set lookup on
+        its codes. The urls are only parsed when filtering by TLD.
+
+        Attributes
+        ----------
+        tlds : Set[str]
+            Top-level domains to keep, such as "com" or "fr".
+        errors : Set[str]
+            Errors to keep, among ERROR_FILTERS ("ok" for the sites fetched
+            without error).
+        server_families : Tuple[str, ...]
+            Server names to keep, matched case-insensitively on their
+            start: "apache" keeps "Apache" and "Apache-Coyote".
+
+        Methods
+        -------
+        aggregate(chunk: ColumnChunk, values: Dict[str, List[str | None]])
+                -> HeaderAggregator
+            Statistics of the selected sites of a chunk of columns.
+    """
+
+    def __init__(
+            self,
+            tlds: Iterable[str] = (),
+            errors: Iterable[str] = (),
+            server_families: Iterable[str] = (),
+            ) -> None:
+        self.tlds: Set[str] = {tld.lower().lstrip(".") for tld in tlds}
+        self.errors: Set[str] = {error.lower() for error in errors}
+        unknown: Set[str] = self.errors.difference(ERROR_FILTERS)
+        if unknown:
+            raise ValueError(
+                f"Unknown errors {sorted(unknown)}, "
+                f"expected some of {list(ERROR_FILTERS)}"
+                )
+        self.server_families: Tuple[str, ...] = tuple(
+            family.lower() for family in server_families
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.tlds or self.errors or self.server_families)
+
+    def _error_codes(self) -> Set[int]:
+        return {
+            code for code, error in enumerate(ERROR_FILTERS)
+            if error in self.errors
+        }
+
+    def _server_codes(self, servers: List[str | None]) -> Set[int]:
+        return {
+            code for code, server in enumerate(servers)
+            if server is not None
+            and server.lower().startswith(self.server_families)
+        }
+
+    def aggregate(
+            self,
+            chunk: ColumnChunk,
+            values: Dict[str, List[str | None]],
+            ) -> HeaderAggregator:
+        errors, columns, urls = chunk
+        if not self:
+            return aggregate_columns(errors, columns, values)
+        masks: List[Iterator[bool]] = []
+        if self.errors:
+            masks.append(map(self._error_codes().__contains__, errors))
+        if self.server_families:
+            masks.append(map(
+                self._server_codes(values["server"]).__contains__,
+                columns["server"],
+                ))
+        if self.tlds:
+            masks.append(map(self.tlds.__contains__, map(tld_of, urls)))
+        mask: bytes = bytes(masks[0]) if len(masks) == 1 \
+            else bytes(map(all, zip(*masks)))
+        return aggregate_columns(
+            array("B", compress(errors, mask)),
+            {
+                field: array("I", compress(columns[field], mask))
+                for field in STAT_HEADERS
+            },
+            values,
+            )
+
+
+def _json_lines(
+        first: Dict[str, Any],
+        lines: Iterable[str],
+        ) -> Iterator[Dict[str, Any]]:
+    yield first
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # Last line of a journal cut short by a crash
+            if line.endswith("\n"):
+                raise
+
+
+class _JsonReader():
+    """
+        Decodes the JSON values of a text file one at a time, from a
+        window of the file that only grows to hold the value being read.
+    """
+
+    def __init__(self, file: IO[str]) -> None:
+        self._file = file
+        self._decoder = json.JSONDecoder()
+        self._buffer: str = ""
+        self._position: int = 0
+
+    def _read(self) -> bool:
+        if len(self._buffer) - self._position > MAX_SITE_SIZE:
+            raise ValueError(
+                f"Invalid JSON near character {self._position} of "
+                f"{self._file.name}"
+                )
+        chunk: str = self._file.read(READ_SIZE)
+        if not chunk:
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def next_char(self) -> str:
+        """
+            Consumes the next character that is not whitespace, "" at the
+            end of the file.
+        """
+        while True:
+            match = WHITESPACE.match(self._buffer, self._position)
+            assert match is not None
+            self._position = match.end()
+            if self._position < len(self._buffer):
+                self._position += 1
+                return self._buffer[self._position - 1]
+            if not self._read():
+                return ""
+
+    def unread(self) -> None:
+        """Gives back the character returned by `next_char`."""
+        self._position -= 1
+
+    def expect(self, char: str) -> None:
+        found: str = self.next_char()
+        if found != char:
+            raise ValueError(
+                f"Expected {char!r} in {self._file.name}, found "
+                f"{found or 'the end of the file'!r}"
+                )
+
+    def value(self) -> Any:
+        """Decodes the next value, an object or a string."""
+        if not self.next_char():
+            raise ValueError(f"Unexpected end of {self._file.name}")
+        self.unread()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self._buffer, self._position
+                    )
+            except json.JSONDecodeError:
+                # Cut by the end of the window
+                if not self._read():
+                    raise
+                continue
+            self._position = end
+            return value
+
+
+def _document_rows(reader: _JsonReader) -> Iterator[Dict[str, Any]]:
+    # After '{"site_infos"' in the layout of Results.to_json and of
+    # model_dump_json: a single key holding the list of sites
+    reader.expect(":")
+    reader.expect("[")
+    char: str = reader.next_char()
+    if char == "]":
+        return
+    reader.unread()
+    while True:
+        yield reader.value()
+        char = reader.next_char()
+        if char == "]":
+            return
+        if char != ",":
+            raise ValueError(f"Expected ',' or ']', found {char!r}")
+
+
+def is_columnar(path: str | Path) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(COLUMNAR_MAGIC)) in (
+            COLUMNAR_MAGIC, COLUMNAR_V1_MAGIC
+            )
+
+
+def iter_rows(path: str | Path) -> Iterator[Dict[str, Any]]:
+    """
+        The sites of a previous scan output as dicts in the format of
+        `SiteStore.rows()`, read one at a time. The JSON document of
+        `Results.to_json`, a single line, is decoded site by site rather
+        than parsed whole.
+    """
+    if is_columnar(path):
+        with ColumnarFile(path) as columnar:
+            yield from columnar.rows()
+        return
+    with open(path, encoding="utf-8") as file:
+        reader = _JsonReader(file)
+        char: str = reader.next_char()
+        if not char:
+            return
+        if char == "{" and reader.value() == "site_infos":
+            yield from _document_rows(reader)
+            return
+        # Newline-delimited JSON, whose first key is the url
+        file.seek(0)
+        lines: Iterator[str] = filter(str.strip, file)
+        yield from _json_lines(json.loads(next(lines)), lines)
+
+
+def load_scan(path: str | Path) -> SiteStore | ColumnarFile:
+    """
+        Loads the output of a previous scan: the JSON document written by
+        `Results.to_json`, newline-delimited JSON (--stream, --journal,
+        `Results.to_ndjson`) or a columnar export, which is memory-mapped
+        rather than loaded.
+
+        The JSON sites are dictionary-encoded straight into a SiteStore,
+        without building a SiteInfos for each of them.
+    """
+    if is_columnar(path):
+        return ColumnarFile(path)
+    store = SiteStore()
+    rows: Iterator[Dict[str, Any]] = iter_rows(path)
+    while batch := list(islice(rows, LOAD_BATCH)):
+        store.extend_rows(batch)
+    return store
+
+
+def offline_stats(
+        path: str | Path,
+        scan_filter: ScanFilter | None = None,
+        ) -> Tuple[HeaderAggregator, int]:
+    """
+        Statistics of the sites of a previous scan selected by
+        `scan_filter`, computed without fetching anything.
+
+        Returns the statistics and the number of sites in the scan.
+    """
+    scan_filter = scan_filter or ScanFilter()
+    scan: SiteStore | ColumnarFile = load_scan(path)
+    try:
+        aggregator = HeaderAggregator()
+        for chunk in scan.chunks():
+            aggregator.merge(scan_filter.aggregate(chunk, scan.values))
+        return aggregator, len(scan)
+    finally:
+        if isinstance(scan, ColumnarFile):
+            scan.close()
@@ -0,0 +1,205 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, Set
+
+from .nyfitsa import ScanSummary
+from .scheduler import host_of
+
+# Threads resolving the hosts of the urls read ahead
+PREFETCH_WORKERS: int = 16
+
+
+class DnsError(socket.gaierror):
+    """Failed name resolution, also raised for cached failures."""
+
+
+class _Entry():
+    __slots__ = ("addresses", "error", "expires")
+
+    def __init__(
+            self,
+            addresses: List[str] | None,
+            error: str | None,
+            expires: float,
+            ) -> None:
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+
+    def result(self) -> List[str]:
+        if self.addresses is None:
+            raise DnsError(socket.EAI_NONAME, self.error)
+        return self.addresses
+
+
+def _key(host: str) -> str:
+    return host.rstrip(".").lower()
+
+
+class ResolverCache():
+    """
+        DNS cache shared by all the workers of a scan, in both engines.
+
+        A host is resolved once with the system resolver, then its
+        addresses are served from memory until `ttl` expires. Failures are
+        cached for `negative_ttl`, so a dead domain shared by thousands of
+        urls costs a single resolver timeout. Concurrent lookups of a host
+        wait for the first one instead of all querying the resolver.
+        getaddrinfo does not expose the TTLs of the records, hence the
+        fixed ones.
+
+        Attributes
+        ----------
+        ttl : float
+            Seconds the addresses of a host are cached.
+        negative_ttl : float
+            Seconds a failed resolution is cached.
+        max_entries : int
+            Maximum number of cached hosts, the oldest are evicted first.
+        hits : int
+            Lookups served from the cache.
+        misses : int
+            Lookups sent to the resolver.
+        failures : int
+            Lookups that failed.
+
+        Methods
+        -------
+        resolve(host: str) -> List[str]
+            Addresses of a host, raises DnsError if it does not resolve.
+
+        resolve_async(host: str) -> List[str]
+            Same as `resolve`, without blocking the event loop.
+
+        prefetch(urls: Iterable[str], window: int) -> Iterator[str]
+            Yields the urls while resolving the hosts of the next `window`
+            urls in the background.
+
+        report(summary: ScanSummary) -> None
+            Copies the counters into the run summary.
+    """
+
+    def __init__(
+            self,
+            ttl: float = 300.0,
+            negative_ttl: float = 60.0,
+            max_entries: int = 100_000,
+            ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self.failures: int = 0
+        self._entries: Dict[str, _Entry] = {}
+        # Hosts being resolved, set once their entry is stored
+        self._pending: Dict[str, threading.Event] = {}
+        self._queued: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def _cached(self, host: str, now: float) -> _Entry | None:
+        entry: _Entry | None = self._entries.get(host)
+        if entry is None or entry.expires <= now:
+            return None
+        self.hits += 1
+        return entry
+
+    def resolve(self, host: str) -> List[str]:
+        host = _key(host)
+        while True:
+            with self._lock:
+                entry: _Entry | None = self._cached(host, time.monotonic())
+                if entry is not None:
+                    return entry.result()
+                pending: threading.Event | None = self._pending.get(host)
+                if pending is None:
+                    self._pending[host] = threading.Event()
+                    break
+            pending.wait()
+        return self._lookup(host).result()
+
+    def _lookup(self, host: str) -> _Entry:
+        entry: _Entry
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            entry = _Entry(
+                # Resolver order, without duplicates
+                list(dict.fromkeys(str(info[4][0]) for info in infos)),
+                None,
+                time.monotonic() + self.ttl,
+                )
+        except (OSError, UnicodeError) as error:
+            entry = _Entry(
+                None, str(error), time.monotonic() + self.negative_ttl
+                )
+        except BaseException:
+            with self._lock:
+                self._pending.pop(host).set()
+            raise
+        with self._lock:
+            self.misses += 1
+            if entry.addresses is None:
+                self.failures += 1
+            self._entries.pop(host, None)
+            self._entries[host] = entry
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._pending.pop(host).set()
+        return entry
+
+    async def resolve_async(self, host: str) -> List[str]:
+        with self._lock:
+            entry: _Entry | None = self._cached(_key(host), time.monotonic())
+        if entry is not None:
+            return entry.result()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.resolve, host
+            )
+
+    def _prefetch(self, host: str) -> None:
+        with self._lock:
+            self._queued.discard(host)
+        try:
+            self.resolve(host)
+        except DnsError:
+            pass
+
+    def _queue(self, host: str) -> None:
+        host = _key(host)
+        with self._lock:
+            entry: _Entry | None = self._entries.get(host)
+            if (entry is not None and entry.expires > time.monotonic()) \
+                    or host in self._pending or host in self._queued:
+                return
+            self._queued.add(host)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                PREFETCH_WORKERS, thread_name_prefix="nyfitsa-dns"
+                )
+        self._executor.submit(self._prefetch, host)
+
+    def prefetch(self, urls: Iterable[str], window: int) -> Iterator[str]:
+        ahead: Deque[str] = deque()
+        for url in urls:
+            host: str = host_of(url)
+            if host:
+                self._queue(host)
+            ahead.append(url)
+            if len(ahead) > window:
+                yield ahead.popleft()
+        yield from ahead
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("dns_cache_hits", self.hits)
+        summary.set("dns_lookups", self.misses)
+        summary.set("dns_failures", self.failures)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,112 @@
+import random
+from typing import Any, Dict, Tuple
+
+from .nyfitsa import ErrorCode, ScanSummary
+
+# Errors that may be transient
+RETRY_ERRORS: Tuple[ErrorCode, ...] = (
+    ErrorCode.TIMEOUT, ErrorCode.CONNECTION_ERROR
+    )
+# HTTP errors that may be transient: rate limited, overloaded gateway or
+# server
+RETRY_STATUSES: Tuple[int, ...] = (429, 502, 503, 504)
+# Retries always allowed, so that a few failures at the start of a scan
+# are retried before the budget builds up
+MIN_RETRIES: int = 10
+
+
+class RetryPolicy():
+    """
+        Decides whether a failed fetch is retried, and when.
+
+        Timeouts, connection errors and the HTTP errors of `statuses` are
+        retried until a url has been tried `max_attempts` times. The delay
+        before a retry is drawn uniformly between 0 and `backoff`
+        doubled at each attempt, capped at `max_delay` ("full jitter"),
+        or is the Retry-After of the server, capped at `max_delay` too.
+
+        Retries are bounded by a budget: at most `budget` retries per url
+        fetched, plus `MIN_RETRIES`, so that a scan on a failing network
+        does not spend its time retrying. Not thread-safe: fed by the loop
+        of the engine.
+
+        Attributes
+        ----------
+        retries : int
+            Retries scheduled.
+        recovered : int
+            Urls fetched without error after at least one retry.
+        exhausted : int
+            Urls that still failed after `max_attempts` attempts.
+        over_budget : int
+            Failures not retried because the budget was spent.
+
+        Methods
+        -------
+        schedule(url: str, result: Dict[str, Any]) -> float | None
+            Returns the delay before retrying `url`, or None to keep
+            `result`.
+
+        report(summary: ScanSummary) -> None
+            Copies the retry counters into the run summary.
+    """
+
+    def __init__(
+            self,
+            max_attempts: int = 3,
+            backoff: float = 0.5,
+            max_delay: float = 30.0,
+            statuses: Tuple[int, ...] = RETRY_STATUSES,
+            budget: float = 0.1,
+            ) -> None:
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.statuses = statuses
+        self.budget = budget
+        self.retries: int = 0
+        self.recovered: int = 0
+        self.exhausted: int = 0
+        self.over_budget: int = 0
+        self._fetched: int = 0
+        # Attempts so far of the urls being retried only
+        self._attempts: Dict[str, int] = {}
+
+    def retryable(self, result: Dict[str, Any]) -> bool:
+        err_code: ErrorCode | None = result["err_code"]
+        if err_code == ErrorCode.HTTP_ERROR:
+            return result.get("status_code") in self.statuses
+        return err_code in RETRY_ERRORS
+
+    def delay(self, attempt: int, result: Dict[str, Any]) -> float:
+        retry_after: float | None = result.get("retry_after")
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(
+            0, min(self.backoff * 2 ** (attempt - 1), self.max_delay)
+            )
+
+    def schedule(self, url: str, result: Dict[str, Any]) -> float | None:
+        attempt: int | None = self._attempts.pop(url, None)
+        if attempt is None:
+            attempt = 1
+            self._fetched += 1
+        if not self.retryable(result):
+            if attempt > 1 and result["err_code"] is None:
+                self.recovered += 1
+            return None
+        if attempt >= self.max_attempts:
+            self.exhausted += 1
+            return None
+        if self.retries >= self.budget * self._fetched + MIN_RETRIES:
+            self.over_budget += 1
+            return None
+        self.retries += 1
+        self._attempts[url] = attempt + 1
+        return self.delay(attempt, result)
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("retries", self.retries)
+        summary.set("retries_recovered", self.recovered)
+        summary.set("retries_exhausted", self.exhausted)
+        summary.set("retries_over_budget", self.over_budget)
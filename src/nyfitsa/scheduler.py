@@ -0,0 +1,406 @@
+import heapq
+from collections import deque
+from typing import (TYPE_CHECKING, Any, Deque, Dict, Iterable, Iterator, List,
+                    Set, Tuple)
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from .retry import RetryPolicy
+
+# Next url to fetch, or None and how long to wait before asking again
+# (None if nothing can be issued until a fetch completes)
+Ready = Tuple[str | None, float | None]
+# Url never fetched to the end, with its last result if it was fetched
+Unfinished = Tuple[str, Dict[str, Any] | None]
+
+
+def host_of(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+class InputScheduler():
+    """
+        Issues the urls in input order, without any limit.
+
+        Methods
+        -------
+        next_ready(now: float) -> Tuple[str | None, float | None]
+            Returns the next url, or None once the input is exhausted.
+
+        release(url: str, now: float) -> None
+            Called when the fetch of `url` is done.
+
+        acquire(url: str, now: float) -> Tuple[bool, float | None]
+            Starts a fetch of `url` outside of the input, such as a retry,
+            if the limits allow it. Otherwise returns False and how long
+            to wait, or None if a fetch has to complete first. A url
+            acquired is released like the others.
+
+        retry(url: str, result: Dict[str, Any], now: float) -> bool
+            Called with each result once `url` is released. Returns True
+            if the url will be fetched again, and `result` dropped.
+
+        drain() -> Iterator[Tuple[str, Dict[str, Any] | None]]
+            Once the scan is stopped, yields the urls that were not issued,
+            with their last result if they were waiting for a retry.
+    """
+
+    # Set once the scan is stopped by its deadline
+    expired: bool = False
+
+    def __init__(self, urls: Iterable[str]) -> None:
+        self._urls: Iterator[str] = iter(urls)
+        self.done: bool = False
+
+    def next_ready(self, now: float) -> Ready:
+        url: str | None = next(self._urls, None)
+        if url is None:
+            self.done = True
+        return url, None
+
+    def release(self, url: str, now: float) -> None:
+        pass
+
+    def acquire(self, url: str, now: float) -> Tuple[bool, float | None]:
+        return True, None
+
+    def retry(self, url: str, result: Dict[str, Any], now: float) -> bool:
+        return False
+
+    def drain(self) -> Iterator[Unfinished]:
+        for url in self._urls:
+            yield url, None
+
+
+class HostScheduler(InputScheduler):
+    """
+        Politeness scheduler placed in front of the fetch workers.
+
+        Urls are read from the input into a bounded window and grouped by
+        host. Hosts take turns, so lists sorted by domain do not send all
+        the concurrent requests to the same host, and a url is only issued
+        when its host is under both per-host limits.
+
+        Attributes
+        ----------
+        per_host_concurrency : int | None
+            Maximum number of requests in flight per host.
+        per_host_rps : float | None
+            Maximum number of requests per second started per host.
+        window : int
+            Maximum number of urls read ahead of the fetches. Hosts can only
+            be interleaved within the window.
+        done : bool
+            True once every url has been issued.
+
+        Methods
+        -------
+        next_ready(now: float) -> Tuple[str | None, float | None]
+            Returns a url that can be fetched now. Otherwise returns None and
+            how long to wait for a rate limit, or None if a fetch has to
+            complete first.
+
+        release(url: str, now: float) -> None
+            Called when the fetch of `url` is done.
+
+        acquire(url: str, now: float) -> Tuple[bool, float | None]
+            Starts a fetch of `url` outside of the input if its host is
+            under both limits.
+    """
+
+    # Urls read from the input per call, so that the first fetches start
+    # without waiting for the window to fill up
+    FILL_BATCH: int = 64
+    # Rate limits remembered before those elapsed are forgotten
+    FORGET_AT: int = 1024
+
+    def __init__(
+            self,
+            urls: Iterable[str],
+            per_host_concurrency: int | None = None,
+            per_host_rps: float | None = None,
+            window: int = 100_000,
+            ) -> None:
+        super().__init__(urls)
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rps = per_host_rps
+        self.window = max(window, 1)
+        self._interval: float = 1 / per_host_rps if per_host_rps else 0.0
+        self._exhausted: bool = False
+        self._buffered: int = 0
+        self._pending: Dict[str, Deque[str]] = {}
+        self._active: Dict[str, int] = {}
+        self._next_start: Dict[str, float] = {}
+        self._forget_at: int = self.FORGET_AT
+        # Hosts taking turns, and hosts waiting for their rate limit
+        self._ready: Deque[str] = deque()
+        self._timed: List[Tuple[float, str]] = []
+        self._scheduled: Set[str] = set()
+
+    def _can_start(self, host: str) -> bool:
+        return self.per_host_concurrency is None or \
+            self._active.get(host, 0) < self.per_host_concurrency
+
+    def _start(self, host: str, now: float) -> None:
+        self._active[host] = self._active.get(host, 0) + 1
+        if self._interval:
+            self._next_start[host] = now + self._interval
+
+    def _schedule(self, host: str) -> None:
+        if host in self._scheduled or not self._pending.get(host) or \
+                not self._can_start(host):
+            return
+        self._scheduled.add(host)
+        start: float = self._next_start.get(host, 0.0)
+        if start:
+            heapq.heappush(self._timed, (start, host))
+        else:
+            self._ready.append(host)
+
+    def _fill(self, limit: int) -> None:
+        while not self._exhausted and limit and \
+                self._buffered < self.window:
+            url: str | None = next(self._urls, None)
+            if url is None:
+                self._exhausted = True
+                return
+            host: str = host_of(url)
+            self._pending.setdefault(host, deque()).append(url)
+            self._buffered += 1
+            self._schedule(host)
+            limit -= 1
+
+    def _pop_ready(self, now: float) -> str | None:
+        while self._timed and self._timed[0][0] <= now:
+            self._ready.append(heapq.heappop(self._timed)[1])
+        while self._ready:
+            host: str = self._ready.popleft()
+            self._scheduled.discard(host)
+            if not self._pending.get(host) or not self._can_start(host):
+                continue
+            if self._next_start.get(host, 0.0) > now:
+                self._schedule(host)
+                continue
+            url: str = self._pending[host].popleft()
+            self._buffered -= 1
+            self._start(host, now)
+            if not self._pending[host]:
+                del self._pending[host]
+            # Back of the queue: the other hosts go first
+            self._schedule(host)
+            return url
+        return None
+
+    def next_ready(self, now: float) -> Ready:
+        self._fill(self.FILL_BATCH)
+        url: str | None = self._pop_ready(now)
+        # Read further ahead while every buffered host is busy
+        while url is None and not self._exhausted and \
+                self._buffered < self.window:
+            self._fill(self.FILL_BATCH)
+            url = self._pop_ready(now)
+        if url is not None:
+            return url, None
+        if self._exhausted and not self._buffered:
+            self.done = True
+        delay: float | None = (
+            max(self._timed[0][0] - now, 0.0) if self._timed else None
+            )
+        return None, delay
+
+    def release(self, url: str, now: float) -> None:
+        host: str = host_of(url)
+        self._active[host] -= 1
+        if not self._active[host]:
+            del self._active[host]
+            # Forget the hosts that are done to keep memory bounded, once
+            # their rate limit has elapsed: a retry may still come
+            if host not in self._pending and \
+                    self._next_start.get(host, 0.0) <= now:
+                self._next_start.pop(host, None)
+        if len(self._next_start) > self._forget_at:
+            self._forget(now)
+        self._schedule(host)
+
+    def _forget(self, now: float) -> None:
+        for host, start in list(self._next_start.items()):
+            if start <= now and host not in self._active and \
+                    host not in self._pending:
+                del self._next_start[host]
+        self._forget_at = max(2 * len(self._next_start), self.FORGET_AT)
+
+    def acquire(self, url: str, now: float) -> Tuple[bool, float | None]:
+        host: str = host_of(url)
+        if not self._can_start(host):
+            return False, None
+        start: float = self._next_start.get(host, 0.0)
+        if start > now:
+            return False, start - now
+        self._start(host, now)
+        return True, None
+
+    def drain(self) -> Iterator[Unfinished]:
+        for pending in self._pending.values():
+            for url in pending:
+                yield url, None
+        self._pending.clear()
+        yield from super().drain()
+
+
+class RetryScheduler(InputScheduler):
+    """
+        Scheduler re-issuing failed urls once their backoff has elapsed.
+
+        Wraps the scheduler of the input. A url to retry waits in a heap
+        ordered by the time it becomes ready, not in a worker: the workers
+        keep fetching the input meanwhile, and a retry is issued before
+        the input as soon as it is due.
+
+        Retries skip the per-host queues of the input scheduler, but not
+        its limits: a retry due for a host at its concurrency or rate
+        limit waits, and the retries of the other hosts and the input go
+        first. A host answering 429 or 503 is not sent more requests than
+        its limits allow.
+    """
+
+    def __init__(
+            self,
+            scheduler: InputScheduler,
+            policy: "RetryPolicy",
+            ) -> None:
+        self.scheduler = scheduler
+        self.policy = policy
+        # Ready time, then a sequence number so that results are never
+        # compared
+        self._waiting: List[Tuple[float, int, str, Dict[str, Any]]] = []
+        self._sequence: int = 0
+
+    @property
+    def done(self) -> bool:  # type: ignore[override]
+        return self.scheduler.done and not self._waiting
+
+    def next_ready(self, now: float) -> Ready:
+        delays: List[float] = []
+        blocked: List[Tuple[float, int, str, Dict[str, Any]]] = []
+        url: str | None = None
+        while url is None and self._waiting and self._waiting[0][0] <= now:
+            entry = heapq.heappop(self._waiting)
+            started, delay = self.scheduler.acquire(entry[2], now)
+            if started:
+                url = entry[2]
+                continue
+            blocked.append(entry)
+            if delay is not None:
+                delays.append(delay)
+        if url is None and self._waiting:
+            # The next retry to become due
+            delays.append(self._waiting[0][0] - now)
+        for entry in blocked:
+            heapq.heappush(self._waiting, entry)
+        if url is not None:
+            return url, None
+        ready, delay = self.scheduler.next_ready(now)
+        if ready is not None:
+            return ready, delay
+        if delay is not None:
+            delays.append(delay)
+        return None, min(delays) if delays else None
+
+    def release(self, url: str, now: float) -> None:
+        self.scheduler.release(url, now)
+
+    def retry(self, url: str, result: Dict[str, Any], now: float) -> bool:
+        delay: float | None = self.policy.schedule(url, result)
+        if delay is None:
+            return False
+        heapq.heappush(
+            self._waiting, (now + delay, self._sequence, url, result)
+            )
+        self._sequence += 1
+        return True
+
+    def drain(self) -> Iterator[Unfinished]:
+        # The urls waiting for a retry keep their last failure
+        for _, _, url, result in self._waiting:
+            yield url, result
+        self._waiting.clear()
+        yield from self.scheduler.drain()
+
+
+class DeadlineScheduler(InputScheduler):
+    """
+        Stops issuing urls ahead of the deadline of a scan.
+
+        No url is issued once less than `margin` seconds are left, the
+        longest a request can take, so that the fetches in flight end by
+        the deadline. Retries have a lower priority and stop one margin
+        earlier: the urls keep the result of their last attempt. The urls
+        never issued are left to `drain`, to be reported as skipped.
+
+        Attributes
+        ----------
+        deadline : float
+            time.monotonic() value the scan has to end by.
+        expired : bool
+            True once no url can be issued anymore.
+    """
+
+    def __init__(
+            self,
+            scheduler: InputScheduler,
+            deadline: float,
+            margin: float,
+            ) -> None:
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self._cutoff: float = deadline - margin
+        self._retry_cutoff: float = deadline - 2 * margin
+
+    @property
+    def done(self) -> bool:  # type: ignore[override]
+        return self.expired or self.scheduler.done
+
+    def next_ready(self, now: float) -> Ready:
+        if now >= self._cutoff:
+            self.expired = True
+            return None, None
+        url, delay = self.scheduler.next_ready(now)
+        if url is not None or self.scheduler.done:
+            return url, delay
+        # Wake up at the cutoff, even if no fetch completes
+        cutoff: float = self._cutoff - now
+        return None, cutoff if delay is None else min(delay, cutoff)
+
+    def release(self, url: str, now: float) -> None:
+        self.scheduler.release(url, now)
+
+    def retry(self, url: str, result: Dict[str, Any], now: float) -> bool:
+        if now >= self._retry_cutoff:
+            return False
+        return self.scheduler.retry(url, result, now)
+
+    def drain(self) -> Iterator[Unfinished]:
+        return self.scheduler.drain()
+
+
+def make_scheduler(
+        urls: Iterable[str],
+        per_host_concurrency: int | None = None,
+        per_host_rps: float | None = None,
+        retry: "RetryPolicy | None" = None,
+        deadline: float | None = None,
+        margin: float = 0.0,
+        ) -> InputScheduler:
+    scheduler: InputScheduler = (
+        InputScheduler(urls)
+        if per_host_concurrency is None and per_host_rps is None
+        else HostScheduler(urls, per_host_concurrency, per_host_rps)
+        )
+    if retry is not None:
+        scheduler = RetryScheduler(scheduler, retry)
+    if deadline is not None:
+        scheduler = DeadlineScheduler(scheduler, deadline, margin)
+    return scheduler
@@ -0,0 +1,233 @@
+import socket
+import time
+from contextlib import nullcontext
+from threading import BoundedSemaphore, Lock, local
+from typing import TYPE_CHECKING, Any, ContextManager, List
+
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import (ConnectTimeoutError, NameResolutionError,
+                                NewConnectionError)
+from urllib3.util import connection
+
+from .nyfitsa import ScanSummary
+from .resolver import DnsError, ResolverCache
+
+if TYPE_CHECKING:
+    from .metrics import ScanMetrics
+
+
+class SessionPool():
+    """
+        Thread-safe HTTP session layer shared by a whole scan.
+
+        Each thread gets its own `requests.Session` (sessions keep cookies
+        and are not safe to share), but all of them are mounted on the same
+        adapter, so keep-alive connections are reused across threads
+        whenever several URLs live on the same host.
+
+        Attributes
+        ----------
+        pool_maxsize : int
+            Number of connections kept alive per host.
+        max_hosts : int
+            Number of per-host pools cached before the least recently
+            used one is closed.
+        max_connections : int | None
+            Maximum number of connections in use at the same time across
+            all hosts, unlimited if None.
+        resolver : ResolverCache | None
+            DNS cache used to open the connections of both engines, the
+            system resolver is queried for each connection if None.
+        metrics : ScanMetrics | None
+            Receives the timings of the connections and requests of both
+            engines.
+        hits : int
+            Number of requests sent on a reused connection.
+        misses : int
+            Number of requests that had to open a new connection.
+
+        Methods
+        -------
+        get(url: str, **kwargs: Any) -> Response
+            Sends a GET request through the pool.
+
+        head(url: str, **kwargs: Any) -> Response
+            Sends a HEAD request through the pool.
+
+        report(summary: ScanSummary) -> None
+            Copies the hit/miss counters into the run summary.
+    """
+
+    def __init__(
+            self,
+            pool_maxsize: int = 10,
+            max_hosts: int = 1000,
+            max_connections: int | None = None,
+            resolver: ResolverCache | None = None,
+            metrics: "ScanMetrics | None" = None,
+            ) -> None:
+        self.pool_maxsize = pool_maxsize
+        self.max_hosts = max_hosts
+        self.max_connections = max_connections
+        self.resolver = resolver
+        self.metrics = metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = Lock()
+        self._local = local()
+        self._slots: BoundedSemaphore | None = (
+            BoundedSemaphore(max_connections) if max_connections else None
+            )
+        self._adapter = _CountingAdapter(
+            self,
+            pool_connections=max_hosts,
+            pool_maxsize=pool_maxsize,
+            )
+
+    def record(self, reused: bool) -> None:
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def slot(self) -> ContextManager[Any]:
+        if self._slots is None:
+            return nullcontext()
+        return self._slots
+
+    def session(self) -> requests.Session:
+        session: requests.Session | None = getattr(
+            self._local, "session", None
+            )
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs: Any) -> Response:
+        with self.slot():
+            return self.session().request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs: Any) -> Response:
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def report(self, summary: ScanSummary) -> None:
+        summary.set("pool_hits", self.hits)
+        summary.set("pool_misses", self.misses)
+
+    def close(self) -> None:
+        self._adapter.close()
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, pool: SessionPool, **kwargs: Any) -> None:
+        self._session_pool = pool
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        session_pool: SessionPool = self._session_pool
+
+        class CountingMixin():
+            def _get_conn(self, timeout: float | None = None) -> Any:
+                conn = super()._get_conn(timeout)  # type: ignore[misc]
+                # New and dropped connections have no open socket yet
+                session_pool.record(getattr(conn, "sock", None) is not None)
+                return conn
+
+        class CountingHTTPConnectionPool(CountingMixin, HTTPConnectionPool):
+            pass
+
+        class CountingHTTPSConnectionPool(CountingMixin, HTTPSConnectionPool):
+            pass
+
+        resolver: ResolverCache | None = session_pool.resolver
+        metrics: "ScanMetrics | None" = session_pool.metrics
+        if resolver is not None or metrics is not None:
+            CountingHTTPConnectionPool.ConnectionCls = _pool_connection(
+                HTTPConnection, resolver, metrics
+                )
+            CountingHTTPSConnectionPool.ConnectionCls = _pool_connection(
+                HTTPSConnection, resolver, metrics
+                )
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+def _pool_connection(
+        base: type[HTTPConnection],
+        resolver: ResolverCache | None,
+        metrics: "ScanMetrics | None",
+        ) -> Any:
+    """
+        Connection class resolving its host through the DNS cache, if any,
+        and timing its DNS, connect and TLS phases, if `metrics` is set.
+    """
+
+    class PoolConnection(base):  # type: ignore[valid-type,misc]
+        def _new_conn(self) -> socket.socket:
+            # Without the DNS cache, the resolution is part of "connect"
+            self._resolved: float = time.perf_counter()
+            sock: socket.socket = super()._new_conn() if resolver is None \
+                else self._resolve_and_connect()
+            self._connected: float = time.perf_counter()
+            if metrics is not None:
+                metrics.record_setup(
+                    "connect", self._connected - self._resolved
+                    )
+            return sock
+
+        def _resolve_and_connect(self) -> socket.socket:
+            assert resolver is not None
+            try:
+                addresses: List[str] = resolver.resolve(self._dns_host)
+            except DnsError as error:
+                raise NameResolutionError(self.host, self, error) from error
+            if metrics is not None:
+                resolved: float = time.perf_counter()
+                metrics.record_setup("dns", resolved - self._resolved)
+                self._resolved = resolved
+            # Same errors as urllib3, the TLS layer still uses self.host
+            last: OSError | None = None
+            for address in addresses:
+                try:
+                    return connection.create_connection(
+                        (address, self.port),
+                        self.timeout,
+                        source_address=self.source_address,
+                        socket_options=self.socket_options,
+                        )
+                except socket.timeout as error:
+                    raise ConnectTimeoutError(
+                        self,
+                        f"Connection to {self.host} timed out. "
+                        f"(connect timeout={self.timeout})",
+                        ) from error
+                except OSError as error:
+                    last = error
+            raise NewConnectionError(
+                self, f"Failed to establish a new connection: {last}"
+                ) from last
+
+        def connect(self) -> None:
+            super().connect()
+            if metrics is not None and isinstance(self, HTTPSConnection):
+                metrics.record_setup(
+                    "tls", time.perf_counter() - self._connected
+                    )
+
+    return PoolConnection
@@ -0,0 +1,183 @@
+import multiprocessing
+import os
+import queue
+import threading
+from itertools import islice
+from multiprocessing.process import BaseProcess
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Sized,
+                    Tuple)
+
+from tqdm import tqdm
+
+from .nyfitsa import HeaderAggregator, ScanSummary, SiteInfos
+
+# Runs a whole fetch loop over the urls of a shard, calling `on_result` with
+# each result and recording its counters in the summary. Sent to the worker
+# processes, so it has to be picklable: a module-level function, or a
+# functools.partial of one.
+ShardScan = Callable[
+    [Iterable[str], Callable[[Dict[str, Any]], None], ScanSummary], None
+    ]
+
+# Urls sent to a worker at once, and sites sent back at once
+CHUNK_SIZE: int = 256
+
+
+def _shard_urls(chunks: Any) -> Iterator[str]:
+    while True:
+        chunk: List[str] | None = chunks.get()
+        if chunk is None:
+            return
+        yield from chunk
+
+
+class ShardResults():
+    """
+        Sites fetched by a shard: each one is counted in the shard's own
+        aggregator and kept serialized to JSON until it is sent back.
+        Instances are used as the `on_result` callback of the engines.
+
+        Methods
+        -------
+        drain() -> Tuple[int, List[str]]
+            Returns the number of sites done and their JSON lines since the
+            last call.
+    """
+
+    def __init__(self, forward: bool = True) -> None:
+        self.forward = forward
+        self.aggregator = HeaderAggregator()
+        self.lines: List[str] = []
+        self.done: int = 0
+
+    def __call__(self, result: Dict[str, Any]) -> None:
+        site: SiteInfos = SiteInfos.model_validate(result)
+        self.aggregator.add(site)
+        self.done += 1
+        if self.forward:
+            self.lines.append(site.model_dump_json())
+
+    def drain(self) -> Tuple[int, List[str]]:
+        done, lines = self.done, self.lines
+        self.done, self.lines = 0, []
+        return done, lines
+
+
+def _shard_worker(
+        scan: ShardScan,
+        chunks: Any,
+        messages: Any,
+        forward: bool,
+        ) -> None:
+    shard = ShardResults(forward)
+    summary = ScanSummary()
+
+    def on_result(result: Dict[str, Any]) -> None:
+        shard(result)
+        if shard.done == CHUNK_SIZE:
+            messages.put(("sites", *shard.drain()))
+
+    error: str | None = None
+    try:
+        scan(_shard_urls(chunks), on_result, summary)
+    except Exception as exc:
+        error = repr(exc)
+    messages.put(("sites", *shard.drain()))
+    messages.put(("done", shard.aggregator, summary.as_dict(), error))
+
+
+def _feed(urls: Iterable[str], chunks: Any, processes: int) -> None:
+    iterator: Iterator[str] = iter(urls)
+    while chunk := list(islice(iterator, CHUNK_SIZE)):
+        chunks.put(chunk)
+    for _ in range(processes):
+        chunks.put(None)
+
+
+def scan_urls_sharded(
+        urls: Iterable[str],
+        scan: ShardScan,
+        processes: int | None = None,
+        on_line: Callable[[str], None] | None = None,
+        summary: ScanSummary | None = None,
+        ) -> HeaderAggregator:
+    """
+        Shards a scan across worker processes, each running its own fetch
+        loop with `scan`.
+
+        The urls are read lazily and handed out in chunks to the workers
+        as they ask for more, so fast shards are never idle. Each worker
+        validates and counts its own sites, so neither the fetching nor
+        the parsing goes through a single interpreter, and sends back its
+        sites already serialized to JSON, which are passed to `on_line`.
+        The per-shard aggregates and summary counters are merged at the
+        end.
+
+        Returns the statistics of the whole scan.
+    """
+    processes = processes or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    # A few chunks per worker are queued ahead, the input is never read
+    # all at once
+    chunks: Any = context.Queue(maxsize=processes * 2)
+    messages: Any = context.Queue()
+    workers: List[BaseProcess] = [
+        context.Process(
+            target=_shard_worker,
+            args=(scan, chunks, messages, on_line is not None),
+            daemon=True,
+            )
+        for _ in range(processes)
+    ]
+    # The parent shows the progress of the whole scan. tqdm reads its
+    # defaults from the environment when it is imported, so the workers
+    # are started with progress bars disabled
+    disable: str | None = os.environ.get("TQDM_DISABLE")
+    os.environ["TQDM_DISABLE"] = "1"
+    try:
+        for worker in workers:
+            worker.start()
+    finally:
+        if disable is None:
+            del os.environ["TQDM_DISABLE"]
+        else:
+            os.environ["TQDM_DISABLE"] = disable
+    threading.Thread(
+        target=_feed, args=(urls, chunks, processes), daemon=True
+        ).start()
+
+    aggregator = HeaderAggregator()
+    errors: List[str] = []
+    running: int = processes
+    total: int | None = len(urls) if isinstance(urls, Sized) else None
+    with tqdm(
+        total=total,
+        desc="Getting sites infos",
+        colour="green"
+    ) as progress:
+        while running:
+            try:
+                message: Any = messages.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("A shard worker died unexpectedly.")
+                continue
+            if message[0] == "sites":
+                _, done, lines = message
+                if on_line is not None:
+                    for line in lines:
+                        on_line(line)
+                progress.update(done)
+            else:
+                _, shard, counters, error = message
+                aggregator.merge(shard)
+                if summary is not None:
+                    summary.merge(counters)
+                if error is not None:
+                    errors.append(error)
+                running -= 1
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise RuntimeError(f"Shard worker failed: {errors[0]}")
+    return aggregator
@@ -0,0 +1,41 @@
+import gzip
+import io
+import sys
+from pathlib import Path
+from typing import IO, Iterator
+
+GZIP_MAGIC: bytes = b"\x1f\x8b"
+
+
+def _open_binary(path: str | Path) -> io.BufferedReader:
+    if str(path) == "-":
+        return sys.stdin.buffer  # type: ignore[return-value]
+    return open(path, "rb")
+
+
+def read_urls(path: str | Path) -> Iterator[str]:
+    """
+        Lazily yields the urls of a file, one url per line.
+
+        The file is read line by line as urls are consumed, so fetching
+        starts right away whatever the size of the file. Gzip-compressed
+        files are detected from their first bytes, and "-" reads stdin.
+        Blank lines are skipped.
+    """
+    raw: io.BufferedReader = _open_binary(path)
+    binary: IO[bytes] = raw
+    if raw.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        binary = gzip.GzipFile(fileobj=raw)
+    text = io.TextIOWrapper(binary, encoding="utf-8")
+    try:
+        for line in text:
+            url: str = line.strip()
+            if url:
+                yield url
+    finally:
+        if raw is sys.stdin.buffer:
+            # Leave stdin open for the rest of the program
+            text.detach()
+        else:
+            text.close()
+            raw.close()
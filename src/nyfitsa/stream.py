@@ -0,0 +1,236 @@
+import json
+import os
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Dict, Iterator, List
+
+from .nyfitsa import ErrorCode, HeaderAggregator, Results, SiteInfos
+
+
+class JsonlSink():
+    """
+        On-disk sink writing one SiteInfos per line (newline-delimited
+        JSON), as soon as each site is done.
+
+        With `checkpoint`, every line is flushed as soon as it is written,
+        so the file is a journal of the completed sites that survives a
+        crash or a Ctrl-C and can be used to resume the scan.
+
+        Methods
+        -------
+        write(site: SiteInfos) -> None
+            Appends a site to the file.
+
+        write_line(line: str) -> None
+            Appends a site already serialized to JSON.
+
+        close() -> None
+            Flushes and closes the file.
+    """
+
+    def __init__(
+            self,
+            path: str | Path,
+            append: bool = False,
+            checkpoint: bool = False,
+            ) -> None:
+        self.path = Path(path)
+        self._file: IO[str] = open(
+            self.path,
+            "a" if append else "w",
+            # Line buffered: each site reaches the file as soon as it is done
+            buffering=1 if checkpoint else -1,
+            )
+
+    def write(self, site: SiteInfos) -> None:
+        self.write_line(site.model_dump_json())
+
+    def write_line(self, line: str) -> None:
+        self._file.write(line + "\n")
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "JsonlSink":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc: BaseException | None,
+            traceback: TracebackType | None,
+            ) -> None:
+        self.close()
+
+
+class TeeSink():
+    """
+        Writes each site to several sinks, such as the journal of the scan
+        and its columnar export.
+    """
+
+    def __init__(self, *sinks: Any) -> None:
+        self.sinks = sinks
+
+    def write(self, site: SiteInfos) -> None:
+        for sink in self.sinks:
+            sink.write(site)
+
+    def write_line(self, line: str) -> None:
+        for sink in self.sinks:
+            sink.write_line(line)
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def repair_journal(path: str | Path) -> None:
+    """
+        Drops the incomplete last line left by a scan killed while it was
+        writing, so that new sites can be appended after the last complete
+        one.
+    """
+    with open(path, "r+b") as file:
+        position: int = file.seek(0, 2)
+        while position > 0:
+            step: int = min(4096, position)
+            position -= step
+            file.seek(position)
+            newline: int = file.read(step).rfind(b"\n")
+            if newline != -1:
+                file.truncate(position + newline + 1)
+                return
+        file.truncate(0)
+
+
+def drop_skipped(path: str | Path) -> int:
+    """
+        Removes from a journal the sites skipped at the deadline of the
+        run that wrote it, so that resuming fetches them and the journal
+        ends up with one line per url. The journal is rewritten only if it
+        has skipped sites.
+
+        Returns the number of sites removed.
+    """
+    path = Path(path)
+    kept: Path = path.with_name(path.name + ".tmp")
+    removed: int = 0
+    with open(path, "r", encoding="utf-8") as source, \
+            open(kept, "w", encoding="utf-8") as target:
+        for line in source:
+            # Most lines are not even parsed
+            if f'"{ErrorCode.SKIPPED.value}"' in line and \
+                    json.loads(line).get("err_code") == \
+                    ErrorCode.SKIPPED.value:
+                removed += 1
+            else:
+                target.write(line)
+    if removed:
+        os.replace(kept, path)
+    else:
+        kept.unlink()
+    return removed
+
+
+def load_jsonl(path: str | Path) -> Iterator[SiteInfos]:
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield SiteInfos.model_validate_json(line)
+
+
+class StreamingPipeline():
+    """
+        Consumes the fetch results one at a time, without keeping them.
+
+        Each result is validated into a SiteInfos, counted by the
+        aggregator, written to the sink and dropped, so memory stays flat
+        however many urls are scanned. Instances are used as the
+        `on_result` callback of the fetch engines.
+
+        Attributes
+        ----------
+        aggregator : HeaderAggregator
+            Statistics of all the sites seen so far.
+        sink : JsonlSink | TeeSink | None
+            Where the sites are written, None to only keep the statistics.
+        results : Results | None
+            Where the sites are kept when the scan is not streamed, its
+            aggregator is then the one of the pipeline.
+
+        Methods
+        -------
+        restore(site: SiteInfos) -> None
+            Counts a site of a previous run without writing it again.
+
+        add_line(line: str) -> None
+            Keeps and writes a site serialized by a shard, which already
+            validated and counted it. The lines are only parsed, and
+            stored in batches.
+
+        merge(aggregator: HeaderAggregator) -> None
+            Adds the statistics of a shard.
+
+        close() -> None
+            Stores the pending lines and closes the sink.
+    """
+
+    # Lines of the shards parsed before they are stored at once
+    BATCH_ROWS: int = 1024
+
+    def __init__(
+            self,
+            sink: JsonlSink | TeeSink | None = None,
+            aggregator: HeaderAggregator | None = None,
+            results: Results | None = None,
+            ) -> None:
+        self.sink = sink
+        self.results = results
+        if results is not None:
+            aggregator = results.aggregator
+        self.aggregator = aggregator or HeaderAggregator()
+        self._rows: List[Dict[str, Any]] = []
+
+    def restore(self, site: SiteInfos) -> None:
+        if self.results is not None:
+            self.results.add_site(site)
+        else:
+            self.aggregator.add(site)
+
+    def add_line(self, line: str) -> None:
+        if self.results is not None:
+            self._rows.append(json.loads(line))
+            if len(self._rows) >= self.BATCH_ROWS:
+                self._store_rows()
+        if self.sink is not None:
+            self.sink.write_line(line)
+
+    def _store_rows(self) -> None:
+        assert self.results is not None
+        # Counted when the shard aggregator is merged, not appended
+        # through add_site
+        self.results.site_infos.extend_rows(self._rows)
+        self._rows = []
+
+    def merge(self, aggregator: HeaderAggregator) -> None:
+        self.aggregator.merge(aggregator)
+
+    def close(self) -> None:
+        if self._rows:
+            self._store_rows()
+        if self.sink is not None:
+            self.sink.close()
+
+    def __call__(self, result: Dict[str, Any] | SiteInfos) -> None:
+        site: SiteInfos = SiteInfos.model_validate(result)
+        self.restore(site)
+        if self.sink is not None:
+            self.sink.write(site)
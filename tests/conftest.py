@@ -0,0 +1,108 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+import pytest
+
+# path -> (status, headers, delay in seconds)
+Route = Tuple[int, Dict[str, str], float]
+
+
+class LocalServer():
+    def __init__(self, routes: Dict[str, Route]) -> None:
+        self.routes = routes
+        # Paths answering HEAD with 405 Method Not Allowed
+        self.head_rejected: set[str] = set()
+        self.requests: list[Tuple[str, str]] = []
+        # Number of conditional requests answered with 304 Not Modified
+        self.not_modified: int = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, avoid delayed ACKs
+            # on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def _respond(self, send_body: bool) -> None:
+                server.requests.append((self.command, self.path))
+                status, headers, delay = server.routes.get(
+                    self.path, (404, {}, 0.0)
+                    )
+                if delay:
+                    time.sleep(delay)
+                etag: str | None = headers.get("ETag")
+                if etag is not None and \
+                        self.headers.get("If-None-Match") == etag:
+                    server.not_modified += 1
+                    self.send_response_only(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body: bytes = b"x" * 1024
+                # send_response would add its own Server header
+                self.send_response_only(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                self._respond(send_body=True)
+
+            def do_HEAD(self) -> None:
+                if self.path in server.head_rejected:
+                    server.requests.append((self.command, self.path))
+                    self.send_response_only(405)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self._respond(send_body=False)
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        # Clients dropping keep-alive connections are not errors here
+        self.httpd.handle_error = lambda *args: None  # type: ignore
+        self.port: int = self.httpd.server_address[1]
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+
+SECURE_HEADERS: Dict[str, str] = {
+    "Server": "nginx/1.18.1",
+    "X-Frame-Options": "DENY",
+    "X-Content-Type-Options": "nosniff",
+    "Referrer-Policy": "no-referrer",
+    "X-XSS-Protection": "1; mode=block",
+}
+
+
+@pytest.fixture
+def local_server() -> Iterator[LocalServer]:
+    server = LocalServer({
+        "/ok": (200, SECURE_HEADERS, 0.0),
+        "/bare": (200, {"Server": "Apache"}, 0.0),
+        "/redirect": (301, {"Location": "/ok"}, 0.0),
+        "/error": (500, SECURE_HEADERS, 0.0),
+        "/slow": (200, SECURE_HEADERS, 2.0),
+        "/no-head": (200, SECURE_HEADERS, 0.0),
+        "/etag": (200, SECURE_HEADERS | {
+            "ETag": '"v1"',
+            "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT",
+            }, 0.0),
+    })
+    server.head_rejected.add("/no-head")
+    thread = threading.Thread(
+        target=server.httpd.serve_forever, args=(0.05,), daemon=True
+        )
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from pytest import MonkeyPatch
+
+from nyfitsa import adaptive, aio, cli, nyfitsa
+from nyfitsa.adaptive import AdaptiveConcurrency
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.cli import main
+from nyfitsa.nyfitsa import ErrorCode, ScanSummary, scan_urls_concurrently
+
+from .conftest import LocalServer
+
+
+def feed(
+        controller: AdaptiveConcurrency,
+        now: float,
+        count: int,
+        err_code: ErrorCode | None = None,
+        ) -> None:
+    for _ in range(count):
+        controller.record(err_code, now)
+
+
+class TestController():
+    def test_increases_while_throughput_climbs(self):
+        controller = AdaptiveConcurrency(64, initial=4, step=2, interval=0.1)
+        start: float = controller._start
+
+        feed(controller, start + 1, 20)
+        feed(controller, start + 1.5, 20)
+        feed(controller, start + 2, 20)
+
+        assert [step["limit"] for step in controller.trajectory] == \
+            [6, 8, 8]
+        assert [step["action"] for step in controller.trajectory] == \
+            ["increase", "increase", "hold"]
+
+    def test_backs_off_on_error_spike(self):
+        controller = AdaptiveConcurrency(64, initial=32)
+        start: float = controller._start
+
+        feed(controller, start + 1, 20)
+        feed(controller, start + 2, 10)
+        feed(controller, start + 2, 10, ErrorCode.TIMEOUT)
+
+        assert controller.trajectory[-1]["action"] == "backoff"
+        assert controller.limit == 17
+        assert controller.peak == 34
+
+    def test_steady_errors_become_the_baseline(self):
+        controller = AdaptiveConcurrency(64, initial=8, min_samples=30)
+        start: float = controller._start
+
+        # A third of the sites are always down
+        for second in range(1, 4):
+            feed(controller, start + second, 20)
+            feed(controller, start + second, 10, ErrorCode.CONNECTION_ERROR)
+
+        assert [step["action"] for step in controller.trajectory] == \
+            ["increase", "hold", "hold"]
+
+    def test_decreases_when_throughput_drops(self):
+        controller = AdaptiveConcurrency(64, initial=8, step=2)
+        start: float = controller._start
+
+        feed(controller, start + 1, 20)
+        feed(controller, start + 3, 20)
+
+        assert [step["action"] for step in controller.trajectory] == \
+            ["increase", "decrease"]
+        assert controller.limit == 8
+
+    def test_probes_after_held_windows(self):
+        controller = AdaptiveConcurrency(
+            64, initial=8, step=2, probe_after=2
+            )
+        start: float = controller._start
+
+        # Same throughput at every window
+        for second in range(1, 6):
+            feed(controller, start + second, 20)
+
+        assert [step["action"] for step in controller.trajectory] == \
+            ["increase", "hold", "probe", "hold", "probe"]
+        assert controller.limit == 14
+
+    def test_trajectory_is_capped(self, monkeypatch: MonkeyPatch):
+        monkeypatch.setattr(adaptive, "TRAJECTORY_SIZE", 3)
+        controller = AdaptiveConcurrency(64)
+        start: float = controller._start
+
+        for second in range(1, 11):
+            feed(controller, start + second, 20)
+        summary = ScanSummary()
+        controller.report(summary)
+
+        assert [step["time"] for step in controller.trajectory] == \
+            [8, 9, 10]
+        assert summary.get("concurrency_adjustments") == 10
+
+    def test_bounds(self):
+        controller = AdaptiveConcurrency(4, minimum=2, initial=100, step=10)
+        start: float = controller._start
+        assert controller.limit == 4
+
+        feed(controller, start + 1, 20)
+        assert controller.limit == 4
+        feed(controller, start + 2, 20, ErrorCode.TIMEOUT)
+        feed(controller, start + 3, 20, ErrorCode.TIMEOUT)
+        assert controller.limit == 2
+
+    def test_waits_for_enough_samples(self):
+        controller = AdaptiveConcurrency(64, min_samples=20)
+
+        feed(controller, controller._start + 5, 19)
+
+        assert controller.trajectory == []
+
+    def test_report(self):
+        steps: List[Dict[str, Any]] = []
+        controller = AdaptiveConcurrency(64, initial=8, on_step=steps.append)
+        feed(controller, controller._start + 1, 20)
+        summary = ScanSummary()
+
+        controller.report(summary)
+
+        assert steps == controller.trajectory
+        assert summary.as_dict() == {
+            "concurrency_final": 10,
+            "concurrency_peak": 10,
+            "concurrency_adjustments": 1,
+        }
+
+
+class InFlight():
+    """Wraps a fetch function to record the most requests in flight."""
+
+    def __init__(self) -> None:
+        self.current: int = 0
+        self.peak: int = 0
+        self.lock = threading.Lock()
+
+    def enter(self) -> None:
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def exit(self) -> None:
+        with self.lock:
+            self.current -= 1
+
+
+@pytest.fixture
+def urls(local_server: LocalServer) -> List[str]:
+    return [local_server.url("/ok")] * 30
+
+
+def test_threads_engine_follows_the_limit(
+        urls: List[str],
+        monkeypatch: MonkeyPatch,
+        ):
+    in_flight = InFlight()
+    fetch = nyfitsa.fetch_single_site_infos
+
+    def counted(*args: Any) -> Dict[str, Any]:
+        in_flight.enter()
+        time.sleep(0.01)
+        try:
+            return fetch(*args)
+        finally:
+            in_flight.exit()
+
+    monkeypatch.setattr(nyfitsa, "fetch_single_site_infos", counted)
+    controller = AdaptiveConcurrency(16, initial=3, interval=60)
+    results: List[Dict[str, Any]] = []
+
+    scan_urls_concurrently(urls, results.append, controller=controller)
+
+    assert len(results) == 30
+    assert in_flight.peak == 3
+    assert controller._done == 30
+
+
+def test_async_engine_follows_the_limit(
+        urls: List[str],
+        monkeypatch: MonkeyPatch,
+        ):
+    in_flight = InFlight()
+    fetch = aio.fetch_single_site_infos_async
+
+    async def counted(*args: Any) -> Dict[str, Any]:
+        in_flight.enter()
+        await asyncio.sleep(0.01)
+        try:
+            return await fetch(*args)
+        finally:
+            in_flight.exit()
+
+    monkeypatch.setattr(aio, "fetch_single_site_infos_async", counted)
+    controller = AdaptiveConcurrency(16, initial=3, interval=60)
+    results: List[Dict[str, Any]] = []
+
+    scan_urls_async(urls, results.append, controller=controller)
+
+    assert len(results) == 30
+    assert in_flight.peak == 3
+    assert controller._done == 30
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_cli_adaptive(
+        engine: str,
+        urls: List[str],
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+        ):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *urls, "--engine", engine, "--adaptive",
+        "--adaptive-max", "8", "--output", str(tmp_path / "stats.json"),
+        "--adaptive-log", str(tmp_path / "adaptive.jsonl"),
+        ])
+    # Small windows, so that the scan adjusts the limit
+    monkeypatch.setattr(cli, "AdaptiveConcurrency", partial(
+        AdaptiveConcurrency, interval=0, min_samples=1
+        ))
+    main()
+
+    out: str = capsys.readouterr().out
+    assert "- concurrency peak:" in out
+    steps: List[Dict[str, Any]] = [
+        json.loads(line)
+        for line in (tmp_path / "adaptive.jsonl").read_text().splitlines()
+    ]
+    assert steps
+    assert all(1 <= step["limit"] <= 8 for step in steps)
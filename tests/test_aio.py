@@ -0,0 +1,122 @@
+import asyncio
+import socket
+from typing import Any, Dict
+
+from nyfitsa.aio import (AsyncClient, _parse_head,
+                         fetch_single_site_infos_async, fetching_urls_async)
+from nyfitsa.nyfitsa import (ErrorCode, Results, ScanSummary,
+                             fetch_single_site_infos)
+from nyfitsa.session import SessionPool
+
+from .conftest import LocalServer
+
+
+def _fetch(url: str, timeout: float = 10) -> Dict[str, Any]:
+    return asyncio.run(
+        fetch_single_site_infos_async(url, AsyncClient(timeout))
+        )
+
+
+def _unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestParseHead():
+    def test_parse_head_folds_repeated_headers(self):
+        raw = (
+            b"HTTP/1.1 200 OK\r\n"
+            b"Server: nginx\r\n"
+            b"X-Frame-Options: DENY\r\n"
+            b"x-frame-options: SAMEORIGIN\r\n\r\n"
+        )
+        status_code, headers = _parse_head(raw)
+
+        assert status_code == 200
+        assert headers["server"] == "nginx"
+        assert headers["X-Frame-Options"] == "DENY, SAMEORIGIN"
+
+
+class TestFetchSingleSiteInfosAsync():
+    def test_same_output_as_threaded_fetch(self, local_server: LocalServer):
+        url: str = local_server.url("/ok")
+        expected_result: Dict[str, Any] = fetch_single_site_infos(url)
+
+        assert _fetch(url) == expected_result
+
+    def test_keep_headers(self, local_server: LocalServer):
+        result: Dict[str, Any] = asyncio.run(fetch_single_site_infos_async(
+            local_server.url("/ok"), AsyncClient(keep_headers=True)
+            ))
+
+        assert result["raw_headers"]["Server"] == "nginx/1.18.1"
+        assert "raw_headers" not in _fetch(local_server.url("/ok"))
+
+    def test_follows_redirects(self, local_server: LocalServer):
+        result = _fetch(local_server.url("/redirect"))
+
+        assert result["url"] == local_server.url("/redirect")
+        assert result["x_frame_options"] == "DENY"
+        assert result["err_code"] is None
+
+    def test_http_error(self, local_server: LocalServer):
+        expected_result: Dict[str, Any] = {
+            "url": local_server.url("/error"),
+            "err_code": ErrorCode.HTTP_ERROR,
+            "status_code": 500,
+        }
+        assert _fetch(local_server.url("/error")) == expected_result
+
+    def test_timeout(self, local_server: LocalServer):
+        result = _fetch(local_server.url("/slow"), timeout=0.2)
+
+        assert result["err_code"] == ErrorCode.TIMEOUT
+
+    def test_connection_error(self):
+        url: str = f"http://127.0.0.1:{_unused_port()}/"
+
+        assert _fetch(url)["err_code"] == ErrorCode.CONNECTION_ERROR
+
+    def test_invalid_url(self):
+        assert _fetch("www.example.com")["err_code"] == \
+            ErrorCode.CONNECTION_ERROR
+
+
+def test_fetching_urls_async(local_server: LocalServer):
+    urls = [local_server.url(path) for path in ("/ok", "/bare", "/error")]
+
+    results: Results = fetching_urls_async(urls * 10, concurrency=4)
+    server_stats, server_version_stats = results.stats_server()
+
+    assert len(results.site_infos) == 30
+    assert server_stats == {
+        "nginx": 33.33, "Apache": 33.33, "http_error": 33.33
+        }
+    assert server_version_stats["nginx"] == {"1.18.1": 100.0}
+
+
+def test_head_mode_falls_back_to_get(local_server: LocalServer):
+    summary = ScanSummary()
+    result = asyncio.run(fetch_single_site_infos_async(
+        local_server.url("/no-head"), AsyncClient(summary=summary), "head"
+        ))
+
+    assert local_server.requests == [
+        ("HEAD", "/no-head"), ("GET", "/no-head")
+        ]
+    assert result["x_frame_options"] == "DENY"
+    assert summary.get("bytes_saved") == 1024
+
+
+def test_fetching_urls_async_reuses_connections(local_server: LocalServer):
+    session = SessionPool(pool_maxsize=2)
+    urls = [local_server.url("/ok")] * 20
+
+    results: Results = fetching_urls_async(
+        urls, concurrency=2, session=session
+        )
+
+    assert results.stats_x_frames_options() == {"DENY": 100.0}
+    assert session.hits + session.misses == 20
+    assert session.misses <= 2
@@ -0,0 +1,69 @@
+from typing import Any, Dict, List
+
+from benchmarks.bench import BenchConfig, percentile, run_benchmark
+from benchmarks.farm import FarmConfig, site_behaviour
+from benchmarks.memory import MemoryConfig, run_memory_benchmark
+
+
+def test_farm_is_reproducible():
+    config = FarmConfig(reset_rate=0.2, error_rate=0.2)
+    first = [site_behaviour(config, f"/site/{i}") for i in range(50)]
+
+    assert first == [site_behaviour(config, f"/site/{i}") for i in range(50)]
+    assert {kind for kind, _, _ in first} == {"ok", "reset", "error"}
+    assert first != [
+        site_behaviour(FarmConfig(reset_rate=0.2, error_rate=0.2, seed=1),
+                       f"/site/{i}")
+        for i in range(50)
+        ]
+
+
+def test_percentile():
+    values: List[float] = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 51.0
+    assert percentile(values, 99) == 100.0
+    assert percentile([], 50) == 0.0
+
+
+def test_run_benchmark(tmp_path):
+    config = BenchConfig(
+        urls=60,
+        threads=[4],
+        concurrency=[20],
+        timeout=0.5,
+        output=tmp_path / "benchmark.json",
+        farm=FarmConfig(latency=0.001, jitter=0.0, reset_rate=0.05,
+                        error_rate=0.1, timeout_rate=0.05, hang=3.0),
+        )
+
+    report: Dict[str, Any] = run_benchmark(config)
+
+    runs: List[Dict[str, Any]] = report["runs"]
+    assert [(run["engine"], run["workers"]) for run in runs] == [
+        ("threads", 4), ("async", 20)
+        ]
+    for run in runs:
+        assert run["urls_per_sec"] > 0
+        assert run["p99_ms"] >= run["p50_ms"] > 0
+        assert run["peak_rss_mb"] > 0
+    # Same farm, same failures whatever the engine
+    assert runs[0]["errors"] == runs[1]["errors"]
+    assert runs[0]["errors"]["http_error"] > 0
+    # Both engines time out the hanging sites after `timeout`
+    assert runs[0]["errors"]["timeout"] > 0
+
+
+def test_memory_benchmark(tmp_path):
+    config = MemoryConfig(
+        counts=[20, 40],
+        workers=4,
+        output=tmp_path / "memory.json",
+        farm=FarmConfig(latency=0.001, jitter=0.0),
+        )
+
+    report: Dict[str, Any] = run_memory_benchmark(config)
+
+    assert [run["urls"] for run in report["runs"]] == [20, 40]
+    for run in report["runs"]:
+        assert run["peak_rss_mb"] >= run["baseline_rss_mb"] > 0
+        assert run["bytes_per_url"] >= 0
@@ -0,0 +1,232 @@
+import multiprocessing
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from nyfitsa.aio import fetching_urls_async
+from nyfitsa.cache import HeaderCache
+from nyfitsa.nyfitsa import ScanSummary, fetch_single_site_infos
+
+from .conftest import LocalServer
+
+
+def put_entries(path: Path, prefix: str, count: int) -> None:
+    cache = HeaderCache(path, ttl=60)
+    for index in range(count):
+        url: str = f"http://{prefix}-{index}.test"
+        cache.lookup(url)
+        cache.put(url, {"server": prefix})
+    cache.close()
+
+
+class TestHeaderCache():
+    def test_fresh_entry_skips_network(
+            self,
+            tmp_path: Path,
+            local_server: LocalServer,
+            ):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=60)
+        url: str = local_server.url("/ok")
+
+        first = fetch_single_site_infos(url, cache=cache)
+        second = fetch_single_site_infos(url, cache=cache)
+
+        assert local_server.requests == [("GET", "/ok")]
+        assert second["x_frame_options"] == first["x_frame_options"] == "DENY"
+        assert second["server_version"] == "1.18.1"
+        assert second["err_code"] is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_expired_entry_is_refetched(
+            self,
+            tmp_path: Path,
+            local_server: LocalServer,
+            ):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=0)
+        url: str = local_server.url("/ok")
+
+        fetch_single_site_infos(url, cache=cache)
+        fetch_single_site_infos(url, cache=cache)
+
+        assert len(local_server.requests) == 2
+        assert cache.hits == 0
+
+    def test_errors_are_not_cached(
+            self,
+            tmp_path: Path,
+            local_server: LocalServer,
+            ):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=60)
+        url: str = local_server.url("/error")
+
+        fetch_single_site_infos(url, cache=cache)
+        fetch_single_site_infos(url, cache=cache)
+
+        assert len(local_server.requests) == 2
+
+    def test_persists_across_runs(self, tmp_path: Path):
+        path: Path = tmp_path / "cache.sqlite"
+        cache = HeaderCache(path, ttl=60)
+        cache.put("http://a.test", {"server": "nginx"})
+        cache.close()
+
+        cache = HeaderCache(path, ttl=60)
+
+        assert cache.get("http://a.test") == {"server": "nginx"}
+
+    def test_eviction_drops_oldest(self, tmp_path: Path):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=60, max_entries=10)
+        for i in range(15):
+            cache.put(f"http://{i}.test", {"server": str(i)})
+
+        assert cache.get("http://0.test") is None
+        assert cache.get("http://14.test") == {"server": "14"}
+        assert cache._size <= 10
+
+    def test_writes_do_not_hold_the_database(
+            self,
+            tmp_path: Path,
+            monkeypatch: pytest.MonkeyPatch,
+            ):
+        path: Path = tmp_path / "cache.sqlite"
+        first = HeaderCache(path, ttl=60)
+        monkeypatch.setattr(HeaderCache, "BUSY_TIMEOUT", 0)
+        second = HeaderCache(path, ttl=60)
+
+        first.put("http://a.test", {"server": "a"})
+        # Written while the first cache is still open, without waiting
+        second.put("http://b.test", {"server": "b"})
+
+        assert first.get("http://b.test") == {"server": "b"}
+        assert second.get("http://a.test") == {"server": "a"}
+
+    def test_shared_by_processes(self, tmp_path: Path):
+        path: Path = tmp_path / "cache.sqlite"
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=put_entries, args=(path, prefix, 300))
+            for prefix in ("a", "b", "c")
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert [worker.exitcode for worker in workers] == [0, 0, 0]
+        cache = HeaderCache(path, ttl=60)
+        assert cache._size == 900
+        assert cache.get("http://c-299.test") == {"server": "c"}
+
+    def test_report(self, tmp_path: Path):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=60)
+        summary = ScanSummary()
+        cache.put("http://a.test", {"server": "nginx"})
+        for url in ("http://a.test", "http://a.test", "http://b.test"):
+            cache.get(url)
+
+        cache.report(summary)
+
+        assert summary.get("cache_hits") == 2
+        assert summary.get("cache_misses") == 1
+        assert summary.get("cache_hit_ratio") == pytest.approx(0.6667)
+
+    def test_async_engine(self, tmp_path: Path, local_server: LocalServer):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=60)
+        cache.put(local_server.url("/bare"), {"server": "cached"})
+        url: str = local_server.url("/ok")
+
+        results = fetching_urls_async([url, local_server.url("/bare")],
+                                      cache=cache)
+
+        assert local_server.requests == [("GET", "/ok")]
+        assert sorted(site.server for site in results.site_infos) == [
+            "cached", "nginx"
+            ]
+
+
+class TestRevalidation():
+    def test_not_modified_reuses_cached_headers(
+            self,
+            tmp_path: Path,
+            local_server: LocalServer,
+            ):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=0)
+        url: str = local_server.url("/etag")
+
+        fetch_single_site_infos(url, cache=cache)
+        entry = cache.lookup(url)
+        result = fetch_single_site_infos(url, cache=cache)
+
+        assert entry is not None
+        assert entry.etag == '"v1"'
+        assert entry.last_modified == "Mon, 05 Oct 2026 10:00:00 GMT"
+        assert local_server.not_modified == 1
+        assert result["x_frame_options"] == "DENY"
+        assert result["server_version"] == "1.18.1"
+        assert result["err_code"] is None
+        assert cache.revalidated == 1
+
+    def test_changed_headers_are_stored(
+            self,
+            tmp_path: Path,
+            local_server: LocalServer,
+            ):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=0)
+        url: str = local_server.url("/etag")
+        fetch_single_site_infos(url, cache=cache)
+        local_server.routes["/etag"] = (
+            200, {"Server": "Apache", "ETag": '"v2"'}, 0.0
+            )
+
+        result = fetch_single_site_infos(url, cache=cache)
+        entry = cache.lookup(url)
+
+        assert local_server.not_modified == 0
+        assert result["server"] == "Apache"
+        assert entry is not None
+        assert entry.etag == '"v2"'
+        assert entry.headers["server"] == "Apache"
+
+    def test_head_mode(self, tmp_path: Path, local_server: LocalServer):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=0)
+        url: str = local_server.url("/etag")
+
+        fetch_single_site_infos(url, "head", cache=cache)
+        result = fetch_single_site_infos(url, "head", cache=cache)
+
+        assert local_server.not_modified == 1
+        assert result["server"] == "nginx"
+
+    def test_async_engine(self, tmp_path: Path, local_server: LocalServer):
+        cache = HeaderCache(tmp_path / "cache.sqlite", ttl=0)
+        url: str = local_server.url("/etag")
+
+        fetching_urls_async([url], cache=cache)
+        results = fetching_urls_async([url], cache=cache)
+
+        assert local_server.not_modified == 1
+        assert results.site_infos[0].x_content_type_options == "nosniff"
+        assert cache.revalidated == 1
+
+    def test_upgrades_old_cache(self, tmp_path: Path):
+        path: Path = tmp_path / "cache.sqlite"
+        db = sqlite3.connect(path)
+        db.execute(
+            "CREATE TABLE headers (url TEXT PRIMARY KEY, "
+            "fetched_at REAL NOT NULL, headers TEXT NOT NULL)"
+            )
+        db.execute(
+            "INSERT INTO headers VALUES ('http://a.test', 0, '{}')"
+            )
+        db.commit()
+        db.close()
+
+        cache = HeaderCache(path, ttl=60)
+        cache.put("http://b.test", {}, etag='"v1"')
+
+        assert cache.lookup("http://a.test") == (
+            {}, False, None, None
+            )
+        entry = cache.lookup("http://b.test")
+        assert entry is not None and entry.etag == '"v1"'
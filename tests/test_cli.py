@@ -0,0 +1,93 @@
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.cli import main
+
+from .conftest import LocalServer
+
+
+def run_cli(monkeypatch: MonkeyPatch, *args: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["nyfitsa", *args])
+    main()
+
+
+class TestResume():
+    def test_resume_skips_journaled_urls(
+            self,
+            tmp_path: Path,
+            monkeypatch: MonkeyPatch,
+            capsys: CaptureFixture[str],
+            local_server: LocalServer,
+            ):
+        urls: List[str] = [
+            local_server.url(path) for path in ("/ok", "/bare", "/error")
+            ]
+        journal: Path = tmp_path / "journal.jsonl"
+        # A first run killed after /ok, while it was writing /bare
+        journal.write_text(
+            json.dumps({"url": urls[0], "server": "nginx",
+                        "server_version": "1.18.1"})
+            + '\n{"url": "' + urls[1]
+            )
+
+        run_cli(
+            monkeypatch, "--urls", *urls, "--journal", str(journal),
+            "--resume", "--stats-server",
+            "--output", str(tmp_path / "stats.json"),
+            )
+
+        assert sorted(local_server.requests) == [
+            ("GET", "/bare"), ("GET", "/error")
+            ]
+        journaled: List[str] = [
+            json.loads(line)["url"]
+            for line in journal.read_text().splitlines()
+            ]
+        assert sorted(journaled) == sorted(urls)
+        out: str = capsys.readouterr().out
+        assert "- nginx: 33.33%" in out
+        assert "- resumed sites: 1" in out
+
+    def test_resume_stream_output(
+            self,
+            tmp_path: Path,
+            monkeypatch: MonkeyPatch,
+            local_server: LocalServer,
+            ):
+        output: Path = tmp_path / "stats.jsonl"
+        urls: List[str] = [local_server.url("/ok"), local_server.url("/bare")]
+
+        run_cli(monkeypatch, "--urls", urls[0], "--stream",
+                "--output", str(output))
+        run_cli(monkeypatch, "--urls", *urls, "--stream", "--resume",
+                "--output", str(output))
+
+        assert local_server.requests == [("GET", "/ok"), ("GET", "/bare")]
+        assert len(output.read_text().splitlines()) == 2
+
+
+class TestProcesses():
+    def test_sharded_scan(
+            self,
+            tmp_path: Path,
+            monkeypatch: MonkeyPatch,
+            capsys: CaptureFixture[str],
+            local_server: LocalServer,
+            ):
+        urls: List[str] = [
+            local_server.url(path) for path in ("/ok", "/bare", "/error")
+            ]
+        output: Path = tmp_path / "stats.json"
+
+        run_cli(monkeypatch, "--urls", *urls, "--processes", "2",
+                "--stats-server", "--output", str(output))
+
+        sites = json.loads(output.read_text())["site_infos"]
+        assert sorted(site["url"] for site in sites) == sorted(urls)
+        out: str = capsys.readouterr().out
+        assert "- nginx: 33.33%" in out
+        assert "- pool misses:" in out
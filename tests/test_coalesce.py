@@ -0,0 +1,123 @@
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.cli import main
+from nyfitsa.coalesce import OriginCoalescer, origin_of
+from nyfitsa.nyfitsa import ErrorCode, Results, SiteStore
+
+from .conftest import SECURE_HEADERS, LocalServer
+
+OK: Dict[str, Any] = {"server": "nginx", "err_code": None}
+TIMEOUT: Dict[str, Any] = {"err_code": ErrorCode.TIMEOUT}
+
+
+def test_origin_of():
+    assert origin_of("https://Example.com/a") == "https://example.com:443"
+    assert origin_of("http://example.com:8080/") == "http://example.com:8080"
+    assert origin_of("http://example.com:bad/") is None
+    assert origin_of("example") is None
+
+
+class TestOriginCoalescer():
+    def test_samples_are_attributed(self):
+        coalescer = OriginCoalescer(sample=1)
+        results: List[Dict[str, Any]] = []
+        on_result = coalescer.wrap(results.append)
+
+        urls: Iterator[str] = coalescer.coalesce([
+            "http://a.com/1", "http://a.com/2", "http://b.com/1",
+            "http://a.com/3",
+            ])
+        assert next(urls) == "http://a.com/1"
+        # Waits for the sample of a.com
+        assert next(urls) == "http://b.com/1"
+        on_result({"url": "http://a.com/1"} | OK)
+        assert [result["url"] for result in results] == [
+            "http://a.com/1", "http://a.com/2",
+        ]
+        # Inferred as soon as it is read
+        assert list(urls) == []
+
+        assert [result.get("inferred") for result in results] == [
+            None, True, True,
+        ]
+        assert results[2] == {
+            "url": "http://a.com/3", "inferred": True,
+        } | OK
+        assert (coalescer.fetched, coalescer.inferred) == (2, 2)
+
+    def test_failed_samples(self):
+        coalescer = OriginCoalescer(sample=2)
+        results: List[Dict[str, Any]] = []
+        on_result = coalescer.wrap(results.append)
+
+        urls: List[str] = list(coalescer.coalesce(
+            [f"http://a.com/{index}" for index in range(4)]
+            ))
+        assert urls == ["http://a.com/0", "http://a.com/1"]
+        on_result({"url": urls[0]} | TIMEOUT)
+        assert len(results) == 1
+        # The second sample succeeds
+        on_result({"url": urls[1]} | OK)
+
+        assert [result["err_code"] for result in results] == [
+            ErrorCode.TIMEOUT, None, None, None,
+        ]
+
+    def test_all_samples_failed(self):
+        coalescer = OriginCoalescer(sample=1)
+        results: List[Dict[str, Any]] = []
+        on_result = coalescer.wrap(results.append)
+
+        urls: List[str] = list(coalescer.coalesce(
+            ["http://a.com/0", "http://a.com/1"]
+            ))
+        on_result({"url": urls[0]} | TIMEOUT)
+
+        assert results[1] == {
+            "url": "http://a.com/1", "inferred": True,
+        } | TIMEOUT
+
+
+def test_inferred_sites_are_stored():
+    store = SiteStore([
+        {"url": "http://a.com/1"},
+        {"url": "http://a.com/2", "inferred": True},
+        ])
+    rows: List[Dict[str, Any]] = list(store.rows())
+    copy = SiteStore()
+    copy.extend_rows(rows)
+
+    assert [row["inferred"] for row in rows] == [False, True]
+    assert [site.inferred for site in copy] == [False, True]
+    assert '"inferred":true' in Results(site_infos=store).model_dump_json()
+
+
+def test_cli_coalesce(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    paths: List[str] = [f"/page-{index}" for index in range(5)]
+    for path in paths:
+        local_server.routes[path] = (200, SECURE_HEADERS, 0.0)
+    output: Path = tmp_path / "stats.jsonl"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *map(local_server.url, paths),
+        "--coalesce", "1", "--stream", "--output", str(output),
+        ])
+    main()
+
+    out: str = capsys.readouterr().out
+    sites: List[Dict[str, Any]] = [
+        json.loads(line) for line in output.read_text().splitlines()
+    ]
+    assert len(local_server.requests) == 1
+    assert [site["inferred"] for site in sites] == [False] + [True] * 4
+    assert {site["server"] for site in sites} == {"nginx"}
+    assert "- coalesced inferred: 4" in out
@@ -0,0 +1,149 @@
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+from pytest import MonkeyPatch
+
+from nyfitsa.cli import main
+from nyfitsa.columnar import COLUMNAR_V1_MAGIC, ColumnarFile, ColumnarSink
+from nyfitsa.nyfitsa import ErrorCode, Results, SiteInfos
+from nyfitsa.offline import iter_rows
+
+from .conftest import LocalServer
+
+SITES: List[SiteInfos] = [
+    SiteInfos(url="http://a.test", server="nginx",
+              server_version="1.18.1", x_frame_options="DENY"),
+    SiteInfos(url="http://b.test/é", server="Apache",
+              referrer_policy="no-referrer"),
+    SiteInfos(url="http://c.test", err_code=ErrorCode.TIMEOUT),
+    SiteInfos(url="http://d.test", server="nginx",
+              xss_protection="unavailable", inferred=True),
+    SiteInfos(url="http://e.test", err_code=ErrorCode.HTTP_ERROR),
+]
+
+
+def write_sites(path: Path, sites: List[SiteInfos], chunk_rows: int) -> None:
+    with ColumnarSink(path, chunk_rows=chunk_rows) as sink:
+        for site in sites:
+            sink.write(site)
+
+
+class TestColumnar():
+    @pytest.mark.parametrize("chunk_rows", [1, 2, 1000])
+    def test_round_trip(self, tmp_path: Path, chunk_rows: int):
+        path: Path = tmp_path / "sites.nyfc"
+        write_sites(path, SITES, chunk_rows)
+
+        with ColumnarFile(path) as columnar:
+            assert len(columnar) == len(SITES)
+            assert list(columnar) == SITES
+
+    @pytest.mark.parametrize("chunk_rows", [2, 1000])
+    def test_aggregate_matches_results(self, tmp_path: Path, chunk_rows: int):
+        path: Path = tmp_path / "sites.nyfc"
+        write_sites(path, SITES * 10, chunk_rows)
+        results = Results(site_infos=SITES * 10)
+
+        with ColumnarFile(path) as columnar:
+            aggregator = columnar.aggregate()
+
+        assert aggregator.total == 50
+        for field in ("server", "server_version", "x_frame_options",
+                      "referrer_policy", "xss_protection"):
+            assert aggregator.stats(field) == \
+                results.aggregator.stats(field)
+
+    def test_truncated_chunk_is_ignored(self, tmp_path: Path):
+        path: Path = tmp_path / "sites.nyfc"
+        write_sites(path, SITES, 2)
+        # Killed while writing the last chunk
+        path.write_bytes(path.read_bytes()[:-3])
+
+        with ColumnarFile(path) as columnar:
+            assert list(columnar) == SITES[:4]
+            assert columnar.aggregate().total == 4
+
+    def test_write_line(self, tmp_path: Path):
+        path: Path = tmp_path / "sites.nyfc"
+        with ColumnarSink(path) as sink:
+            for site in SITES:
+                sink.write_line(site.model_dump_json())
+
+        with ColumnarFile(path) as columnar:
+            assert columnar.results().site_infos == SITES
+
+    def test_rows_keep_inferred(self, tmp_path: Path):
+        path: Path = tmp_path / "sites.nyfc"
+        write_sites(path, SITES, 2)
+
+        assert [row["inferred"] for row in iter_rows(path)] == [
+            site.inferred for site in SITES
+            ]
+
+    def test_files_without_inferred(self, tmp_path: Path):
+        path: Path = tmp_path / "sites.nyfc"
+        sites: List[SiteInfos] = [site for site in SITES if not site.inferred]
+        write_sites(path, sites, 1)
+        # Chunks of one site: the flag is where the padding of a file
+        # written before the inferred column is
+        path.write_bytes(COLUMNAR_V1_MAGIC + path.read_bytes()[8:])
+
+        with ColumnarFile(path) as columnar:
+            assert list(columnar) == sites
+        assert [row["url"] for row in iter_rows(path)] == [
+            site.url for site in sites
+            ]
+
+    def test_not_columnar(self, tmp_path: Path):
+        path: Path = tmp_path / "stats.json"
+        path.write_text("{}")
+
+        with pytest.raises(ValueError):
+            ColumnarFile(path)
+
+
+class TestJsonExports():
+    def test_to_json_matches_model_dump(self, tmp_path: Path):
+        results = Results(site_infos=SITES)
+        results.to_json(str(tmp_path / "stats.json"))
+
+        assert (tmp_path / "stats.json").read_text(encoding="utf-8") == \
+            results.model_dump_json()
+
+    def test_to_ndjson(self, tmp_path: Path):
+        Results(site_infos=SITES).to_ndjson(str(tmp_path / "stats.jsonl"))
+
+        lines: List[str] = (
+            tmp_path / "stats.jsonl"
+            ).read_text(encoding="utf-8").splitlines()
+        assert [SiteInfos.model_validate_json(line) for line in lines] == \
+            SITES
+
+
+def test_cli_columnar_export(
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        local_server: LocalServer,
+        ):
+    urls: List[str] = [
+        local_server.url(path) for path in ("/ok", "/bare", "/error")
+        ]
+    columnar: Path = tmp_path / "sites.nyfc"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *urls, "--stream", "--processes", "2",
+        "--output", str(tmp_path / "stats.jsonl"),
+        "--columnar", str(columnar),
+        ])
+    main()
+
+    streamed: List[SiteInfos] = [
+        SiteInfos.model_validate_json(line)
+        for line in (tmp_path / "stats.jsonl").read_text().splitlines()
+    ]
+    with ColumnarFile(columnar) as exported:
+        assert sorted(exported, key=str) == sorted(streamed, key=str)
+        assert exported.aggregate().stats("server") == pytest.approx({
+            "nginx": 33.33, "Apache": 33.33, "http_error": 33.33,
+            }, abs=0.01)
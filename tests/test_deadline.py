@@ -0,0 +1,198 @@
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.cli import main
+from nyfitsa.nyfitsa import (ErrorCode, ScanSummary, Timeouts,
+                             fetch_single_site_infos, scan_urls_concurrently)
+from nyfitsa.retry import RetryPolicy
+from nyfitsa.scheduler import (DeadlineScheduler, HostScheduler,
+                               InputScheduler, RetryScheduler)
+
+from .conftest import SECURE_HEADERS, LocalServer
+
+TIMEOUT: Dict[str, Any] = {"err_code": ErrorCode.TIMEOUT}
+
+
+def err_codes(results: List[Dict[str, Any]]) -> List[ErrorCode | None]:
+    return [result["err_code"] for result in results]
+
+
+def test_timeouts():
+    assert Timeouts(2, 5).longest == 7
+    assert Timeouts(2, 5, 3).longest == 3
+    assert Timeouts(2, 5, 3).connect_read == (2, 3)
+
+
+class TestDeadlineScheduler():
+    def test_stops_one_margin_before_the_deadline(self):
+        scheduler = DeadlineScheduler(InputScheduler("abc"), 10, margin=2)
+
+        assert scheduler.next_ready(7) == ("a", None)
+        assert not scheduler.expired
+        assert scheduler.next_ready(8) == (None, None)
+        assert scheduler.expired and scheduler.done
+        assert list(scheduler.drain()) == [("b", None), ("c", None)]
+
+    def test_wakes_up_at_the_cutoff(self):
+        scheduler = DeadlineScheduler(
+            HostScheduler(["http://a.test/1", "http://a.test/2"],
+                          per_host_concurrency=1),
+            10, margin=2,
+            )
+
+        assert scheduler.next_ready(0)[0] == "http://a.test/1"
+        assert scheduler.next_ready(1) == (None, 7)
+        assert list(scheduler.drain()) == [("http://a.test/2", None)]
+
+    def test_retries_stop_first(self):
+        scheduler = DeadlineScheduler(
+            RetryScheduler(InputScheduler(["a", "b"]), RetryPolicy()),
+            10, margin=2,
+            )
+
+        assert scheduler.next_ready(0) == ("a", None)
+        scheduler.release("a", 1)
+        assert scheduler.retry("a", TIMEOUT, 1)
+        assert scheduler.next_ready(1) == ("b", None)
+        scheduler.release("b", 6)
+        # Less than two margins left, the failure is kept
+        assert not scheduler.retry("b", TIMEOUT, 6)
+        assert scheduler.next_ready(8) == (None, None)
+        # Still waiting for its retry, with its last result
+        assert list(scheduler.drain()) == [("a", TIMEOUT)]
+
+
+def test_total_timeout(local_server: LocalServer):
+    start: float = time.perf_counter()
+    result: Dict[str, Any] = fetch_single_site_infos(
+        local_server.url("/slow"), timeouts=Timeouts(1, 5, 0.2)
+        )
+
+    assert result["err_code"] == ErrorCode.TIMEOUT
+    assert time.perf_counter() - start < 1
+
+
+def test_async_total_timeout(local_server: LocalServer):
+    results: List[Dict[str, Any]] = []
+    start: float = time.perf_counter()
+
+    scan_urls_async(
+        [local_server.url("/slow")],
+        results.append,
+        timeout=Timeouts(1, 5, 0.2),
+        )
+
+    assert err_codes(results) == [ErrorCode.TIMEOUT]
+    assert time.perf_counter() - start < 1
+
+
+@pytest.fixture
+def pausing(local_server: LocalServer) -> List[str]:
+    local_server.routes["/pause"] = (200, SECURE_HEADERS, 0.3)
+    return [local_server.url("/pause")] * 5
+
+
+def test_threads_engine_deadline(pausing: List[str]):
+    results: List[Dict[str, Any]] = []
+    summary = ScanSummary()
+
+    scan_urls_concurrently(
+        pausing,
+        results.append,
+        summary=summary,
+        workers=1,
+        timeouts=Timeouts(0.5, 0.5, 0.5),
+        deadline=time.monotonic() + 1,
+        )
+
+    # Fetched one after the other: the queued urls are cancelled once less
+    # than the longest request is left, the one started still ends
+    assert err_codes(results).count(None) == 3
+    assert err_codes(results).count(ErrorCode.SKIPPED) == 2
+    assert summary.get("skipped") == 2
+
+
+def test_async_engine_deadline(pausing: List[str]):
+    results: List[Dict[str, Any]] = []
+    start: float = time.monotonic()
+
+    scan_urls_async(
+        pausing,
+        results.append,
+        concurrency=1,
+        timeout=Timeouts(0.5, 0.5, 0.5),
+        deadline=start + 1,
+        )
+
+    assert err_codes(results) == [None, None] + [ErrorCode.SKIPPED] * 3
+    assert time.monotonic() - start < 1
+
+
+def test_cli_deadline(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    output: Path = tmp_path / "stats.jsonl"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", local_server.url("/ok"),
+        local_server.url("/bare"), "--deadline", "0", "--stream",
+        "--output", str(output),
+        ])
+    main()
+
+    assert "- skipped: 2" in capsys.readouterr().out
+    assert [
+        json.loads(line)["err_code"]
+        for line in output.read_text().splitlines()
+        ] == ["skipped", "skipped"]
+    assert not local_server.requests
+
+
+def test_cli_resume_fetches_skipped_urls(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    output: Path = tmp_path / "stats.jsonl"
+    urls: List[str] = [local_server.url("/ok"), local_server.url("/bare")]
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *urls, "--deadline", "0", "--stream",
+        "--output", str(output),
+        ])
+    main()
+    capsys.readouterr()
+
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *urls, "--stream", "--resume",
+        "--output", str(output), "--stats-server",
+        ])
+    main()
+
+    out: str = capsys.readouterr().out
+    assert "- resumed sites: 0" in out
+    assert "skipped" not in out
+    assert len(local_server.requests) == 2
+    assert [
+        json.loads(line)["err_code"]
+        for line in output.read_text().splitlines()
+        ] == [None, None]
+
+
+def test_cli_deadline_needs_fetches(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", "http://a.test", "--deadline", "60",
+        "--listen", "127.0.0.1:0",
+        ])
+
+    with pytest.raises(SystemExit, match="--listen"):
+        main()
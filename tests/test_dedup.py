@@ -0,0 +1,143 @@
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.cli import main
+from nyfitsa.dedup import BloomFilter, UrlDeduplicator, normalize_url
+
+from .conftest import LocalServer
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("example.com", "http://example.com/"),
+    ("  HTTPS://WWW.Example.COM  ", "https://www.example.com/"),
+    ("http://example.com:80/a?b=1#top", "http://example.com/a?b=1"),
+    ("https://example.com:8443", "https://example.com:8443/"),
+    ("http://User@Example.com/", "http://User@example.com/"),
+    ("http://[::1]:80/", "http://[::1]/"),
+    ("http://example.com:bad/", "http://example.com:bad/"),
+])
+def test_normalize_url(url: str, expected: str):
+    assert normalize_url(url) == expected
+
+
+def test_deduplicate():
+    dedup = UrlDeduplicator()
+
+    urls: List[str] = list(dedup.deduplicate([
+        "example.com", "http://EXAMPLE.com/", "https://example.com",
+        "http://example.com/page/", "http://example.com/page",
+        "http://example.com/page?q=1",
+        ]))
+
+    assert urls == [
+        "http://example.com/", "https://example.com/",
+        "http://example.com/page/", "http://example.com/page?q=1",
+    ]
+    assert (dedup.unique, dedup.duplicates) == (4, 2)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, error_rate=0.01)
+
+    added: List[bool] = [bloom.add(f"url-{index}") for index in range(1000)]
+
+    assert added.count(True) < 30
+    assert all(bloom.add(f"url-{index}") for index in range(1000))
+
+
+@pytest.mark.parametrize("error_rate", [0, 1, 1.5, -0.1])
+def test_bloom_filter_error_rate(error_rate: float):
+    with pytest.raises(ValueError, match="error rate"):
+        BloomFilter(1000, error_rate)
+
+
+def test_deduplicate_with_a_bloom_filter():
+    dedup = UrlDeduplicator(bloom_capacity=100)
+
+    urls: List[str] = list(dedup.deduplicate(["a.com", "A.com", "b.com"]))
+
+    assert urls == ["http://a.com/", "http://b.com/"]
+    assert dedup.duplicates == 1
+
+
+def test_cli_dedup(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    url: str = local_server.url("/ok")
+    urls_file: Path = tmp_path / "urls.txt"
+    urls_file.write_text(f"{url}\n{url}#top\n{url.upper()}\n")
+    output: Path = tmp_path / "stats.jsonl"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--file", str(urls_file), "--stream",
+        "--output", str(output),
+        ])
+    main()
+
+    assert "- duplicates removed: 1" in capsys.readouterr().out
+    # The path is case-sensitive
+    assert sorted(
+        json.loads(line)["url"] for line in output.read_text().splitlines()
+        ) == [local_server.url("/OK"), url]
+    assert len(local_server.requests) == 2
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_cli_unparsable_urls(
+        engine: str,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        ):
+    urls: List[str] = [
+        "http://[::1", "http://exa mple.com/", "http://a..b/", "http:///",
+    ]
+    urls_file: Path = tmp_path / "urls.txt"
+    urls_file.write_text("\n".join(urls) + "\n")
+    output: Path = tmp_path / "stats.jsonl"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--file", str(urls_file), "--stream", "--engine", engine,
+        "--output", str(output),
+        ])
+    main()
+
+    # Reported as errors rather than failing the scan
+    sites = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(sites) == len(urls)
+    assert {site["err_code"] for site in sites} <= {
+        "connection_error", "dns_error"
+    }
+
+
+def test_cli_dedup_error_rate(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", "http://example.com", "--dedup-bloom", "10",
+        "--dedup-error-rate", "0",
+        ])
+    with pytest.raises(SystemExit, match="--dedup-error-rate"):
+        main()
+
+
+def test_cli_resume_matches_dedup_keys(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        ):
+    output: Path = tmp_path / "stats.jsonl"
+    url: str = local_server.url("/ok")
+    output.write_text(json.dumps({"url": url + "/", "server": "nginx"}) + "\n")
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", url, local_server.url("/bare"), "--stream",
+        "--resume", "--output", str(output),
+        ])
+    main()
+
+    # The trailing-slash variant of a journaled url is not fetched again
+    assert local_server.requests == [("GET", "/bare")]
+    assert len(output.read_text().splitlines()) == 2
@@ -0,0 +1,129 @@
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.cli import main
+from nyfitsa.columnar import ColumnarSink
+from nyfitsa.diff import DiffReport, diff_scans
+from nyfitsa.nyfitsa import ErrorCode, Results, SiteInfos
+
+OLD: List[SiteInfos] = [
+    SiteInfos(url="http://a.test", server="nginx", server_version="1.18.0",
+              x_frame_options="SAMEORIGIN"),
+    SiteInfos(url="http://b.test", server="Apache",
+              x_frame_options="SAMEORIGIN", referrer_policy="no-referrer"),
+    SiteInfos(url="http://c.test", server="nginx"),
+    SiteInfos(url="http://gone.test", server="nginx"),
+    SiteInfos(url="http://down.test", err_code=ErrorCode.TIMEOUT),
+]
+NEW: List[SiteInfos] = [
+    SiteInfos(url="http://a.test", server="nginx", server_version="1.20.1",
+              x_frame_options="DENY"),
+    SiteInfos(url="http://b.test", server="Apache",
+              x_frame_options="DENY", referrer_policy="no-referrer"),
+    SiteInfos(url="http://c.test", server="nginx"),
+    SiteInfos(url="http://new.test", server="cloudflare"),
+    SiteInfos(url="http://down.test", server="nginx"),
+]
+
+
+@pytest.fixture(params=["json", "ndjson", "columnar"])
+def scans(request: pytest.FixtureRequest, tmp_path: Path) -> List[Path]:
+    paths: List[Path] = []
+    for name, sites in (("old", OLD), ("new", NEW)):
+        path: Path = tmp_path / f"{name}.{request.param}"
+        if request.param == "json":
+            Results(site_infos=sites).to_json(str(path))
+        elif request.param == "ndjson":
+            Results(site_infos=sites).to_ndjson(str(path))
+        else:
+            with ColumnarSink(path) as sink:
+                for site in sites:
+                    sink.write(site)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("partitions", [1, 3])
+def test_diff_scans(scans: List[Path], partitions: int, tmp_path: Path):
+    records: List[Dict[str, Any]] = []
+    report: DiffReport = diff_scans(
+        *scans, records.append, partitions=partitions, workdir=tmp_path
+        )
+
+    assert (report.added, report.removed, report.changed,
+            report.unchanged) == (1, 1, 3, 1)
+    assert report.changes["x_frame_options"] == 2
+    # A site back from a timeout moves in every stats table
+    assert report.top_transitions("x_frame_options") == [
+        (("SAMEORIGIN", "DENY"), 2), (("timeout", "unavailable"), 1)
+        ]
+    assert report.transitions["server"][("timeout", "nginx")] == 1
+    assert report.transitions["server"][("nginx", "nginx")] == 2
+    assert report.top_transitions("err_code") == [(("timeout", "ok"), 1)]
+    assert {"url": "http://a.test", "change": "changed",
+            "field": "server_version", "old": "1.18.0",
+            "new": "1.20.1"} in records
+    assert {"url": "http://new.test", "change": "added"} in records
+    assert {"url": "http://gone.test", "change": "removed"} in records
+    assert not [record for record in records
+                if record["url"] == "http://c.test"]
+    # The partitions are removed once joined
+    assert list(tmp_path.glob("tmp*/*")) == []
+
+
+def test_duplicate_urls(tmp_path: Path):
+    old: Path = tmp_path / "old.jsonl"
+    new: Path = tmp_path / "new.jsonl"
+    Results(site_infos=OLD[:1] * 2).to_ndjson(str(old))
+    Results(site_infos=NEW[:1] * 3).to_ndjson(str(new))
+
+    report: DiffReport = diff_scans(old, new)
+
+    assert (report.added, report.removed, report.changed) == (0, 0, 1)
+
+
+def test_urls_spelled_differently(tmp_path: Path):
+    # A scan made without deduplication against a normalized one
+    old: Path = tmp_path / "old.jsonl"
+    new: Path = tmp_path / "new.jsonl"
+    Results(site_infos=[
+        SiteInfos(url="HTTP://A.test", server="nginx"),
+        SiteInfos(url="b.test#top", server="Apache"),
+        ]).to_ndjson(str(old))
+    Results(site_infos=[
+        SiteInfos(url="http://a.test/", server="nginx"),
+        SiteInfos(url="http://b.test/", server="nginx"),
+        ]).to_ndjson(str(new))
+    records: List[Dict[str, Any]] = []
+
+    report: DiffReport = diff_scans(old, new, records.append)
+
+    assert (report.added, report.removed, report.changed,
+            report.unchanged) == (0, 0, 1, 1)
+    assert records == [{"url": "http://b.test/", "change": "changed",
+                        "field": "server", "old": "Apache", "new": "nginx"}]
+
+
+def test_cli_diff(
+        scans: List[Path],
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    output: Path = tmp_path / "changes.jsonl"
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--diff", *map(str, scans), "--output", str(output),
+        ])
+    main()
+
+    out: str = capsys.readouterr().out
+    assert "- SAMEORIGIN → DENY: 2" in out
+    changes: List[Dict[str, Any]] = [
+        json.loads(line) for line in output.read_text().splitlines()
+    ]
+    assert len(changes) == 7
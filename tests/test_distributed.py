@@ -0,0 +1,191 @@
+import json
+import multiprocessing
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List
+
+import pytest
+
+from nyfitsa.cli import NyfitsaConfig, ScanEngine, run_scan
+from nyfitsa.distributed import Coordinator, parse_address, run_worker
+from nyfitsa.nyfitsa import (ErrorCode, HeaderAggregator, ScanSummary,
+                             SiteInfos)
+
+from .conftest import LocalServer
+
+
+def payload(sites: List[SiteInfos]) -> str:
+    aggregator = HeaderAggregator()
+    for site in sites:
+        aggregator.add(site)
+    return json.dumps({
+        "aggregator": aggregator.as_dict(),
+        "counters": {"pool_misses": len(sites)},
+        "sites": [site.model_dump_json() for site in sites],
+    })
+
+
+class TestCoordinator():
+    def test_leases_chunks_until_done(self):
+        lines: List[str] = []
+        coordinator = Coordinator(
+            [f"http://{i}.test" for i in range(5)], lines.append, chunk_size=2
+            )
+
+        leases: List[Dict[str, Any]] = [
+            coordinator.lease("w") for _ in range(4)
+            ]
+        assert [lease["status"] for lease in leases] == [
+            "lease", "lease", "lease", "wait"
+            ]
+        for lease in leases[:3]:
+            assert coordinator.complete(lease["id"], payload(
+                [SiteInfos(url=url, server="nginx") for url in lease["urls"]]
+                ))
+
+        assert coordinator.lease("w") == {"status": "done"}
+        assert coordinator.finished.is_set()
+        assert coordinator.aggregator.total == 5
+        assert coordinator.summary.get("pool_misses") == 5
+        assert len(lines) == 5
+
+    def test_expired_lease_is_requeued(self):
+        coordinator = Coordinator(
+            ["http://a.test"], chunk_size=1, lease_timeout=0.05
+            )
+        lost: Dict[str, Any] = coordinator.lease("dead")
+        time.sleep(0.1)
+
+        again: Dict[str, Any] = coordinator.lease("alive")
+        sites: List[SiteInfos] = [SiteInfos(url="http://a.test")]
+
+        assert again["urls"] == ["http://a.test"]
+        assert not coordinator.complete(lost["id"], payload(sites))
+        assert coordinator.complete(again["id"], payload(sites))
+        assert coordinator.aggregator.total == 1
+        assert coordinator.summary.get("requeued_leases") == 1
+
+    def test_renew_keeps_lease(self):
+        coordinator = Coordinator(
+            ["http://a.test"], chunk_size=1, lease_timeout=0.2
+            )
+        lease: Dict[str, Any] = coordinator.lease("w")
+        for _ in range(3):
+            time.sleep(0.1)
+            assert coordinator.renew(lease["id"])
+
+        assert coordinator.lease("other") == {"status": "wait"}
+
+    def test_released_lease_is_leased_first(self):
+        coordinator = Coordinator(
+            [f"http://{i}.test" for i in range(4)], chunk_size=2
+            )
+        first: Dict[str, Any] = coordinator.lease("late")
+
+        assert coordinator.release(first["id"])
+        assert not coordinator.release(first["id"])
+        assert coordinator.lease("w")["urls"] == first["urls"]
+        assert coordinator.summary.get("requeued_leases") == 0
+
+    def test_aggregator_round_trip(self):
+        aggregator = HeaderAggregator()
+        aggregator.add(SiteInfos(url="http://a.test", server="Apache"))
+
+        copy = HeaderAggregator.from_dict(
+            json.loads(json.dumps(aggregator.as_dict()))
+            )
+
+        assert copy.total == 1
+        assert copy.server_versions == {"Apache": {None: 1}}
+        assert copy.stats_server() == aggregator.stats_server()
+
+
+def test_parse_address():
+    assert parse_address("10.0.0.1:8765") == ("10.0.0.1", 8765)
+    assert parse_address(":8765") == ("127.0.0.1", 8765)
+
+
+def test_local_workers(local_server: LocalServer):
+    urls: List[str] = [
+        local_server.url(path) for path in ("/ok", "/bare", "/error")
+        ] * 20
+    lines: List[str] = []
+    coordinator = Coordinator(
+        urls, lines.append, chunk_size=8, lease_timeout=1.0
+        )
+    server = coordinator.serve("127.0.0.1", 0)
+    address: str = f"127.0.0.1:{server.server_address[1]}"
+    # A worker that dies right after leasing its first chunk
+    coordinator.lease("dead")
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(address, partial(run_scan, NyfitsaConfig())),
+            )
+        for _ in range(2)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        assert coordinator.finished.wait(30)
+    finally:
+        for process in processes:
+            process.join(10)
+        server.shutdown()
+        server.server_close()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert coordinator.aggregator.total == 60
+    assert coordinator.summary.get("requeued_leases") == 1
+    assert sorted(SiteInfos.model_validate_json(line).url
+                  for line in lines) == sorted(urls)
+    assert coordinator.aggregator.stats("server") == pytest.approx({
+        "nginx": 33.33, "Apache": 33.33, "http_error": 33.33,
+        }, abs=0.01)
+
+
+def skip_all(urls: Iterable[str], on_result: Callable[..., None],
+             summary: ScanSummary) -> None:
+    for url in urls:
+        on_result({"url": url, "err_code": ErrorCode.SKIPPED})
+
+
+def test_worker_past_deadline(local_server: LocalServer):
+    urls: List[str] = [local_server.url("/ok")] * 4
+    coordinator = Coordinator(urls, chunk_size=2)
+    server = coordinator.serve("127.0.0.1", 0)
+    address: str = f"127.0.0.1:{server.server_address[1]}"
+    try:
+        # Past its deadline, a worker leases nothing
+        assert run_worker(address, skip_all, time.time() - 1) == 0
+        lease: Dict[str, Any] = coordinator.lease("w")
+        assert lease["urls"] == urls[:2]
+        coordinator.release(lease["id"])
+        # A chunk skipped whole at the deadline goes back to the coordinator
+        assert run_worker(address, skip_all, time.time() + 60) == 0
+        assert run_worker(
+            address, partial(run_scan, NyfitsaConfig())
+            ) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert coordinator.aggregator.total == 4
+    assert coordinator.aggregator.stats("server") == {"nginx": 100.0}
+
+
+def test_engine_kept_across_chunks(local_server: LocalServer):
+    summaries: List[ScanSummary] = [ScanSummary(), ScanSummary()]
+    with ScanEngine(NyfitsaConfig(adaptive=True, dns_cache=True)) as engine:
+        for summary in summaries:
+            engine([local_server.url("/ok")], lambda result: None, summary)
+
+    # The second chunk reuses the connection and the address of the first
+    assert [summary.get("pool_misses") for summary in summaries] == [1, 0]
+    assert [summary.get("pool_hits") for summary in summaries] == [0, 1]
+    assert [summary.get("dns_lookups") for summary in summaries] == [1, 0]
+    # Gauges are the values of the engine, not added up
+    assert summaries[1].get("concurrency_peak") == \
+        summaries[0].get("concurrency_peak") > 0
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import sys
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.aio import AsyncClient, fetch_single_site_infos_async
+from nyfitsa.cli import main
+from nyfitsa.metrics import Histogram, MetricsExporter, ScanMetrics
+from nyfitsa.nyfitsa import ErrorCode, fetch_single_site_infos
+from nyfitsa.resolver import ResolverCache
+from nyfitsa.session import SessionPool
+
+from .conftest import LocalServer
+
+
+def phase_counts(metrics: ScanMetrics) -> Dict[str, int]:
+    return {
+        phase: histogram.count
+        for phase, histogram in metrics.phases.items() if histogram.count
+    }
+
+
+class TestHistogram():
+    def test_quantiles(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.record(0.001)
+        for _ in range(10):
+            histogram.record(1.0)
+
+        assert histogram.quantile(0.5) == pytest.approx(0.0016, rel=0.1)
+        assert histogram.quantile(0.99) == 1.0
+        assert histogram.as_dict()["count"] == 100
+        assert histogram.as_dict()["mean_ms"] == pytest.approx(100.9)
+        assert histogram.as_dict()["max_ms"] == 1000.0
+
+    def test_slower_than_the_last_bucket(self):
+        histogram = Histogram()
+        histogram.record(120.0)
+
+        assert histogram.counts[-1] == 1
+        assert histogram.quantile(0.5) == 120.0
+
+    def test_empty(self):
+        assert Histogram().as_dict()["p99_ms"] == 0.0
+
+
+def test_counters():
+    metrics = ScanMetrics()
+    for err_code in (None, None, ErrorCode.TIMEOUT):
+        metrics.start()
+        metrics.finish(err_code, 0.01)
+    metrics.start()
+
+    snapshot: Dict[str, Any] = metrics.snapshot()
+
+    assert snapshot["in_flight"] == 1
+    assert snapshot["completed"] == 3
+    assert snapshot["errors"] == {"ok": 2, "timeout": 1}
+    assert snapshot["phases"]["total"]["count"] == 3
+
+
+def test_threads_engine(local_server: LocalServer):
+    metrics = ScanMetrics()
+    session = SessionPool(metrics=metrics)
+
+    for _ in range(2):
+        fetch_single_site_infos(local_server.url("/ok"), session=session)
+    fetch_single_site_infos(local_server.url("/missing"), session=session)
+
+    # One connection, reused by the next requests
+    assert phase_counts(metrics) == {
+        "connect": 1, "first_byte": 3, "body": 3, "parse": 2, "total": 3,
+    }
+    assert metrics.errors == {"ok": 2, "http_error": 1}
+
+
+def test_threads_engine_with_dns_cache(local_server: LocalServer):
+    metrics = ScanMetrics()
+    session = SessionPool(resolver=ResolverCache(), metrics=metrics)
+
+    fetch_single_site_infos(
+        local_server.url("/ok").replace("127.0.0.1", "localhost"),
+        session=session,
+        )
+
+    assert phase_counts(metrics)["dns"] == 1
+
+
+def test_async_engine(local_server: LocalServer):
+    metrics = ScanMetrics()
+    client = AsyncClient(session=SessionPool(metrics=metrics))
+
+    async def fetch_all() -> None:
+        for _ in range(2):
+            await fetch_single_site_infos_async(
+                local_server.url("/ok"), client
+                )
+
+    asyncio.run(fetch_all())
+
+    assert phase_counts(metrics) == {
+        "connect": 1, "first_byte": 2, "body": 2, "parse": 2, "total": 2,
+    }
+    assert metrics.completed == 2
+    assert metrics.in_flight == 0
+
+
+def test_exporter(tmp_path: Path):
+    metrics = ScanMetrics()
+    metrics.start()
+    path: Path = tmp_path / "metrics.json"
+
+    with MetricsExporter(
+            metrics, path, ("127.0.0.1", 0), interval=0.05) as exporter:
+        with urllib.request.urlopen(
+                f"http://127.0.0.1:{exporter.port}/metrics") as response:
+            served: Dict[str, Any] = json.load(response)
+        metrics.finish(None, 0.1)
+
+    assert served["in_flight"] == 1
+    assert json.loads(path.read_text())["completed"] == 1
+
+
+def test_cli_metrics(
+        local_server: LocalServer,
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", local_server.url("/ok"),
+        "--output", str(tmp_path / "stats.json"),
+        "--metrics-file", str(tmp_path / "metrics.json"),
+        ])
+    main()
+
+    assert "Timings (ms)" in capsys.readouterr().out
+    assert json.loads(
+        (tmp_path / "metrics.json").read_text()
+        )["errors"] == {"ok": 1}
+
+
+def test_cli_metrics_need_one_process(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", "http://a.test", "--metrics",
+        "--processes", "2",
+        ])
+
+    with pytest.raises(SystemExit, match="--processes"):
+        main()
@@ -5,10 +5,13 @@ from unittest.mock import MagicMock, patch
 import requests
 from pytest import CaptureFixture
 
-from nyfitsa.nyfitsa import (ErrorCode, Results, SiteInfos, fetch_headers,
+from nyfitsa.nyfitsa import (ErrorCode, HeaderAggregator, Results,
+                             ScanSummary, SiteInfos, SiteStore, fetch_headers,
                              fetch_single_site_infos, get_server_version,
                              get_server_version_number)
 
+from .conftest import LocalServer
+
 
 class Test_FetchHeaders():
     def test_fetch_headers_all_present(self):
@@ -313,13 +316,42 @@ class TestFetchSingleSiteInfos():
             "x_content_type_options": "test",
             "referrer_policy": "test",
             "xss_protection": "test",
-            "response": mock_response,
             "err_code": None
         }
 
         result = fetch_single_site_infos(self.url)
         assert expected_result == result
 
+    def test_fetch_single_site_infos_keep_headers(
+            self,
+            local_server: LocalServer,
+            ):
+        url: str = local_server.url("/ok")
+
+        lean: Dict[str, Any] = fetch_single_site_infos(url)
+        debug: Dict[str, Any] = fetch_single_site_infos(
+            url, keep_headers=True
+            )
+
+        # Only the parsed fields, nothing holds on to the response
+        assert all(isinstance(value, (str, type(None), ErrorCode))
+                   for value in lean.values())
+        assert debug["raw_headers"]["X-Frame-Options"] == "DENY"
+        assert debug["raw_headers"]["Content-Length"] == "1024"
+
+    def test_site_store_keeps_raw_headers(self):
+        store = SiteStore([
+            {"url": "http://a.com"},
+            {"url": "http://b.com", "raw_headers": {"Server": "nginx"}},
+            ])
+        copy = SiteStore()
+        copy.extend_rows(list(store.rows()))
+
+        assert [site.raw_headers for site in copy] == [
+            None, {"Server": "nginx"},
+        ]
+        assert list(copy.raw_headers) == [1]
+
 
 class TestPrintStats():
     mock_response = MagicMock()
@@ -473,3 +505,247 @@ def test_calculate_percentage_empty_list():
     percentage = results._caclulate_percentage({})  # type: ignore
 
     assert percentage == {}
+
+
+class TestFetchHeadMode():
+    def test_head_mode_skips_body(self, local_server: LocalServer):
+        summary = ScanSummary()
+        url: str = local_server.url("/ok")
+
+        result = fetch_single_site_infos(url, "head", summary)
+
+        assert local_server.requests == [("HEAD", "/ok")]
+        assert result["x_frame_options"] == "DENY"
+        assert result["err_code"] is None
+        assert summary.get("bytes_saved") == 1024
+
+    def test_head_rejected_falls_back_to_get(
+            self,
+            local_server: LocalServer
+            ):
+        summary = ScanSummary()
+        url: str = local_server.url("/no-head")
+
+        result = fetch_single_site_infos(url, "head", summary)
+
+        assert local_server.requests == [
+            ("HEAD", "/no-head"), ("GET", "/no-head")
+            ]
+        assert result["server"] == "nginx"
+        assert result["server_version"] == "1.18.1"
+        assert summary.get("bytes_saved") == 1024
+
+    def test_head_mode_http_error(self, local_server: LocalServer):
+        result = fetch_single_site_infos(local_server.url("/error"), "head")
+
+        assert result == {
+            "url": local_server.url("/error"),
+            "err_code": ErrorCode.HTTP_ERROR,
+            "status_code": 500,
+        }
+
+
+def test_scan_summary_print(capsys: CaptureFixture[str]):
+    summary = ScanSummary()
+    summary.print_summary()
+    summary.add("bytes_saved", 512)
+    summary.add("bytes_saved", 512)
+    expected_print: str = (
+        "\n" + "=" * 50 + "\nRun summary\n" + "=" * 50
+        + "\n- bytes saved: 1024\n" + "=" * 50 + "\n\n"
+        )
+
+    summary.print_summary()
+
+    assert capsys.readouterr().out == expected_print
+
+
+def test_scan_summary_merge_keeps_highest_gauges():
+    summary = ScanSummary()
+    for limit in (40, 64, 32):
+        summary.merge({"concurrency_peak": limit, "pool_misses": 2})
+
+    assert summary.get("concurrency_peak") == 64
+    assert summary.get("pool_misses") == 6
+
+
+class TestHeaderAggregator():
+    sites = [
+        SiteInfos(
+            url="http://a.com", server="nginx", server_version="1.18.1",
+            x_frame_options="DENY", x_content_type_options="nosniff",
+            referrer_policy="no-referrer", xss_protection="0",
+        ),
+        SiteInfos(
+            url="http://b.com", server="nginx", server_version="1.20.0",
+            x_frame_options="unavailable", x_content_type_options="nosniff",
+            referrer_policy="unavailable", xss_protection="unavailable",
+        ),
+        SiteInfos(
+            url="http://c.com", server="Apache", server_version=None,
+            x_frame_options="SAMEORIGIN",
+        ),
+        SiteInfos(url="http://d.com", err_code=ErrorCode.TIMEOUT),
+        SiteInfos(url="http://e.com", err_code=ErrorCode.HTTP_ERROR),
+    ]
+
+    def test_same_stats_as_results(self):
+        aggregator = HeaderAggregator()
+        for site in self.sites:
+            aggregator.add(site)
+        results: Results = Results(site_infos=self.sites)
+
+        assert aggregator.total == 5
+        assert aggregator.stats_server() == results.stats_server()
+        assert aggregator.stats("x_frame_options") == \
+            results.stats_x_frames_options()
+        assert aggregator.stats("x_content_type_options") == \
+            results.stats_x_content_type_options()
+        assert aggregator.stats("referrer_policy") == \
+            results.stats_referrer_policy()
+        assert aggregator.stats("xss_protection") == \
+            results.stats_xss_protection()
+
+    def test_same_print_as_results(self, capsys: CaptureFixture[str]):
+        aggregator = HeaderAggregator()
+        for site in self.sites:
+            aggregator.add(site)
+        results: Results = Results(site_infos=self.sites)
+
+        for stat_type in ("server", "x_frame_options", "server_version"):
+            results.print_stats(stat_type)  # type: ignore[arg-type]
+            expected_print: str = capsys.readouterr().out
+            aggregator.print_stats(stat_type)  # type: ignore[arg-type]
+            assert capsys.readouterr().out == expected_print
+
+    def test_merge(self):
+        merged = HeaderAggregator()
+        for shard_sites in (self.sites[:2], self.sites[2:]):
+            shard = HeaderAggregator()
+            for site in shard_sites:
+                shard.add(site)
+            merged.merge(shard)
+        results: Results = Results(site_infos=self.sites)
+
+        assert merged.total == 5
+        assert merged.stats_server() == results.stats_server()
+        assert merged.stats("xss_protection") == \
+            results.stats_xss_protection()
+
+
+class TestResultsAggregator():
+    def test_stats_are_computed_once(self):
+        results: Results = Results(site_infos=TestHeaderAggregator.sites)
+
+        with patch.object(
+            SiteStore, "aggregate", autospec=True,
+            side_effect=SiteStore.aggregate
+        ) as mock_aggregate:
+            results.stats_server()
+            results.stats_server()
+            results.print_stats("x_frame_options")
+
+        assert mock_aggregate.call_count == 1
+
+    def test_add_site_updates_stats(self):
+        results: Results = Results(site_infos=[])
+        results.add_site({"url": "http://a.com", "server": "nginx",
+                          "server_version": "1.18.1"})
+        assert results.stats_server() == (
+            {"nginx": 100.0}, {"nginx": {"1.18.1": 100.0}}
+            )
+
+        results.add_site(SiteInfos(url="http://b.com",
+                                   err_code=ErrorCode.TIMEOUT))
+
+        assert len(results.site_infos) == 2
+        assert results.stats_server()[0] == {"nginx": 50.0, "timeout": 50.0}
+        assert results.stats_server_version() == {
+            "1.18.1": 50.0, "timeout": 50.0
+            }
+
+    def test_sites_appended_directly_are_counted(self):
+        results: Results = Results(site_infos=[])
+        assert results.stats_referrer_policy() == {}
+
+        results.site_infos.append(SiteInfos(url="http://a.com",
+                                            referrer_policy="no-referrer"))
+
+        assert results.stats_referrer_policy() == {"no-referrer": 100.0}
+
+    def test_equality_ignores_the_cached_stats(self):
+        results: Results = Results(site_infos=TestHeaderAggregator.sites)
+        other: Results = Results(site_infos=TestHeaderAggregator.sites)
+
+        results.stats_server()
+
+        assert results == other
+        assert results != Results(site_infos=[])
+
+
+class TestSiteStore():
+    def test_round_trip(self):
+        store = SiteStore(TestHeaderAggregator.sites)
+
+        assert len(store) == 5
+        assert list(store) == TestHeaderAggregator.sites
+        assert store[-1] == TestHeaderAggregator.sites[-1]
+        assert store[1:3] == TestHeaderAggregator.sites[1:3]
+
+    def test_values_are_stored_once(self):
+        store = SiteStore(
+            SiteInfos(url=f"http://{i}.com", server="nginx",
+                      x_frame_options="unavailable")
+            for i in range(1000)
+            )
+
+        assert store.values["server"] == [None, "nginx"]
+        assert store.values["x_frame_options"] == [None, "unavailable"]
+        assert store.columns["server"].itemsize == 4
+
+    def test_aggregate_matches_aggregator(self):
+        store = SiteStore(TestHeaderAggregator.sites)
+        aggregator = HeaderAggregator()
+        for site in TestHeaderAggregator.sites[2:]:
+            aggregator.add(site)
+
+        tail: HeaderAggregator = store.aggregate(2)
+
+        assert tail.total == 3
+        assert tail.counters == aggregator.counters
+        assert tail.server_versions == aggregator.server_versions
+
+    def test_results_json_format(self):
+        results: Results = Results(site_infos=TestHeaderAggregator.sites)
+
+        restored: Results = Results.model_validate_json(
+            results.model_dump_json()
+            )
+
+        assert restored.site_infos == TestHeaderAggregator.sites
+        assert '"err_code":"timeout"' in results.model_dump_json()
+
+    def test_results_python_dump(self):
+        results: Results = Results(site_infos=TestHeaderAggregator.sites)
+
+        assert results.model_dump() == {
+            "site_infos": [
+                site.model_dump() for site in TestHeaderAggregator.sites
+            ],
+        }
+        assert ErrorCode.TIMEOUT in [
+            site["err_code"] for site in results.model_dump()["site_infos"]
+        ]
+
+    def test_results_json_schema(self):
+        sites: Dict[str, Any] = {
+            "items": {"$ref": "#/$defs/SiteInfos"}, "type": "array",
+        }
+
+        for mode in ("validation", "serialization"):
+            schema: Dict[str, Any] = Results.model_json_schema(
+                mode=mode  # type: ignore[arg-type]
+                )
+            assert schema["properties"]["site_infos"] == \
+                {"title": "Site Infos"} | sites
+            assert "SiteInfos" in schema["$defs"]
@@ -0,0 +1,191 @@
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.cli import main
+from nyfitsa.columnar import ColumnarSink
+from nyfitsa.nyfitsa import ErrorCode, Results, SiteInfos
+from nyfitsa import offline
+from nyfitsa.offline import (ERROR_FILTERS, ScanFilter, iter_rows, load_scan,
+                             offline_stats, tld_of)
+
+SITES: List[SiteInfos] = [
+    SiteInfos(url="http://a.example.com/", server="nginx",
+              server_version="1.18.1", x_frame_options="DENY"),
+    SiteInfos(url="https://b.example.fr:8443/x", server="Apache",
+              x_frame_options="SAMEORIGIN"),
+    SiteInfos(url="http://c.example.com", server="Apache-Coyote",
+              x_frame_options="DENY"),
+    SiteInfos(url="http://d.example.org", err_code=ErrorCode.TIMEOUT),
+    SiteInfos(url="http://e.example.fr", err_code=ErrorCode.HTTP_ERROR),
+]
+
+
+@pytest.fixture(params=["json", "ndjson", "columnar"])
+def scan_file(request: pytest.FixtureRequest, tmp_path: Path) -> Path:
+    path: Path = tmp_path / f"scan.{request.param}"
+    results = Results(site_infos=SITES)
+    if request.param == "json":
+        results.to_json(str(path))
+    elif request.param == "ndjson":
+        results.to_ndjson(str(path))
+    else:
+        with ColumnarSink(path, chunk_rows=2) as sink:
+            for site in SITES:
+                sink.write(site)
+    return path
+
+
+def test_tld_of():
+    assert tld_of("https://b.example.fr:8443/x") == "fr"
+    assert tld_of("http://www.example.com./") == "com"
+    assert tld_of("not a url") == ""
+
+
+def test_load_scan(scan_file: Path):
+    scan = load_scan(scan_file)
+
+    assert len(scan) == len(SITES)
+    assert list(scan) == SITES
+
+
+def test_unfiltered_stats_match_results(scan_file: Path):
+    aggregator, loaded = offline_stats(scan_file)
+    results = Results(site_infos=SITES)
+
+    assert loaded == 5
+    assert aggregator.stats_server() == results.stats_server()
+    assert aggregator.stats("x_frame_options") == \
+        results.stats_x_frames_options()
+
+
+class TestScanFilter():
+    def test_tld(self, scan_file: Path):
+        aggregator, _ = offline_stats(scan_file, ScanFilter(tlds=[".FR"]))
+
+        assert aggregator.total == 2
+        assert aggregator.stats("server") == {"Apache": 50.0,
+                                              "http_error": 50.0}
+
+    def test_error(self, scan_file: Path):
+        aggregator, _ = offline_stats(
+            scan_file, ScanFilter(errors=["timeout", "http_error"])
+            )
+
+        assert aggregator.stats("server") == {"timeout": 50.0,
+                                              "http_error": 50.0}
+
+    def test_server_family_and_error(self, scan_file: Path):
+        aggregator, _ = offline_stats(scan_file, ScanFilter(
+            errors=["ok"], server_families=["apache"]
+            ))
+
+        assert aggregator.total == 2
+        assert aggregator.stats("x_frame_options") == {"SAMEORIGIN": 50.0,
+                                                       "DENY": 50.0}
+
+    def test_all_filters(self, scan_file: Path):
+        aggregator, _ = offline_stats(scan_file, ScanFilter(
+            tlds=["com"], errors=["ok"], server_families=["apache"]
+            ))
+
+        assert aggregator.stats("server") == {"Apache-Coyote": 100.0}
+
+    def test_unknown_error(self):
+        with pytest.raises(ValueError):
+            ScanFilter(errors=["refused"])
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_json_document_is_read_site_by_site(
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        indent: int | None,
+        ):
+    path: Path = tmp_path / "stats.json"
+    results = Results(site_infos=SITES * 40)
+    if indent is None:
+        results.to_json(str(path))
+    else:
+        path.write_text(results.model_dump_json(indent=indent))
+    monkeypatch.setattr(offline, "READ_SIZE", 64)
+    windows: List[int] = []
+    read = offline._JsonReader._read
+
+    def recorded_read(reader: Any) -> bool:
+        windows.append(len(reader._buffer) - reader._position)
+        return read(reader)
+
+    monkeypatch.setattr(offline._JsonReader, "_read", recorded_read)
+
+    rows: List[Dict[str, Any]] = list(iter_rows(path))
+
+    assert rows == list(results.site_infos.rows())
+    # Never more than one site and one read in memory
+    assert max(windows) < 64 + max(map(len, map(str, rows))) * 2
+
+
+def test_empty_json_document(tmp_path: Path):
+    path: Path = tmp_path / "stats.json"
+    Results(site_infos=[]).to_json(str(path))
+
+    assert list(iter_rows(path)) == []
+
+
+def test_invalid_json_document(tmp_path: Path):
+    path: Path = tmp_path / "stats.json"
+    path.write_text('{"site_infos": [{"url": "http://a.test"} {}]}')
+
+    with pytest.raises(ValueError):
+        list(iter_rows(path))
+
+
+def test_truncated_journal(tmp_path: Path):
+    path: Path = tmp_path / "journal.jsonl"
+    path.write_text(
+        "\n".join(site.model_dump_json() for site in SITES[:2])
+        + '\n{"url": "http://cut'
+        )
+
+    assert len(load_scan(path)) == 2
+
+
+def test_cli_offline(
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    path: Path = tmp_path / "stats.json"
+    Results(site_infos=SITES).to_json(str(path))
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--load", str(path), "--tld", "com", "--stats-server",
+        ])
+    main()
+
+    out: str = capsys.readouterr().out
+    assert "2 of 5 sites selected" in out
+    assert "- nginx: 50.00%" in out
+
+
+def test_cli_error_help(
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    monkeypatch.setattr(sys, "argv", ["nyfitsa", "--help"])
+    monkeypatch.setenv("COLUMNS", "200")
+
+    with pytest.raises(SystemExit):
+        main()
+
+    help_text: str = capsys.readouterr().out
+    assert all(error in help_text for error in ERROR_FILTERS)
+
+
+def test_cli_filter_needs_load(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(sys, "argv", ["nyfitsa", "--error", "timeout"])
+
+    with pytest.raises(SystemExit):
+        main()
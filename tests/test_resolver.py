@@ -0,0 +1,174 @@
+import asyncio
+import socket
+import threading
+import time
+from typing import Any, List
+
+import pytest
+import requests
+from pytest import MonkeyPatch
+
+from nyfitsa.aio import AsyncClient, fetch_single_site_infos_async
+from nyfitsa.nyfitsa import ErrorCode, fetch_single_site_infos, is_dns_error
+from nyfitsa.resolver import DnsError, ResolverCache
+from nyfitsa.session import SessionPool
+
+from .conftest import LocalServer
+
+UNRESOLVABLE: str = "http://nyfitsa.invalid/"
+
+
+def count_lookups(monkeypatch: MonkeyPatch, delay: float = 0.0) -> List[str]:
+    hosts: List[str] = []
+    getaddrinfo = socket.getaddrinfo
+
+    def counting(host: str, *args: Any, **kwargs: Any) -> Any:
+        hosts.append(host)
+        time.sleep(delay)
+        return getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", counting)
+    return hosts
+
+
+class TestResolverCache():
+    def test_addresses_are_cached(self, monkeypatch: MonkeyPatch):
+        lookups: List[str] = count_lookups(monkeypatch)
+        resolver = ResolverCache()
+
+        assert resolver.resolve("localhost") == \
+            resolver.resolve("LOCALHOST.")
+        assert "127.0.0.1" in resolver.resolve("localhost")
+        assert lookups == ["localhost"]
+        assert (resolver.hits, resolver.misses) == (2, 1)
+
+    def test_failures_are_cached(self, monkeypatch: MonkeyPatch):
+        lookups: List[str] = count_lookups(monkeypatch)
+        resolver = ResolverCache()
+
+        for _ in range(3):
+            with pytest.raises(DnsError):
+                resolver.resolve("nyfitsa.invalid")
+
+        assert lookups == ["nyfitsa.invalid"]
+        assert resolver.failures == 1
+
+    def test_expired_entries_are_resolved_again(
+            self,
+            monkeypatch: MonkeyPatch,
+            ):
+        lookups: List[str] = count_lookups(monkeypatch)
+        resolver = ResolverCache(ttl=0)
+
+        resolver.resolve("localhost")
+        resolver.resolve("localhost")
+
+        assert len(lookups) == 2
+
+    def test_concurrent_lookups_are_coalesced(
+            self,
+            monkeypatch: MonkeyPatch,
+            ):
+        lookups: List[str] = count_lookups(monkeypatch, delay=0.1)
+        resolver = ResolverCache()
+        threads: List[threading.Thread] = [
+            threading.Thread(target=resolver.resolve, args=("localhost",))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert lookups == ["localhost"]
+
+    def test_oldest_entries_are_evicted(self):
+        resolver = ResolverCache(max_entries=1)
+        resolver.resolve("localhost")
+        resolver.resolve("127.0.0.1")
+
+        resolver.resolve("localhost")
+
+        assert resolver.misses == 3
+
+    def test_prefetch(self, monkeypatch: MonkeyPatch):
+        lookups: List[str] = count_lookups(monkeypatch)
+        resolver = ResolverCache()
+        urls: List[str] = [
+            f"http://localhost/{i}" for i in range(5)
+            ] + [UNRESOLVABLE]
+
+        assert list(resolver.prefetch(urls, window=2)) == urls
+        deadline: float = time.monotonic() + 5
+        while len(lookups) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        resolver.close()
+
+        assert sorted(lookups) == ["localhost", "nyfitsa.invalid"]
+
+    def test_resolve_async(self):
+        resolver = ResolverCache()
+
+        async def resolve() -> List[str]:
+            return await resolver.resolve_async("localhost")
+
+        assert asyncio.run(resolve()) == asyncio.run(resolve())
+        assert (resolver.hits, resolver.misses) == (1, 1)
+
+
+class TestDnsErrors():
+    def test_threads_engine(self):
+        assert fetch_single_site_infos(UNRESOLVABLE)["err_code"] == \
+            ErrorCode.DNS_ERROR
+
+    def test_threads_engine_with_cache(self):
+        session = SessionPool(resolver=ResolverCache())
+
+        for _ in range(2):
+            result = fetch_single_site_infos(UNRESOLVABLE, session=session)
+            assert result["err_code"] == ErrorCode.DNS_ERROR
+        assert session.resolver is not None
+        assert session.resolver.misses == 1
+
+    @pytest.mark.parametrize("resolver", [None, ResolverCache()])
+    def test_async_engine(self, resolver: ResolverCache | None):
+        client = AsyncClient(session=SessionPool(resolver=resolver))
+
+        result = asyncio.run(
+            fetch_single_site_infos_async(UNRESOLVABLE, client)
+            )
+
+        assert result["err_code"] == ErrorCode.DNS_ERROR
+
+    def test_refused_connection_is_not_dns(self):
+        assert not is_dns_error(requests.exceptions.ConnectionError())
+
+
+class TestFetchThroughCache():
+    def url(self, local_server: LocalServer) -> str:
+        return local_server.url("/ok").replace("127.0.0.1", "localhost")
+
+    def test_threads_engine(self, local_server: LocalServer):
+        # No keep-alive, each fetch opens a connection
+        session = SessionPool(pool_maxsize=0, resolver=ResolverCache())
+
+        for _ in range(3):
+            result = fetch_single_site_infos(
+                self.url(local_server), session=session
+                )
+            assert result["x_frame_options"] == "DENY"
+
+        assert session.resolver is not None
+        assert session.resolver.misses == 1
+
+    def test_async_engine(self, local_server: LocalServer):
+        resolver = ResolverCache()
+
+        for _ in range(3):
+            client = AsyncClient(session=SessionPool(resolver=resolver))
+            result = asyncio.run(fetch_single_site_infos_async(
+                self.url(local_server), client
+                ))
+            assert result["x_frame_options"] == "DENY"
+
+        assert (resolver.hits, resolver.misses) == (2, 1)
@@ -0,0 +1,261 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
+
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.cli import main
+from nyfitsa.nyfitsa import (ErrorCode, fetch_single_site_infos,
+                             retry_after, scan_urls_concurrently)
+from nyfitsa.retry import MIN_RETRIES, RetryPolicy
+from nyfitsa.scheduler import HostScheduler, InputScheduler, RetryScheduler
+
+from .conftest import SECURE_HEADERS, LocalServer, Route
+
+TIMEOUT: Dict[str, Any] = {"err_code": ErrorCode.TIMEOUT}
+OK: Dict[str, Any] = {"err_code": None}
+
+
+class FlakyRoutes(Dict[str, Route]):
+    """Routes answering 503 the first times they are asked."""
+
+    def __init__(
+            self,
+            routes: Dict[str, Route],
+            failures: Dict[str, int],
+            ) -> None:
+        super().__init__(routes)
+        self.failures = failures
+
+    def get(self, path: str, default: Any = None) -> Any:
+        if self.failures.get(path):
+            self.failures[path] -= 1
+            return 503, {"Retry-After": "0"}, 0.0
+        return super().get(path, default)
+
+
+def test_retry_after():
+    in_a_minute: datetime = datetime.now(timezone.utc) + timedelta(minutes=1)
+
+    assert retry_after({"Retry-After": "120"}) == 120.0
+    assert retry_after({"Retry-After": format_datetime(in_a_minute)}) == \
+        pytest.approx(60, abs=2)
+    assert retry_after({"Retry-After": "soon"}) is None
+    assert retry_after({}) is None
+
+
+def test_http_errors_keep_their_status(local_server: LocalServer):
+    local_server.routes["/busy"] = (503, {"Retry-After": "7"}, 0.0)
+
+    result: Dict[str, Any] = fetch_single_site_infos(
+        local_server.url("/busy")
+        )
+
+    assert (result["status_code"], result["retry_after"]) == (503, 7.0)
+
+
+class TestRetryPolicy():
+    def test_retryable(self):
+        policy = RetryPolicy()
+
+        assert policy.retryable(TIMEOUT)
+        assert policy.retryable({"err_code": ErrorCode.CONNECTION_ERROR})
+        assert policy.retryable(
+            {"err_code": ErrorCode.HTTP_ERROR, "status_code": 429}
+            )
+        assert not policy.retryable(
+            {"err_code": ErrorCode.HTTP_ERROR, "status_code": 404}
+            )
+        assert not policy.retryable({"err_code": ErrorCode.DNS_ERROR})
+        assert not policy.retryable(OK)
+
+    def test_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+
+        assert policy.schedule("a", TIMEOUT) is not None
+        assert policy.schedule("a", TIMEOUT) is not None
+        assert policy.schedule("a", TIMEOUT) is None
+        assert (policy.retries, policy.exhausted) == (2, 1)
+        # Forgotten once done, a new scan of the url starts over
+        assert policy.schedule("a", TIMEOUT) is not None
+
+    def test_recovered(self):
+        policy = RetryPolicy()
+
+        policy.schedule("a", TIMEOUT)
+        policy.schedule("a", OK)
+        policy.schedule("b", OK)
+
+        assert policy.recovered == 1
+
+    def test_backoff_with_jitter(self):
+        policy = RetryPolicy(max_attempts=10, backoff=1, max_delay=5)
+
+        delays: List[float] = [
+            policy.schedule("a", TIMEOUT) or 0.0 for _ in range(9)
+            ]
+
+        assert all(0 <= delay <= 5 for delay in delays)
+        assert delays[0] <= 1 and delays[1] <= 2
+        assert len(set(delays)) > 1
+
+    def test_retry_after_is_honoured(self):
+        policy = RetryPolicy(max_delay=10)
+        busy: Dict[str, Any] = {
+            "err_code": ErrorCode.HTTP_ERROR, "status_code": 503,
+        }
+
+        assert policy.schedule("a", busy | {"retry_after": 4.0}) == 4.0
+        assert policy.schedule("b", busy | {"retry_after": 60.0}) == 10.0
+
+    def test_budget(self):
+        policy = RetryPolicy(budget=0.1)
+        for index in range(40):
+            policy.schedule(f"ok-{index}", OK)
+
+        scheduled: List[float | None] = [
+            policy.schedule(f"down-{index}", TIMEOUT) for index in range(40)
+            ]
+
+        # 0.1 retry per url fetched, 80 urls fetched
+        assert MIN_RETRIES < policy.retries <= 0.1 * 80 + MIN_RETRIES
+        assert scheduled.count(None) == policy.over_budget == \
+            40 - policy.retries
+
+
+class TestRetryScheduler():
+    def test_retries_wait_their_backoff(self):
+        scheduler = RetryScheduler(
+            InputScheduler(["a", "b"]), RetryPolicy(backoff=2, max_delay=2)
+            )
+
+        assert scheduler.next_ready(0) == ("a", None)
+        scheduler.release("a", 1)
+        assert scheduler.retry("a", TIMEOUT, 1)
+        assert scheduler.next_ready(1) == ("b", None)
+        scheduler.release("b", 1)
+        assert not scheduler.retry("b", OK, 1)
+
+        url, delay = scheduler.next_ready(1)
+        assert url is None and delay is not None and delay <= 2
+        assert not scheduler.done
+        assert scheduler.next_ready(3) == ("a", None)
+        scheduler.release("a", 3)
+        assert scheduler.next_ready(3) == (None, None)
+        assert scheduler.done
+
+    def test_retries_respect_per_host_concurrency(self):
+        scheduler = RetryScheduler(
+            HostScheduler(["http://a.test/1", "http://a.test/2",
+                           "http://b.test/1"], per_host_concurrency=1),
+            RetryPolicy(backoff=0.1, max_delay=0.1),
+            )
+
+        assert scheduler.next_ready(0)[0] == "http://a.test/1"
+        scheduler.release("http://a.test/1", 0)
+        assert scheduler.retry("http://a.test/1", TIMEOUT, 0)
+        assert scheduler.next_ready(0)[0] == "http://b.test/1"
+        assert scheduler.next_ready(0)[0] == "http://a.test/2"
+
+        # Due, but a.test is at its limit until a fetch completes
+        assert scheduler.next_ready(1) == (None, None)
+        scheduler.release("http://a.test/2", 1)
+        assert scheduler.next_ready(1) == ("http://a.test/1", None)
+        assert scheduler.next_ready(1) == (None, None)
+        scheduler.release("http://a.test/1", 1)
+        scheduler.release("http://b.test/1", 1)
+        assert scheduler.next_ready(1) == (None, None)
+        assert scheduler.done
+
+    def test_retries_respect_per_host_rps(self):
+        scheduler = RetryScheduler(
+            HostScheduler(["http://a.test/1"], per_host_rps=1),
+            RetryPolicy(backoff=0.1, max_delay=0.1),
+            )
+
+        assert scheduler.next_ready(0)[0] == "http://a.test/1"
+        scheduler.release("http://a.test/1", 0.1)
+        assert scheduler.retry(
+            "http://a.test/1", {"err_code": ErrorCode.HTTP_ERROR,
+                                "status_code": 429}, 0.1
+            )
+
+        url, delay = scheduler.next_ready(0.5)
+        assert url is None and delay == pytest.approx(0.5)
+        assert scheduler.next_ready(1) == ("http://a.test/1", None)
+
+
+@pytest.fixture
+def flaky(local_server: LocalServer) -> List[str]:
+    paths: List[str] = [f"/{index}" for index in range(5)]
+    local_server.routes = FlakyRoutes(
+        {path: (200, SECURE_HEADERS, 0.0) for path in paths},
+        {path: 2 for path in paths},
+        )
+    return [local_server.url(f"/{index}") for index in range(5)]
+
+
+def test_threads_engine_retries(flaky: List[str]):
+    results: List[Dict[str, Any]] = []
+    policy = RetryPolicy(backoff=0.01)
+
+    scan_urls_concurrently(flaky, results.append, retry=policy)
+
+    assert [result["err_code"] for result in results] == [None] * 5
+    assert (policy.retries, policy.recovered) == (10, 5)
+
+
+def test_async_engine_retries(flaky: List[str]):
+    results: List[Dict[str, Any]] = []
+    policy = RetryPolicy(max_attempts=2, backoff=0.01)
+
+    scan_urls_async(flaky, results.append, concurrency=2, retry=policy)
+
+    # One retry is not enough
+    assert [result["status_code"] for result in results] == [503] * 5
+    assert (policy.retries, policy.exhausted) == (5, 5)
+
+
+def test_waiting_retries_do_not_hold_workers(local_server: LocalServer):
+    local_server.routes = FlakyRoutes({
+        "/flaky": (200, SECURE_HEADERS, 0.0),
+        "/ok": (200, SECURE_HEADERS, 0.05),
+        }, {"/flaky": 1})
+    urls: List[str] = [local_server.url("/flaky")] + [
+        local_server.url("/ok")
+        ] * 10
+    results: List[Dict[str, Any]] = []
+
+    scan_urls_concurrently(
+        urls,
+        results.append,
+        retry=RetryPolicy(backoff=0.3, max_delay=0.3),
+        workers=1,
+        )
+
+    # With a single worker, the next urls are fetched during the backoff
+    assert len(results) == 11
+    assert results[0]["url"] == local_server.url("/ok")
+    assert local_server.url("/flaky") in [result["url"] for result in results]
+
+
+def test_cli_retries(
+        flaky: List[str],
+        tmp_path: Path,
+        monkeypatch: MonkeyPatch,
+        capsys: CaptureFixture[str],
+        ):
+    monkeypatch.setattr(sys, "argv", [
+        "nyfitsa", "--urls", *flaky, "--retries", "2",
+        "--retry-backoff", "0.01", "--retry-statuses", "503",
+        "--output", str(tmp_path / "stats.json"),
+        ])
+    main()
+
+    out: str = capsys.readouterr().out
+    assert "- retries: 10" in out
+    assert "- retries recovered: 5" in out
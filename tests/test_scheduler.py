@@ -0,0 +1,96 @@
+from typing import List
+
+from pytest import approx
+
+from nyfitsa.aio import scan_urls_async
+from nyfitsa.nyfitsa import (Results, fetching_urls_concurrently,
+                             scan_urls_concurrently)
+from nyfitsa.scheduler import HostScheduler, InputScheduler, host_of
+
+from .conftest import LocalServer
+
+SORTED_URLS: List[str] = [
+    "http://a.com/1", "http://a.com/2", "http://a.com/3",
+    "http://b.com/1", "http://b.com/2",
+    "http://c.com/1",
+]
+
+
+def test_host_of():
+    assert host_of("https://WWW.Example.com:8443/path") == "www.example.com"
+    assert host_of("not a url") == ""
+
+
+def test_input_scheduler_keeps_order():
+    scheduler = InputScheduler(SORTED_URLS)
+    issued: List[str] = []
+    while not scheduler.done:
+        url, _ = scheduler.next_ready(0)
+        if url is not None:
+            issued.append(url)
+
+    assert issued == SORTED_URLS
+
+
+class TestHostScheduler():
+    def test_hosts_are_interleaved(self):
+        scheduler = HostScheduler(SORTED_URLS)
+        issued = [scheduler.next_ready(0)[0] for _ in SORTED_URLS]
+
+        assert [host_of(url) for url in issued if url] == [
+            "a.com", "b.com", "c.com", "a.com", "b.com", "a.com"
+            ]
+        assert scheduler.next_ready(0) == (None, None)
+        assert scheduler.done
+
+    def test_per_host_concurrency(self):
+        scheduler = HostScheduler(SORTED_URLS, per_host_concurrency=1)
+        issued = [scheduler.next_ready(0)[0] for _ in range(3)]
+
+        assert issued == ["http://a.com/1", "http://b.com/1", "http://c.com/1"]
+        # Every host is busy: a fetch has to complete first
+        assert scheduler.next_ready(0) == (None, None)
+        assert not scheduler.done
+
+        scheduler.release("http://b.com/1", 0)
+        assert scheduler.next_ready(0) == ("http://b.com/2", None)
+
+    def test_per_host_rps(self):
+        scheduler = HostScheduler(SORTED_URLS[:2], per_host_rps=2)
+
+        assert scheduler.next_ready(10.0) == ("http://a.com/1", None)
+        url, delay = scheduler.next_ready(10.1)
+        assert url is None
+        assert delay == approx(0.4)
+        assert scheduler.next_ready(10.5) == ("http://a.com/2", None)
+
+    def test_window_bounds_read_ahead(self):
+        consumed: List[str] = []
+
+        def urls():
+            for url in SORTED_URLS:
+                consumed.append(url)
+                yield url
+
+        scheduler = HostScheduler(urls(), per_host_concurrency=1, window=2)
+        assert scheduler.next_ready(0) == ("http://a.com/1", None)
+        assert scheduler.next_ready(0) == (None, None)
+        assert len(consumed) == 3
+
+
+def test_fetching_with_host_limits(local_server: LocalServer):
+    urls = [local_server.url("/ok")] * 6 + [local_server.url("/error")]
+
+    results: Results = fetching_urls_concurrently(urls)
+    threaded: Results = Results(site_infos=[])
+    scan_urls_concurrently(
+        urls, threaded.add_site, per_host_concurrency=1, per_host_rps=100,
+        )
+    asynchronous: Results = Results(site_infos=[])
+    scan_urls_async(
+        urls, asynchronous.add_site, per_host_concurrency=1, per_host_rps=100
+        )
+
+    assert len(threaded.site_infos) == len(asynchronous.site_infos) == 7
+    assert threaded.stats_server() == results.stats_server()
+    assert asynchronous.stats_server() == results.stats_server()
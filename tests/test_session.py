@@ -0,0 +1,42 @@
+from nyfitsa.nyfitsa import (ScanSummary, fetch_single_site_infos,
+                             fetching_urls_concurrently)
+from nyfitsa.session import SessionPool
+
+from .conftest import LocalServer
+
+
+class TestSessionPool():
+    def test_connections_are_reused(self, local_server: LocalServer):
+        session = SessionPool()
+        url: str = local_server.url("/ok")
+
+        for _ in range(3):
+            result = fetch_single_site_infos(url, session=session)
+            assert result["x_frame_options"] == "DENY"
+
+        assert session.misses == 1
+        assert session.hits == 2
+
+    def test_head_mode_through_pool(self, local_server: LocalServer):
+        session = SessionPool()
+        url: str = local_server.url("/no-head")
+
+        result = fetch_single_site_infos(url, "head", session=session)
+
+        assert result["server"] == "nginx"
+        assert local_server.requests == [
+            ("HEAD", "/no-head"), ("GET", "/no-head")
+            ]
+        assert session.hits + session.misses == 2
+
+    def test_report(self, local_server: LocalServer):
+        session = SessionPool(pool_maxsize=4, max_connections=4)
+        summary = ScanSummary()
+
+        fetching_urls_concurrently(
+            [local_server.url("/ok")] * 10, session=session
+            )
+        session.report(summary)
+
+        assert summary.get("pool_hits") + summary.get("pool_misses") == 10
+        assert summary.get("pool_hits") >= 6
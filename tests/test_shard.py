@@ -0,0 +1,44 @@
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List
+
+import pytest
+
+from nyfitsa.cli import NyfitsaConfig, run_scan
+from nyfitsa.nyfitsa import ScanSummary, SiteInfos
+from nyfitsa.shard import scan_urls_sharded
+
+from .conftest import LocalServer
+
+
+def failing_scan(
+        urls: Iterable[str],
+        on_result: Callable[[Dict[str, Any]], None],
+        summary: ScanSummary,
+        ) -> None:
+    raise ValueError("boom")
+
+
+class TestShardedScan():
+    def test_merges_shards(self, local_server: LocalServer):
+        urls: List[str] = [
+            local_server.url(path) for path in ("/ok", "/bare", "/error")
+            ] * 200
+        lines: List[str] = []
+        summary = ScanSummary()
+
+        aggregator = scan_urls_sharded(
+            urls, partial(run_scan, NyfitsaConfig()), 2, lines.append, summary
+            )
+
+        assert aggregator.total == 600
+        assert aggregator.stats("server") == pytest.approx({
+            "nginx": 33.33, "Apache": 33.33, "http_error": 33.33,
+            }, abs=0.01)
+        assert sorted(SiteInfos.model_validate_json(line).url
+                      for line in lines) == sorted(urls)
+        assert summary.get("pool_hits") + summary.get("pool_misses") == 600
+        assert len(local_server.requests) == 600
+
+    def test_worker_errors_are_raised(self):
+        with pytest.raises(RuntimeError, match="boom"):
+            scan_urls_sharded(["http://a.test"], failing_scan, 2)
@@ -0,0 +1,45 @@
+import gzip
+import io
+import sys
+from pathlib import Path
+
+from pytest import MonkeyPatch
+
+from nyfitsa.sources import read_urls
+
+URLS: str = "http://a.com\n\n  https://b.com  \nhttp://c.com\n"
+EXPECTED_URLS = ["http://a.com", "https://b.com", "http://c.com"]
+
+
+def test_read_urls_text(tmp_path: Path):
+    path: Path = tmp_path / "urls.txt"
+    path.write_text(URLS)
+
+    assert list(read_urls(path)) == EXPECTED_URLS
+
+
+def test_read_urls_gzip(tmp_path: Path):
+    path: Path = tmp_path / "urls.txt.gz"
+    with gzip.open(path, "wt") as file:
+        file.write(URLS)
+
+    assert list(read_urls(path)) == EXPECTED_URLS
+
+
+def test_read_urls_stdin(monkeypatch: MonkeyPatch):
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(URLS.encode())))
+    monkeypatch.setattr(sys, "stdin", stdin)
+
+    assert list(read_urls("-")) == EXPECTED_URLS
+    assert not stdin.closed
+
+
+def test_read_urls_is_lazy(tmp_path: Path):
+    path: Path = tmp_path / "urls.txt"
+    path.write_text(URLS)
+
+    urls = read_urls(path)
+    assert next(urls) == "http://a.com"
+    path.unlink()
+
+    assert list(urls) == EXPECTED_URLS[1:]
@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+from unittest.mock import patch
+
+from nyfitsa.columnar import ColumnarFile, ColumnarSink
+from nyfitsa.nyfitsa import (ErrorCode, HeaderAggregator, Results, SiteInfos,
+                             scan_urls_concurrently)
+from nyfitsa.stream import (JsonlSink, StreamingPipeline, load_jsonl,
+                            repair_journal)
+
+from .conftest import LocalServer
+
+
+def test_streaming_pipeline(tmp_path: Path, local_server: LocalServer):
+    urls = [local_server.url(path) for path in ("/ok", "/bare", "/error")]
+    output: Path = tmp_path / "stats.jsonl"
+
+    with JsonlSink(output) as sink:
+        pipeline = StreamingPipeline(sink)
+        scan_urls_concurrently(urls * 5, pipeline)
+
+    sites: List[SiteInfos] = list(load_jsonl(output))
+    results: Results = Results(site_infos=sites)
+    assert len(sites) == 15
+    assert pipeline.aggregator.stats_server() == results.stats_server()
+    assert pipeline.aggregator.stats("x_frame_options") == \
+        results.stats_x_frames_options()
+
+
+def test_shard_lines_are_not_validated_again(tmp_path: Path):
+    sites: List[SiteInfos] = [
+        SiteInfos(url=f"http://{index}.test", server="nginx")
+        for index in range(5)
+    ] + [SiteInfos(url="http://down.test", err_code=ErrorCode.TIMEOUT)]
+    shard = HeaderAggregator()
+    for site in sites:
+        shard.add(site)
+    results: Results = Results(site_infos=[])
+    columnar = ColumnarSink(tmp_path / "sites.nyfc")
+    pipeline = StreamingPipeline(columnar, results=results)
+    pipeline.BATCH_ROWS = 4
+
+    with patch.object(SiteInfos, "model_validate_json") as validate:
+        for site in sites:
+            pipeline.add_line(site.model_dump_json())
+        pipeline.merge(shard)
+        pipeline.close()
+
+    validate.assert_not_called()
+    assert results.site_infos == sites
+    assert results.stats_server() == Results(site_infos=sites).stats_server()
+    with ColumnarFile(tmp_path / "sites.nyfc") as exported:
+        assert list(exported) == sites
+
+
+def test_submission_is_bounded(local_server: LocalServer):
+    pulled: List[int] = [0]
+    in_flight: List[int] = []
+
+    def urls() -> Iterator[str]:
+        for _ in range(40):
+            pulled[0] += 1
+            yield local_server.url("/ok")
+
+    def on_result(result: Dict[str, Any]) -> None:
+        in_flight.append(pulled[0] - len(in_flight))
+
+    scan_urls_concurrently(urls(), on_result, max_in_flight=3)
+
+    assert len(in_flight) == 40
+    assert max(in_flight) <= 4
+
+
+def test_repair_journal(tmp_path: Path):
+    journal: Path = tmp_path / "journal.jsonl"
+    complete: str = SiteInfos(url="http://a.com").model_dump_json() + "\n"
+    journal.write_text(complete + '{"url": "http://b.c')
+
+    repair_journal(journal)
+
+    assert journal.read_text() == complete
+    assert [site.url for site in load_jsonl(journal)] == ["http://a.com"]
+
+
+def test_repair_journal_without_complete_line(tmp_path: Path):
+    journal: Path = tmp_path / "journal.jsonl"
+    journal.write_text('{"url": "http://b.c')
+
+    repair_journal(journal)
+
+    assert journal.read_text() == ""